@@ -0,0 +1,285 @@
+#!/usr/bin/env python
+
+# Progressive Cactus Package
+# Copyright (C) 2009-2013 by Glenn Hickey (hickey@soe.ucsc.edu)
+# and Benedict Paten (benedictpaten@gmail.com)
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+import os
+import sys
+import time
+import json
+import random
+import shutil
+import platform
+import subprocess
+from optparse import OptionParser
+
+from processRunner import ProcessRunner
+from runMetrics import diskUsage
+from nodeProfile import readMetrics, formatTime, formatBytes
+from costModel import numCpus, physicalMemory
+
+###############################################################################
+# Run progressive cactus end to end on a set of inputs and record how long
+# each stage took and how much memory and disk it used, so that releases
+# can be compared with each other.  The inputs are the example seqFiles
+# (which need the cactusTestData submodule) and synthetic trees of any
+# size, whose genomes are generated by randomly mutating a random root
+# sequence down a balanced tree.
+#
+# Results are written as json:
+#   { "host" : {...}, "revision" : ..., "cases" : { name : {
+#       "status", "wall", "stages" : { stage : seconds }, "maxRss",
+#       "bytesWritten", "workDirFinalBytes", "halBytes" } } }
+# bytesWritten is everything the run (and every process it waited for)
+# wrote to disk, temporary files included, from the i/o counters of
+# wait4(); workDirFinalBytes is what was left in the workDir at the end.
+# and can be compared against the results of an earlier run with
+# --baseline, in which case we exit with an error if anything got slower or
+# bigger by more than --tolerance.
+###############################################################################
+
+rootDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+examples = ["blanchette00", "evolverMammalsLoci1", "evolverPrimatesLoci1"]
+# the stages recorded in the RunMetrics by progressiveCactus.py
+stages = ["validation", "project", "alignment", "halExport"]
+
+###############################################################################
+# Synthetic inputs
+###############################################################################
+
+# copy of seq with substitutions at the given rate, and about one small
+# insertion or deletion per 100 substitutions
+def mutate(seq, rate, rand):
+    bases = "ACGT"
+    out = []
+    for base in seq:
+        x = rand.random()
+        if x >= rate:
+            out.append(base)
+        elif x < rate / 200.:
+            pass
+        elif x < rate / 100.:
+            out.append(base + "".join([rand.choice(bases) for i in
+                                       xrange(rand.randint(1, 10))]))
+        else:
+            out.append(rand.choice(bases))
+    return "".join(out)
+
+# Write a synthetic seqFile with numLeaves genomes of about numBases each
+# to outDir, and return its path
+def makeSynthetic(outDir, numLeaves, numBases, seed=0, rate=0.02):
+    rand = random.Random(seed)
+    if not os.path.isdir(outDir):
+        os.makedirs(outDir)
+    rootSeq = "".join([rand.choice("ACGT") for i in xrange(numBases)])
+    leaves = []
+    # (sequence, leaf names) -> newick, filling in leaves as we go
+    def build(seq, names):
+        if len(names) == 1:
+            leaves.append((names[0], seq))
+            return names[0]
+        half = len(names) / 2
+        return "(%s:%f,%s:%f)" % (
+            build(mutate(seq, rate, rand), names[:half]), rate,
+            build(mutate(seq, rate, rand), names[half:]), rate)
+    newick = build(rootSeq, ["genome%d" % i for i in xrange(numLeaves)])
+    seqFilePath = os.path.join(outDir, "seqFile.txt")
+    seqFile = open(seqFilePath, "w")
+    seqFile.write("%s;\n\n" % newick)
+    for name, seq in leaves:
+        path = os.path.join(outDir, "%s.fa" % name)
+        faFile = open(path, "w")
+        faFile.write(">%s\n" % name)
+        for i in xrange(0, len(seq), 80):
+            faFile.write(seq[i:i + 80] + "\n")
+        faFile.close()
+        seqFile.write("%s %s\n" % (name, os.path.abspath(path)))
+    seqFile.close()
+    return seqFilePath
+
+###############################################################################
+# Running
+###############################################################################
+
+def runCase(name, seqFilePath, benchDir, extraArgs, runner):
+    workDir = os.path.join(benchDir, name, "work")
+    halPath = os.path.join(benchDir, name, "%s.hal" % name)
+    if os.path.exists(workDir):
+        shutil.rmtree(workDir)
+    os.makedirs(workDir)
+    cmd = [os.path.join(rootDir, "bin", "runProgressiveCactus.sh"),
+           seqFilePath, workDir, halPath] + extraArgs
+    sys.stderr.write("Running %s\n" % name)
+    result = runner.start(cmd, logPath=os.path.join(
+        benchDir, name, "benchmark.log"), cwd=rootDir).wait()
+    stageTimes = dict()
+    for record in readMetrics(workDir):
+        if record["type"] == "stage_end" and record.get("stage") in stages:
+            stageTimes[record["stage"]] = record.get("elapsed")
+    case = { "status" : result.returnCode,
+             "wall" : result.wallTime,
+             "stages" : stageTimes,
+             "maxRss" : result.maxRss,
+             "bytesWritten" : result.writtenBytes,
+             "workDirFinalBytes" : diskUsage(workDir),
+             "halBytes" : None }
+    if os.path.isfile(halPath):
+        case["halBytes"] = os.path.getsize(halPath)
+    return case
+
+def revision():
+    try:
+        return subprocess.Popen(["git", "rev-parse", "HEAD"], cwd=rootDir,
+                                stdout=subprocess.PIPE,
+                                stderr=open(os.devnull, "w")).communicate()[
+            0].strip() or None
+    except OSError:
+        return None
+
+def hostInfo():
+    return { "name" : platform.node(),
+             "cpus" : numCpus(),
+             "memory" : physicalMemory(),
+             "python" : platform.python_version() }
+
+###############################################################################
+# Comparing
+###############################################################################
+
+# (metric name, value) for everything we compare in a case
+def caseMetrics(case):
+    metrics = [("wall", case.get("wall")), ("maxRss", case.get("maxRss")),
+               ("bytesWritten", case.get("bytesWritten")),
+               ("workDirFinalBytes", case.get("workDirFinalBytes"))]
+    for stage in stages:
+        metrics.append(("stage:%s" % stage, case.get("stages", {}).get(stage)))
+    return metrics
+
+def formatMetric(name, value):
+    if value is None:
+        return "-"
+    if name in ["maxRss", "bytesWritten", "workDirFinalBytes"]:
+        return formatBytes(value)
+    return formatTime(value)
+
+# Print how results compare to a baseline.  Returns the number of
+# regressions: metrics that grew by more than tolerance (a fraction), or
+# cases that failed now but not before.
+def compare(results, baseline, tolerance, outFile):
+    regressions = 0
+    rows = [["case", "metric", "baseline", "current", "change"]]
+    for name in sorted(results["cases"].keys()):
+        case = results["cases"][name]
+        oldCase = baseline["cases"].get(name)
+        if oldCase is None:
+            continue
+        if case["status"] != 0 and oldCase["status"] == 0:
+            rows.append([name, "status", "ok", "FAILED", "REGRESSION"])
+            regressions += 1
+            continue
+        oldMetrics = dict(caseMetrics(oldCase))
+        for metric, value in caseMetrics(case):
+            oldValue = oldMetrics.get(metric)
+            if value is None or oldValue is None:
+                continue
+            change = "-"
+            if oldValue > 0:
+                ratio = float(value) / oldValue - 1.
+                change = "%+.1f%%" % (100. * ratio)
+                # (allow for rounding, so +10.0% isn't over a 10% tolerance)
+                if ratio > tolerance + 1e-9:
+                    change += " REGRESSION"
+                    regressions += 1
+            rows.append([name, metric, formatMetric(metric, oldValue),
+                         formatMetric(metric, value), change])
+    widths = [max([len(row[i]) for row in rows]) for i in xrange(len(rows[0]))]
+    for row in rows:
+        outFile.write("  ".join([row[i].ljust(widths[i]) for i in
+                                 xrange(len(row))]).rstrip() + "\n")
+    return regressions
+
+def main():
+    usage = "usage: %prog [options] <benchmark dir> <results.json>\n\n"\
+            "Time progressive cactus on the example seqFiles and on "\
+            "synthetic inputs.  Everything is run from scratch in "\
+            "<benchmark dir>, and the results are written to <results.json>"
+    parser = OptionParser(usage=usage)
+    parser.add_option("--examples", dest="examples", help="Comma-separated "
+                      "examples to run, or none [default: %default]",
+                      default=",".join(examples))
+    parser.add_option("--synthetic", dest="synthetic", action="append",
+                      help="Also run on a synthetic tree with this many "
+                      "genomes of this many bases each (ex 8:1000000).  "
+                      "Can be given more than once", default=[])
+    parser.add_option("--seed", dest="seed", type=int, help="Random seed "
+                      "for synthetic inputs [default: %default]", default=0)
+    parser.add_option("--cactusOptions", dest="cactusOptions",
+                      help="Options to pass along to progressive cactus "
+                      "(ex \"--maxThreads 8\")", default="")
+    parser.add_option("--baseline", dest="baseline", help="Results of an "
+                      "earlier run to compare against", default=None)
+    parser.add_option("--tolerance", dest="tolerance", type=float,
+                      help="Fraction by which a measurement can grow "
+                      "compared to the baseline before it counts as a "
+                      "regression [default: %default]", default=0.1)
+    options, args = parser.parse_args()
+    if len(args) != 2:
+        parser.print_help()
+        return 1
+    benchDir = os.path.abspath(args[0])
+    cases = []
+    for example in options.examples.split(","):
+        if example != "" and example != "none":
+            cases.append((example, os.path.join(rootDir, "examples",
+                                                "%s.txt" % example)))
+    for synthetic in options.synthetic:
+        try:
+            numLeaves, numBases = [int(x) for x in synthetic.split(":")]
+        except ValueError:
+            parser.error("Invalid --synthetic %s" % synthetic)
+        name = "synthetic_%d_%d" % (numLeaves, numBases)
+        cases.append((name, makeSynthetic(os.path.join(benchDir, name,
+                                                       "input"),
+                                          numLeaves, numBases,
+                                          options.seed)))
+
+    runner = ProcessRunner()
+    results = { "time" : time.time(),
+                "revision" : revision(),
+                "host" : hostInfo(),
+                "cactusOptions" : options.cactusOptions,
+                "cases" : dict() }
+    for name, seqFilePath in cases:
+        results["cases"][name] = runCase(name, seqFilePath, benchDir,
+                                         options.cactusOptions.split(),
+                                         runner)
+    outFile = open(args[1], "w")
+    json.dump(results, outFile, indent=1, sort_keys=True)
+    outFile.close()
+
+    if options.baseline is not None:
+        baselineFile = open(options.baseline, "r")
+        baseline = json.load(baselineFile)
+        baselineFile.close()
+        if compare(results, baseline, options.tolerance, sys.stdout) > 0:
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,258 @@
+#!/usr/bin/env python
+
+# Progressive Cactus Package
+# Copyright (C) 2009-2013 by Glenn Hickey (hickey@soe.ucsc.edu)
+# and Benedict Paten (benedictpaten@gmail.com)
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+import os
+import sys
+import re
+
+###############################################################################
+# A guide tree stored in flat lists indexed by node id (parent id, child
+# ids, name and length of the branch to the parent), with the parts of the
+# NXTree interface we use.  It's much smaller and faster than a networkx
+# graph for trees with thousands of leaves, and everything here is done
+# without recursion, so tree depth doesn't matter.
+###############################################################################
+class CompactTree:
+    def __init__(self):
+        self.parents = []
+        self.children = []
+        self.names = []
+        self.weights = []
+        self.rootId = None
+
+    # add a node and return its id.  the first node without a parent is the
+    # root.
+    def addNode(self, parent=None, name="", weight=None):
+        node = len(self.parents)
+        if parent is None:
+            if self.rootId is not None:
+                raise RuntimeError("Tree can only have one root")
+            self.rootId = node
+            self.parents.append(-1)
+        else:
+            self.parents.append(parent)
+            self.children[parent].append(node)
+        self.children.append([])
+        self.names.append(name)
+        self.weights.append(weight)
+        return node
+
+    def size(self):
+        return len(self.parents)
+
+    def getRootId(self):
+        return self.rootId
+
+    def hasParent(self, node):
+        return self.parents[node] >= 0
+
+    def getParent(self, node):
+        if self.parents[node] < 0:
+            return None
+        return self.parents[node]
+
+    def getChildren(self, node):
+        return self.children[node]
+
+    def isLeaf(self, node):
+        return len(self.children[node]) == 0
+
+    def getName(self, node):
+        return self.names[node]
+
+    def setName(self, node, name):
+        self.names[node] = name
+
+    def getWeight(self, parent, node, defaultValue=None):
+        if self.parents[node] != parent or self.weights[node] is None:
+            return defaultValue
+        return self.weights[node]
+
+    def setWeight(self, parent, node, weight):
+        assert self.parents[node] == parent
+        self.weights[node] = weight
+
+    # reorder the children of every node on key(child node).  ties keep
+    # their current order
+    def sortChildren(self, key):
+        for children in self.children:
+            children.sort(key=key)
+
+    def leaves(self):
+        return [x for x in xrange(len(self.parents))
+                if len(self.children[x]) == 0]
+
+    def preOrderTraversal(self, node=None):
+        if node is None:
+            node = self.rootId
+        if node is None:
+            return
+        stack = [node]
+        while len(stack) > 0:
+            node = stack.pop()
+            yield node
+            stack.extend(reversed(self.children[node]))
+
+    def postOrderTraversal(self, node=None):
+        if node is None:
+            node = self.rootId
+        if node is None:
+            return
+        stack = [(node, False)]
+        while len(stack) > 0:
+            node, expanded = stack.pop()
+            if expanded is True or len(self.children[node]) == 0:
+                yield node
+            else:
+                stack.append((node, True))
+                stack.extend([(x, False) for x in
+                              reversed(self.children[node])])
+
+    def breadthFirstTraversal(self, node=None):
+        if node is None:
+            node = self.rootId
+        if node is None:
+            return
+        queue = [node]
+        pos = 0
+        while pos < len(queue):
+            yield queue[pos]
+            queue.extend(self.children[queue[pos]])
+            pos += 1
+
+    ###########################################################################
+    # Remove, in one pass, every leaf for which keep(leaf) is False, along
+    # with any internal node that is left without leaves.  Nodes are
+    # renumbered (in pre-order).  Returns the names of the leaves removed.
+    ###########################################################################
+    def prune(self, keep):
+        kept = [False] * len(self.parents)
+        removed = []
+        for node in self.postOrderTraversal():
+            if len(self.children[node]) == 0:
+                kept[node] = keep(node)
+                if kept[node] is False:
+                    removed.append(self.names[node])
+            else:
+                kept[node] = True in [kept[x] for x in self.children[node]]
+        old = self.parents, self.names, self.weights
+        order = [x for x in self.preOrderTraversal() if kept[x]]
+        newId = dict([(x, i) for i, x in enumerate(order)])
+        self.parents = [newId.get(old[0][x], -1) for x in order]
+        self.names = [old[1][x] for x in order]
+        self.weights = [old[2][x] for x in order]
+        self.children = [[] for x in order]
+        for node, parent in enumerate(self.parents):
+            if parent >= 0:
+                self.children[parent].append(node)
+        self.rootId = 0 if len(order) > 0 else None
+        return removed
+
+newickTokens = re.compile(r"[(),;:]|[^(),;:]+")
+
+###############################################################################
+# Parse a newick string into a CompactTree, in a single scan.  Labels and
+# branch lengths are optional.  Raises a RuntimeError if the string isn't
+# valid newick (including a node with two labels or branch lengths, or
+# anything but whitespace after the ;).
+###############################################################################
+def parseNewick(newick):
+    end = newick.find(";")
+    if end >= 0 and newick[end + 1:].strip() != "":
+        raise RuntimeError("Unexpected text after ; in %s" % newick)
+    tree = CompactTree()
+    # open internal nodes
+    stack = []
+    # the node that the next label or branch length belongs to
+    current = None
+    inLength = False
+    for token in newickTokens.findall(newick):
+        token = token.strip()
+        if token == "":
+            continue
+        parent = stack[-1] if len(stack) > 0 else None
+        if inLength is True and token in "(),;:":
+            raise RuntimeError("Missing branch length in %s" % newick)
+        if token == "(":
+            if current is not None:
+                raise RuntimeError("Unexpected ( in %s" % newick)
+            stack.append(tree.addNode(parent))
+        elif token == "," or token == ")":
+            if current is None:
+                # unlabeled leaf
+                tree.addNode(parent)
+            if len(stack) == 0:
+                raise RuntimeError("Unbalanced parentheses in %s" % newick)
+            current = stack.pop() if token == ")" else None
+        elif token == ":":
+            if current is None:
+                current = tree.addNode(parent)
+            elif tree.weights[current] is not None:
+                raise RuntimeError("Repeated branch length in %s" % newick)
+            inLength = True
+            continue
+        elif token == ";":
+            break
+        elif inLength is True:
+            try:
+                tree.weights[current] = float(token)
+            except ValueError:
+                raise RuntimeError("Invalid branch length %s in %s" % (
+                    token, newick))
+        elif current is None:
+            current = tree.addNode(parent, token)
+        elif tree.names[current] != "" or tree.weights[current] is not None:
+            raise RuntimeError("Repeated label %s in %s" % (token, newick))
+        else:
+            tree.names[current] = token
+        inLength = False
+    if len(stack) > 0:
+        raise RuntimeError("Unbalanced parentheses in %s" % newick)
+    if tree.size() == 0:
+        raise RuntimeError("Empty tree: %s" % newick)
+    return tree
+
+###############################################################################
+# Newick string for a tree (a CompactTree or NXTree), with the children of
+# each node sorted on childKey(child node, child newick string) if given.
+# Built bottom-up so deep trees don't hit the recursion limit.
+###############################################################################
+def writeNewick(tree, childKey=None):
+    strings = dict()
+    for node in tree.postOrderTraversal():
+        children = [(child, strings.pop(child)) for child in
+                    tree.getChildren(node)]
+        if childKey is not None:
+            children.sort(key=lambda x: childKey(x[0], x[1]))
+        children = [x[1] for x in children]
+        name = tree.getName(node)
+        if name is None:
+            name = ""
+        if len(children) > 0:
+            label = "(%s)%s" % (",".join(children), name)
+        else:
+            label = name
+        if tree.hasParent(node):
+            weight = tree.getWeight(tree.getParent(node), node)
+            if weight is not None:
+                label += ":%s" % repr(weight)
+        strings[node] = label
+    return strings[tree.getRootId()] + ";"
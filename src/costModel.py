@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+
+# Progressive Cactus Package
+# Copyright (C) 2009-2013 by Glenn Hickey (hickey@soe.ucsc.edu)
+# and Benedict Paten (benedictpaten@gmail.com)
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import os
+import sys
+import multiprocessing
+
+from fastaStats import sequenceFiles, isGzipped
+
+###############################################################################
+# Rough estimates of how expensive the parts of a progressive alignment
+# will be, based only on the input sizes and the guide tree.  The absolute
+# numbers are crude, but they're good enough to compare subproblems with
+# each other and to decide what to start first.
+###############################################################################
+
+# ktserver memory needed per base of sequence in a subproblem (ballpark
+# from mammal runs: ~50G for three 3Gb genomes)
+ktBytesPerBase = 6
+# bases of sequence per database record (ballpark from the same runs,
+# where bnum=30m, ie two buckets per record, worked well)
+ktBasesPerRecord = 600
+
+# cpu time per unit of subproblem cost (see TreeCost) and memory of the
+# biggest cactus job per base in a subproblem.  again, ballparks from
+# mammal runs: a subproblem aligning three 3Gb genomes takes a couple of
+# thousand cpu hours, and its biggest jobs ~20G
+cpuSecondsPerCost = 2.5e-4
+jobBytesPerBase = 2
+
+# fasta usually compresses about this well with gzip
+gzipExpansion = 4
+
+def genomeBases(path):
+    total = 0
+    for seqPath in sequenceFiles(path):
+        if isGzipped(seqPath):
+            total += os.path.getsize(seqPath) * gzipExpansion
+        else:
+            total += os.path.getsize(seqPath)
+    return total
+
+# convert a size like 500m or 50g to bytes
+def parseBytes(sizeString):
+    units = { "k" : 1024, "m" : 1024 ** 2, "g" : 1024 ** 3, "t" : 1024 ** 4 }
+    sizeString = str(sizeString).strip().lower()
+    try:
+        if len(sizeString) > 0 and sizeString[-1] in units:
+            return int(float(sizeString[:-1]) * units[sizeString[-1]])
+        return int(sizeString)
+    except ValueError:
+        raise RuntimeError("Invalid size: %s" % sizeString)
+
+def physicalMemory():
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (ValueError, OSError, AttributeError):
+        return None
+
+# kyoto tycoon settings for a database that will hold a subproblem with
+# the given number of bases: (bucket count, memory map size)
+def ktTuning(bases):
+    records = max(1, bases / ktBasesPerRecord)
+    return (2 * records, bases * ktBytesPerBase)
+
+# estimated cpu hours of a subproblem aligning numGenomes genomes with a
+# total of bases bases
+def cpuHours(bases, numGenomes):
+    return bases * numGenomes * cpuSecondsPerCost / 3600.
+
+# estimated memory needed by the biggest job of a subproblem
+def jobMemory(bases):
+    return bases * jobBytesPerBase
+
+def numCpus():
+    try:
+        return multiprocessing.cpu_count()
+    except NotImplementedError:
+        return 1
+
+###############################################################################
+# Cost of every subproblem (internal node) of a guide tree, where:
+# - the size of a leaf genome is the size of its input sequence
+# - the size of an ancestral genome is the average size of its leaves
+# - a subproblem aligns its children, so its cost is the total size of
+#   its children times the number of children (everything is compared to
+#   everything)
+# - the path cost of a node is its cost plus the largest path cost of its
+#   children: the time it can't be finished before, no matter how many
+#   subproblems run in parallel.  The root's path cost is the critical path.
+###############################################################################
+class TreeCost:
+    def __init__(self, tree, pathMap):
+        self.tree = tree
+        self.bases = dict()
+        self.leaves = dict()
+        self.cost = dict()
+        self.pathCost = dict()
+        sizeMap = dict()
+        for name, path in pathMap.items():
+            sizeMap[name] = genomeBases(path)
+        for node in tree.postOrderTraversal():
+            children = tree.getChildren(node)
+            if len(children) == 0:
+                self.bases[node] = sizeMap.get(tree.getName(node), 0)
+                self.leaves[node] = 1
+                self.pathCost[node] = 0
+            else:
+                self.bases[node] = sum([self.bases[x] for x in children])
+                self.leaves[node] = sum([self.leaves[x] for x in children])
+                self.cost[node] = self.subproblemBases(node) * len(children)
+                self.pathCost[node] = self.cost[node] + \
+                    max([self.pathCost[x] for x in children])
+
+    # estimated size of the genome at a node
+    def genomeSize(self, node):
+        return self.bases[node] / max(1, self.leaves[node])
+
+    # total size of the genomes aligned in the subproblem at a node
+    def subproblemBases(self, node):
+        return sum([self.genomeSize(x) for x in self.tree.getChildren(node)])
+
+    def ktMemory(self, node):
+        return self.subproblemBases(node) * ktBytesPerBase
+
+    # memory the whole alignment needs at its peak: the biggest
+    # subproblem's ktserver along with its biggest job
+    def peakMemory(self):
+        return max([self.ktMemory(x) + jobMemory(self.subproblemBases(x))
+                    for x in self.subproblems()] + [0])
+
+    # internal nodes, which is where the subproblems are
+    def subproblems(self):
+        return self.cost.keys()
+
+    def criticalPath(self):
+        return self.pathCost[self.tree.getRootId()]
+
+    # the most subproblems that can run at once without their (estimated)
+    # ktservers needing more than the given amount of memory, assuming the
+    # biggest ones run together.  the root never runs alongside anything.
+    def maxParallelSubproblems(self, memory):
+        total = 0
+        count = 0
+        root = self.tree.getRootId()
+        for size in sorted([self.ktMemory(x) for x in self.subproblems()
+                            if x != root], reverse=True):
+            total += size
+            if total > memory:
+                break
+            count += 1
+        return max(1, count)
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+
+# Progressive Cactus Package
+# Copyright (C) 2009-2013 by Glenn Hickey (hickey@soe.ucsc.edu)
+# and Benedict Paten (benedictpaten@gmail.com)
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import os
+import sys
+import xml.etree.ElementTree as ET
+
+from cactus.progressive.multiCactusProject import MultiCactusProject
+from cactus.shared.experimentWrapper import ExperimentWrapper
+
+###############################################################################
+# Parsed project and experiment xml files, kept around for as long as the
+# files on disk don't change (going by their mtime and size).  Anything
+# that needs to look at the project over and over again (like the
+# JobStatusMonitor) only pays for parsing the files that changed.
+###############################################################################
+class ExperimentCache:
+    def __init__(self):
+        # path -> ((mtime, size), MultiCactusProject)
+        self.projects = dict()
+        # path -> ((mtime, size), ExperimentWrapper)
+        self.experiments = dict()
+
+    def getProject(self, path):
+        signature = self.__signature(path)
+        entry = self.projects.get(path)
+        if entry is None or entry[0] != signature:
+            mcProj = MultiCactusProject()
+            mcProj.readXML(path)
+            entry = (signature, mcProj)
+            self.projects[path] = entry
+        return entry[1]
+
+    def getExperiment(self, path):
+        signature = self.__signature(path)
+        entry = self.experiments.get(path)
+        if entry is None or entry[0] != signature:
+            entry = (signature, ExperimentWrapper(ET.parse(path).getroot()))
+            self.experiments[path] = entry
+        return entry[1]
+
+    # (event name, ExperimentWrapper) for every subproblem in the project.
+    # experiments that are no longer in the project are forgotten.
+    def getExperiments(self, projectPath):
+        mcProj = self.getProject(projectPath)
+        experiments = []
+        for eventName, expPath in mcProj.expMap.items():
+            experiments.append((eventName, self.getExperiment(expPath)))
+        expPaths = set(mcProj.expMap.values())
+        for expPath in self.experiments.keys():
+            if expPath not in expPaths:
+                del self.experiments[expPath]
+        return experiments
+
+    def __signature(self, path):
+        info = os.stat(path)
+        return (info.st_mtime, info.st_size)
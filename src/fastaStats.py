@@ -0,0 +1,256 @@
+#!/usr/bin/env python
+
+# Progressive Cactus Package
+# Copyright (C) 2009-2013 by Glenn Hickey (hickey@soe.ucsc.edu)
+# and Benedict Paten (benedictpaten@gmail.com)
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import os
+import sys
+import mmap
+import gzip
+import string
+from optparse import OptionParser
+
+###############################################################################
+# Streaming FASTA statistics.  We only need to know how much of each input
+# genome is soft-masked (lowercase) and how much is N, so rather than
+# running an external tool and scraping its output we scan the files
+# ourselves.  Files are read in big chunks (mmapped when possible, and
+# transparently decompressed if gzipped), and each chunk is classified
+# with a single translate() through a byte table followed by a few
+# count()s, which keeps all the per-base work in C.
+###############################################################################
+
+# number of bytes read from disk at once
+chunkSize = 16 * 1024 * 1024
+
+gzipMagic = '\x1f\x8b'
+
+# every byte is mapped to one of these classes:
+# w: whitespace (ignored),  l: lowercase (masked),  n: lowercase n (masked
+# and N),  N: uppercase N,  .: anything else
+def makeClassTable():
+    table = ['.'] * 256
+    for c in string.whitespace:
+        table[ord(c)] = 'w'
+    for c in string.ascii_lowercase:
+        table[ord(c)] = 'l'
+    table[ord('n')] = 'n'
+    table[ord('N')] = 'N'
+    return ''.join(table)
+classTable = makeClassTable()
+
+# Base counts for a contig, file or whole genome
+class FastaStats:
+    def __init__(self, name=None):
+        self.name = name
+        self.length = 0
+        self.masked = 0
+        self.ns = 0
+
+    def add(self, other):
+        self.length += other.length
+        self.masked += other.masked
+        self.ns += other.ns
+
+    def maskedFraction(self):
+        if self.length == 0:
+            return 0.
+        return float(self.masked) / self.length
+
+    def nFraction(self):
+        if self.length == 0:
+            return 0.
+        return float(self.ns) / self.length
+
+# Incrementally count the bases of a FASTA stream, fed one chunk at a time.
+# Chunks can break anywhere, including in the middle of a header line.
+class FastaScanner:
+    def __init__(self, name=None, contigs=False):
+        self.total = FastaStats(name)
+        self.contigs = []
+        self.keepContigs = contigs
+        self.current = None
+        self.inHeader = False
+        self.header = []
+
+    def update(self, chunk):
+        pos = 0
+        end = len(chunk)
+        while pos < end:
+            if self.inHeader is True:
+                newline = chunk.find('\n', pos)
+                if newline < 0:
+                    self.header.append(chunk[pos:])
+                    return
+                self.header.append(chunk[pos:newline])
+                self.__startContig(''.join(self.header))
+                self.inHeader = False
+                pos = newline + 1
+            else:
+                start = chunk.find('>', pos)
+                if start < 0:
+                    self.__count(chunk, pos, end)
+                    return
+                self.__count(chunk, pos, start)
+                self.inHeader = True
+                self.header = []
+                pos = start + 1
+
+    def finish(self):
+        if self.inHeader is True:
+            self.__startContig(''.join(self.header))
+            self.inHeader = False
+        return self.total
+
+    def __startContig(self, header):
+        tokens = header.split()
+        if len(tokens) > 0:
+            name = tokens[0]
+        else:
+            name = ''
+        self.current = FastaStats(name)
+        if self.keepContigs is True:
+            self.contigs.append(self.current)
+
+    def __count(self, chunk, start, stop):
+        if start >= stop:
+            return
+        if start > 0 or stop < len(chunk):
+            chunk = chunk[start:stop]
+        classes = chunk.translate(classTable)
+        maskedN = classes.count('n')
+        length = len(classes) - classes.count('w')
+        masked = classes.count('l') + maskedN
+        ns = classes.count('N') + maskedN
+        self.total.length += length
+        self.total.masked += masked
+        self.total.ns += ns
+        if self.keepContigs is True:
+            if self.current is None:
+                self.__startContig('')
+            self.current.length += length
+            self.current.masked += masked
+            self.current.ns += ns
+
+def isGzipped(path):
+    with open(path, "rb") as f:
+        return f.read(len(gzipMagic)) == gzipMagic
+
+# The files that make up a sequence path.  Directories are read the same
+# way "cat dir/*" would.
+def sequenceFiles(path):
+    if os.path.isdir(path):
+        return [os.path.join(path, x) for x in sorted(os.listdir(path))
+                if x[0] != '.' and os.path.isfile(os.path.join(path, x))]
+    return [path]
+
+# Summarize a sequence path by the sizes and modification times of
+# its files.  If the signature is unchanged, we assume the sequence is too.
+def sequenceSignature(path):
+    if os.path.isdir(path):
+        signature = []
+        for name in sorted(os.listdir(path)):
+            if name[0] == '.':
+                continue
+            info = os.stat(os.path.join(path, name))
+            signature.append([name, info.st_size, info.st_mtime])
+        return signature
+    info = os.stat(path)
+    return [info.st_size, info.st_mtime]
+
+# Yield the (uncompressed) contents of a file in chunks.  Plain files are
+# mmapped so we don't pay for python's buffered reads.
+def readChunks(path, size=None):
+    if size is None:
+        size = chunkSize
+    if isGzipped(path):
+        # gzip reads concatenated members, so bgzip'ed files work too
+        f = gzip.open(path, "rb")
+        try:
+            while True:
+                chunk = f.read(size)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            f.close()
+        return
+    with open(path, "rb") as f:
+        length = os.fstat(f.fileno()).st_size
+        mapped = None
+        if length > 0:
+            try:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (mmap.error, ValueError, EnvironmentError):
+                mapped = None
+        if mapped is not None:
+            try:
+                for offset in xrange(0, length, size):
+                    yield mapped[offset:offset + size]
+            finally:
+                mapped.close()
+        else:
+            while True:
+                chunk = f.read(size)
+                if not chunk:
+                    break
+                yield chunk
+
+# Scan a single fasta file.  Returns the file's FastaStats and a list of
+# per-contig FastaStats (empty unless contigs is True)
+def scanFile(path, contigs=False, size=None):
+    scanner = FastaScanner(path, contigs)
+    for chunk in readChunks(path, size):
+        scanner.update(chunk)
+    return scanner.finish(), scanner.contigs
+
+# Scan a sequence path (a fasta file or directory of fasta files).
+# Returns (total stats, list of per-file stats, list of per-contig stats)
+def scanSequence(path, contigs=False, size=None):
+    total = FastaStats(path)
+    fileStats = []
+    contigStats = []
+    for seqPath in sequenceFiles(path):
+        stats, seqContigs = scanFile(seqPath, contigs, size)
+        total.add(stats)
+        fileStats.append(stats)
+        contigStats += seqContigs
+    return total, fileStats, contigStats
+
+def main():
+    usage = "usage: %prog [options] <fasta file or directory>\n\n"\
+            "Print the length, soft-masked and N content of a genome"
+    parser = OptionParser(usage=usage)
+    parser.add_option("--contigs", dest="contigs", action="store_true",
+                      help="Print stats for every contig", default=False)
+    options, args = parser.parse_args()
+    if len(args) != 1:
+        parser.print_help()
+        return 1
+    total, fileStats, contigStats = scanSequence(args[0], options.contigs)
+    rows = fileStats + contigStats
+    if len(fileStats) > 1:
+        rows.append(total)
+    for stats in rows:
+        sys.stdout.write("%s\t%d\t%f\t%f\n" % (stats.name, stats.length,
+                                               stats.maskedFraction(),
+                                               stats.nFraction()))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+
+# Progressive Cactus Package
+# Copyright (C) 2009-2013 by Glenn Hickey (hickey@soe.ucsc.edu)
+# and Benedict Paten (benedictpaten@gmail.com)
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+import os
+import sys
+import time
+import json
+import shutil
+import datetime
+from threading import Thread, Lock
+from multiprocessing.pool import ThreadPool
+
+from sonLib.nxnewick import NXNewick
+
+from experimentCache import ExperimentCache
+
+###############################################################################
+# Export the alignment to HAL while it's still running, instead of with one
+# single-threaded cactus2hal.py over the whole project at the end.
+#
+# As soon as a subproblem's cactus output (its .c2h and .fa files) is done,
+# it's converted to a HAL file of its own (a "piece", rooted at the
+# subproblem) with halAppendCactusSubtree, up to numThreads at a time, while
+# the rest of the tree is still aligning.  Pieces are kept in
+# <workDir>/halPieces along with the signature of the output they were made
+# from, so a resumed run only converts what changed.  Once the alignment is
+# done, finish() converts whatever's left (at least the root) and stitches
+# the pieces together top-down with halAppendSubtree, each child piece
+# being merged onto the leaf of the same name in its parent.
+###############################################################################
+class HalExporter(Thread):
+    pieceDirName = "halPieces"
+
+    def __init__(self, projectPath, workDir, runner, logPath, numThreads=4,
+                 pollTime=60):
+        Thread.__init__(self)
+        self.projectPath = projectPath
+        self.pieceDir = os.path.join(workDir, HalExporter.pieceDirName)
+        self.runner = runner
+        self.logPath = logPath
+        self.pollTime = pollTime
+        self.pool = ThreadPool(max(1, numThreads))
+        self.experimentCache = ExperimentCache()
+        self.lock = Lock()
+        # event -> signature of the output as of the previous poll
+        self.lastSeen = dict()
+        # event -> AsyncResult of its conversion
+        self.pending = dict()
+        self.stopped = False
+        self.daemon = True
+
+    def run(self):
+        while self.stopped is False:
+            time.sleep(self.pollTime)
+            try:
+                self.poll(False)
+            except:
+                # the project can be caught halfway through an update.
+                # we'll look again next time.
+                pass
+
+    ###########################################################################
+    # Start converting any subproblem whose output is complete and doesn't
+    # have an up to date piece yet.  While the alignment is running, output
+    # only counts as complete once it has stopped changing between polls
+    ###########################################################################
+    def poll(self, final):
+        self.lock.acquire()
+        try:
+            for event, exp in self.experimentCache.getExperiments(
+                self.projectPath):
+                if event in self.pending:
+                    continue
+                signature = outputSignature(exp)
+                if signature is None:
+                    continue
+                if final is False and self.lastSeen.get(event) != signature:
+                    self.lastSeen[event] = signature
+                    continue
+                if self.__pieceSignature(event) != signature:
+                    self.pending[event] = self.pool.apply_async(
+                        self.__makePiece, (event, exp, signature))
+        finally:
+            self.lock.release()
+
+    ###########################################################################
+    # Convert whatever's left and merge the pieces into outputHalFile
+    ###########################################################################
+    def finish(self, outputHalFile):
+        self.stopped = True
+        self.poll(True)
+        self.pool.close()
+        self.pool.join()
+        for event, result in self.pending.items():
+            # reraises any error from the conversion
+            result.get()
+        # redo anything that was rewritten (by a retried job, say) after
+        # its conversion started
+        for event, exp in self.experimentCache.getExperiments(
+            self.projectPath):
+            signature = outputSignature(exp)
+            if signature is None:
+                raise RuntimeError("Cactus output for %s not found: %s" % (
+                    event, exp.getHALPath()))
+            if self.__pieceSignature(event) != signature:
+                self.__makePiece(event, exp, signature)
+        self.__merge(outputHalFile)
+
+    def piecePath(self, event):
+        return os.path.join(self.pieceDir, "%s.hal" % event)
+
+    def __signaturePath(self, event):
+        return os.path.join(self.pieceDir, "%s.json" % event)
+
+    def __pieceSignature(self, event):
+        if not os.path.isfile(self.piecePath(event)) or \
+               not os.path.isfile(self.__signaturePath(event)):
+            return None
+        try:
+            sigFile = open(self.__signaturePath(event), "r")
+            signature = json.load(sigFile)
+            sigFile.close()
+            return signature
+        except ValueError:
+            return None
+
+    def __makePiece(self, event, exp, signature):
+        if not os.path.isdir(self.pieceDir):
+            try:
+                os.makedirs(self.pieceDir)
+            except OSError:
+                pass
+        piecePath = self.piecePath(event)
+        tempPath = piecePath + ".tmp"
+        if os.path.exists(tempPath):
+            os.remove(tempPath)
+        cmd = ["halAppendCactusSubtree", exp.getHALPath(),
+               exp.getHALFastaPath(), NXNewick().writeString(exp.getTree()),
+               tempPath]
+        outgroups = exp.getOutgroupEvents()
+        if outgroups is not None and len(outgroups) > 0:
+            cmd += ["--outgroups", ",".join(outgroups)]
+        self.__log("Exporting %s to HAL" % event)
+        self.runner.run(cmd, logPath=self.logPath)
+        os.rename(tempPath, piecePath)
+        sigFile = open(self.__signaturePath(event), "w")
+        json.dump(signature, sigFile)
+        sigFile.close()
+
+    # Stitch the pieces together, parents before children
+    def __merge(self, outputHalFile):
+        mcProj = self.experimentCache.getProject(self.projectPath)
+        tree = mcProj.mcTree
+        tempPath = outputHalFile + ".tmp"
+        merged = 0
+        for node in tree.preOrderTraversal():
+            event = tree.getName(node)
+            if event not in mcProj.expMap:
+                continue
+            if merged == 0:
+                shutil.copyfile(self.piecePath(event), tempPath)
+            else:
+                parent = tree.getName(tree.getParent(node))
+                self.runner.run(["halAppendSubtree", tempPath,
+                                 self.piecePath(event), event, parent,
+                                 "--merge"], logPath=self.logPath)
+            merged += 1
+        if merged == 0:
+            raise RuntimeError("No HAL output found in %s" % self.pieceDir)
+        os.rename(tempPath, outputHalFile)
+        self.__log("Merged %d HAL pieces into %s" % (merged, outputHalFile))
+
+    def __log(self, msg):
+        logFile = open(self.logPath, "a")
+        logFile.write("%s: %s\n" % (str(datetime.datetime.now()), msg))
+        logFile.close()
+
+# size and mtime of a subproblem's cactus output, or None if it isn't there
+# (yet)
+def outputSignature(exp):
+    signature = []
+    for path in [exp.getHALPath(), exp.getHALFastaPath()]:
+        if not os.path.isfile(path):
+            return None
+        info = os.stat(path)
+        signature.append([info.st_size, info.st_mtime])
+    return signature
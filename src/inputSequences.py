@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+
+# Progressive Cactus Package
+# Copyright (C) 2009-2013 by Glenn Hickey (hickey@soe.ucsc.edu)
+# and Benedict Paten (benedictpaten@gmail.com)
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+import os
+import sys
+import json
+import multiprocessing
+
+from fastaStats import sequenceFiles, readChunks, isGzipped
+from fastaStats import sequenceSignature
+
+###############################################################################
+# Cactus can only read plain fasta, so input genomes that are gzipped (or
+# bgzipped), or directories with any gzipped files in them, are decompressed
+# into a single fasta file per genome before the alignment starts.  Files
+# are streamed straight from the input to their place in the working
+# directory (no intermediate copies), several genomes at a time.  Next to
+# each decompressed file we keep the signature of the input it was made
+# from, so it's only redone if the input changes.
+#
+# That one copy can't be avoided without changing cactus: its preprocessor
+# opens the input paths itself and expects plain fasta files there.  It
+# costs the uncompressed size of the gzipped genomes in the working
+# directory.
+###############################################################################
+
+# genomes are decompressed into this subdirectory of the sequence directory
+inputDirName = "inputs"
+
+def needsDecompression(path):
+    return len([x for x in sequenceFiles(path) if isGzipped(x)]) > 0
+
+def decompressedPath(outDir, name):
+    return os.path.join(outDir, "%s.fa" % name)
+
+def signaturePath(outPath):
+    return "%s.json" % outPath
+
+def inputSignature(path):
+    return [os.path.abspath(path), sequenceSignature(path)]
+
+def isUpToDate(path, outPath):
+    if not os.path.isfile(outPath) or not os.path.isfile(signaturePath(outPath)):
+        return False
+    try:
+        sigFile = open(signaturePath(outPath), "r")
+        signature = json.load(sigFile)
+        sigFile.close()
+    except ValueError:
+        return False
+    return signature == inputSignature(path)
+
+# Concatenate the (decompressed) files of a sequence path into outPath,
+# making sure every file starts on a new line.  Takes a tuple so it can be
+# mapped over a multiprocessing pool.
+def decompressSequence(args):
+    path, outPath = args
+    tempPath = "%s.tmp" % outPath
+    outFile = open(tempPath, "wb")
+    try:
+        for seqPath in sequenceFiles(path):
+            lastChunk = None
+            for chunk in readChunks(seqPath):
+                outFile.write(chunk)
+                lastChunk = chunk
+            if lastChunk is not None and lastChunk[-1] != '\n':
+                outFile.write('\n')
+    finally:
+        outFile.close()
+    os.rename(tempPath, outPath)
+    sigFile = open(signaturePath(outPath), "w")
+    json.dump(inputSignature(path), sigFile)
+    sigFile.close()
+    return outPath
+
+###############################################################################
+# Decompress the genomes in pathMap (name -> sequence path) that need it
+# into outDir, numThreads at a time.  Returns a copy of pathMap where they
+# are replaced by their decompressed fasta files.
+###############################################################################
+def decompressInputs(pathMap, outDir, numThreads=1):
+    newPathMap = dict(pathMap)
+    todo = []
+    for name, path in sorted(pathMap.items()):
+        if not needsDecompression(path):
+            continue
+        outPath = decompressedPath(outDir, name)
+        newPathMap[name] = outPath
+        if not isUpToDate(path, outPath):
+            todo.append((path, outPath))
+    if len(todo) > 0:
+        if not os.path.isdir(outDir):
+            os.makedirs(outDir)
+        pool = multiprocessing.Pool(min(max(1, numThreads), len(todo)))
+        try:
+            pool.map(decompressSequence, todo)
+        finally:
+            pool.close()
+            pool.join()
+    return newPathMap
@@ -32,121 +32,273 @@ import socket
 from time import sleep
 import signal
 import traceback
-from threading import Thread
-
-from jobTree.src.master import getJobFileDirName, getConfigFileName
-from jobTree.src.jobTreeStatus import parseJobFiles
+from threading import Thread, Lock
 
 from cactus.progressive.multiCactusProject import MultiCactusProject
 from cactus.shared.experimentWrapper import ExperimentWrapper
-from cactus.pipeline.ktserverControl import pingKtServer
 
 from seqFile import SeqFile
 from projectWrapper import ProjectWrapper
+from jobTreeWatcher import JobTreeWatcher
+from experimentCache import ExperimentCache
+from ktserverProbe import KtServerProber
+from runMetrics import diskUsage
+from progressTracker import ProgressTracker
+from ktServerRegistry import KtServerRegistry
 
 ###############################################################################
 # Keep tabs on how progressive cactus is doing.  In particular look for:
 # - errors in jobTreeStatus
 # - which ktservers are running
+# - every ktserver seen running goes in the run's KtServerRegistry (if we
+#   know the workDir), so they can be shut down when the run stops
 #
 # we use this information to detect cases where some kind of failure leads
-# ktservers running and nothing else.  the logic for calling these deadlocks is
-# - the same ktservers have been running for more than deadlockTime
-# - AND no other jobs have been running for this time
-# - AND there is some kind of error message in the log
+# ktservers running and nothing else.  Rather than waiting for the same
+# jobs to have been around for hours (which long, healthy jobs also do), we
+# watch for signs of forward progress with a ProgressTracker:
+# - the log growing
+# - job files in the jobTree being added, removed or updated
+# - ktservers starting or stopping, or their databases changing size
+# - HAL files being written
+# - the processes we started (other than ktservers) using cpu
+# and call it a deadlock when none of these has moved for deadlockTime
+# (and at least two ktserver polls, so the databases have been compared)
+# while ktservers are still running.
+# The jobTree is looked at every pollTime seconds (which is cheap since only
+# the job files that changed get reread) and the ktservers every ktPollTime.
+# After every poll, status() is passed to statusCallbackFn (if given), which
+# is how the ProgressView is kept up to date.
 # Make sure I'm a daemon! 
 ###############################################################################
 class JobStatusMonitor(Thread):
-    def __init__(self, jobTreePath, projectPath, logPath, pollTime=600,
-                 deadlockTime=14400, deadlockCallbackFn=None):
+    def __init__(self, jobTreePath, projectPath, logPath, pollTime=60,
+                 deadlockTime=1800, deadlockCallbackFn=None,
+                 ktPollTime=600, ktProbeTimeout=10, ktProbeThreads=16,
+                 metrics=None, workDir=None, diskUsageTime=3600,
+                 statusCallbackFn=None):
         Thread.__init__(self)
         self.jobTreePath = jobTreePath
         self.projectPath = projectPath
         self.logPath = logPath
+        # bytes of our own messages in the log, which aren't progress
+        self.logBytesWritten = 0
+        self.logLock = Lock()
         self.pollTime = pollTime
+        self.ktPollTime = ktPollTime
         self.deadlockTime = deadlockTime
         self.deadlockCallbackFn = deadlockCallbackFn
+        self.jobTreeWatcher = JobTreeWatcher(jobTreePath)
+        self.experimentCache = ExperimentCache()
+        self.ktProber = KtServerProber(ktProbeTimeout, ktProbeThreads)
+        # optional RunMetrics where every poll gets recorded, and the
+        # directory whose disk usage is recorded every diskUsageTime
+        self.metrics = metrics
+        self.workDir = workDir
+        self.diskUsageTime = diskUsageTime
+        self.diskThread = None
+        self.diskWarnings = set()
+        self.ktRegistry = None
+        if workDir is not None:
+            self.ktRegistry = KtServerRegistry(workDir)
+        self.progress = ProgressTracker()
+        # called with status() after every poll
+        self.statusCallbackFn = statusCallbackFn
+        # called with every message instead of writing it to stderr (the
+        # log still gets it), ex to keep it out of a ProgressView's way
+        self.messageCallbackFn = None
+        self.__resetTimes()
         self.daemon = True
 
     ###########################################################################
-    # Get the active jobs as done by jobTreeStatus, which is the world-renowned
-    # expert at doing this. If the same jobs are running as last time we polled
-    # add the polltime to sameJobsTime
+    # Get the active jobs (the job files still in the jobTree).  Any change
+    # to the job files counts as progress.
     ###########################################################################
-    def __pollJobTree(self):
-        childJobFileToParentJob, childCounts =  {}, {}
-        updatedJobFiles, shellJobs = set(), set()
+    def __pollJobTree(self, now):
         try:
-            parseJobFiles(getJobFileDirName(self.jobTreePath),
-                          updatedJobFiles, childJobFileToParentJob,
-                          childCounts, shellJobs)
-            failedJobs = [ job for job in updatedJobFiles | \
-                           set(childCounts.keys()) \
-                           if job.remainingRetryCount == 0 ]
-
-            self.curActiveJobs = set()
-            for job in updatedJobFiles:
-                self.curActiveJobs.add(job.getJobFileName())
-            self.failedJobs = max(len(failedJobs), self.failedJobs)
-
+            if self.jobTreeWatcher.poll() is True:
+                self.progress.progress("jobs", now)
+            self.curActiveJobs = self.jobTreeWatcher.activeJobs()
+            self.failedJobs = max(self.jobTreeWatcher.numFailed(),
+                                  self.failedJobs)
+            self.retryingJobs = self.jobTreeWatcher.numRetrying()
         except:
             self.curActiveJobs = set()
 
-        if len(self.prevActiveJobs) > 0 and len(self.curActiveJobs) > 0 and\
-               self.curActiveJobs == self.prevActiveJobs:
-            self.sameJobsTime += self.pollTime
-        else:
-            self.sameJobsTime = 0
-            self.prevActiveJobs = set(self.curActiveJobs)
+    ###########################################################################
+    # Find the subproblems that are done (their HAL file exists).  New
+    # HAL files are a progress signal.
+    ###########################################################################
+    def __pollOutputs(self, now):
+        finished = set()
+        halTimes = dict()
+        try:
+            for eventName, exp in self.experimentCache.getExperiments(
+                self.projectPath):
+                try:
+                    halTimes[eventName] = os.path.getmtime(exp.getHALPath())
+                    finished.add(eventName)
+                except:
+                    pass
+            self.finishedEvents = finished
+            self.progress.observe("hal", halTimes, now)
+        except:
+            pass
 
     ###########################################################################
-    # Get the active ktservers
+    # Get the active ktservers.  All the servers named in the project are
+    # probed at once, and the latency of the ones that answer is kept in
+    # ktStatus.  The set of live servers and the size of their databases
+    # are progress signals.
     ###########################################################################
-    def __pollKtServers(self):
+    def __pollKtServers(self, now):
         self.curKtservers = set()
         try:
-            mc = MultiCactusProject()
-            mc.readXML(self.projectPath)
-            for eventName,expPath in mc.expMap.items():
-                exp = ExperimentWrapper(ET.parse(expPath).getroot())
+            targets = dict()
+            dbDirs = dict()
+            self.ktEvents = dict()
+            for eventName, exp in self.experimentCache.getExperiments(
+                self.projectPath):
                 try:
-                    if pingKtServer(exp):
-                        self.curKtservers.add("%s_%s:%s" % (
-                            eventName, exp.getDbHost(), str(exp.getDbPort())))
+                    name = "%s_%s:%s" % (eventName, exp.getDbHost(),
+                                         str(exp.getDbPort()))
+                    targets[name] = (exp.getDbHost(), exp.getDbPort())
+                    self.ktEvents[name] = eventName
+                    dbDirs[name] = exp.getDbDir()
                 except:
                     pass
                 try:
                     secElem = exp.getSecondaryDBElem()
-                    if secElem is not None and pingKtServer(secElem):
-                        self.curKtservers.add("%s_secondary_%s:%s" % (
+                    if secElem is not None:
+                        name = "%s_secondary_%s:%s" % (
                             eventName, secElem.getDbHost(),
-                            str(secElem.getDbPort())))
+                            str(secElem.getDbPort()))
+                        targets[name] = (secElem.getDbHost(),
+                                         secElem.getDbPort())
+                        self.ktEvents[name] = eventName
+                        dbDirs[name] = secElem.getDbDir()
                 except:
                     pass
-
+            self.ktStatus = dict()
+            for name, status in self.ktProber.probe(targets).items():
+                if status.alive is True:
+                    self.curKtservers.add(name)
+                    self.ktStatus[name] = status
+                    self.__register(name, targets[name], dbDirs.get(name),
+                                    status, now)
         except:
             self.curKtservers = set()
-        if len(self.prevKtservers) > 0 and len(self.curKtservers) > 0 and\
-               self.curKtservers == self.prevKtservers:
-            self.sameKtserversTime += self.pollTime
-        else:
-            self.prevKtservers = set(self.curKtservers)
-            self.sameKtserversTime = 0
+        self.progress.observe("ktservers", self.curKtservers, now)
+        self.progress.observe("db", dict(
+            [(name, (status.records, status.dbBytes))
+             for name, status in self.ktStatus.items()]), now)
+        self.ktPollsSinceProgress += 1
 
+    # losing track of a server is better than losing the whole poll
+    def __register(self, name, target, dbDir, status, now):
+        if self.ktRegistry is None:
+            return
+        try:
+            self.ktRegistry.add(self.ktEvents[name], target[0], target[1],
+                                dbDir, status.dbPaths, now)
+        except (IOError, OSError), e:
+            self.__write("\nUnable to update ktserver registry (no longer "
+                         "trying): %s\n" % str(e))
+            self.ktRegistry = None
 
     def __resetTimes(self):
         self.curActiveJobs = set()
-        self.prevActiveJobs = set()
+        self.finishedEvents = set()
         self.failedJobs = 0
+        self.retryingJobs = 0
         self.curKtservers = set()
-        self.prevKtservers = set()
-        self.sameJobsTime = 0
-        self.sameKtserversTime = 0
+        self.ktStatus = dict()
+        self.ktEvents = dict()
+        self.ktPollsSinceProgress = 0
+        self.inDeadlock = False
+        self.lastProgress = None
+        self.lastKtPoll = time.time()
+        self.lastDiskPoll = None
+
+    ###########################################################################
+    # Record what we found in the last poll in the metrics stream
+    ###########################################################################
+    def __recordJobMetrics(self):
+        if self.metrics is None:
+            return
+        self.metrics.record("jobs", active=len(self.curActiveJobs),
+                            failed=self.failedJobs,
+                            retrying=self.retryingJobs)
+        self.metrics.setGauges([
+            ("cactus_active_jobs", len(self.curActiveJobs), None),
+            ("cactus_failed_jobs", self.failedJobs, None),
+            ("cactus_retrying_jobs", self.retryingJobs, None),
+            ("cactus_seconds_since_progress", self.progress.stalledTime(),
+             None)])
+
+    def __recordKtMetrics(self):
+        if self.metrics is None:
+            return
+        servers = dict()
+        gauges = [("cactus_live_ktservers", len(self.curKtservers), None)]
+        for name, status in self.ktStatus.items():
+            servers[name] = { "event" : self.ktEvents.get(name),
+                              "host" : status.host,
+                              "port" : status.port,
+                              "latency" : status.latency,
+                              "records" : status.records,
+                              "bytes" : status.dbBytes }
+            gauges.append(("cactus_ktserver_latency_seconds", status.latency,
+                           { "server" : name }))
+            gauges.append(("cactus_ktserver_db_bytes", status.dbBytes,
+                           { "server" : name }))
+        self.metrics.record("ktservers", live=len(self.curKtservers),
+                            servers=servers)
+        self.metrics.clearGauges("cactus_ktserver_latency_seconds")
+        self.metrics.clearGauges("cactus_ktserver_db_bytes")
+        self.metrics.setGauges(gauges)
+
+    ###########################################################################
+    # Measuring the workDir means walking the whole jobTree, which can take
+    # a long time, so it's done in a thread of its own (one at a time)
+    # rather than holding up the polls that deadlock detection relies on
+    ###########################################################################
+    def __startDiskUsage(self):
+        if self.metrics is None or self.workDir is None:
+            return
+        if self.diskThread is not None and self.diskThread.isAlive():
+            return
+        self.diskThread = Thread(target=self.__recordDiskUsage)
+        self.diskThread.daemon = True
+        self.diskThread.start()
+
+    def __recordDiskUsage(self):
+        try:
+            fsInfo = os.statvfs(self.workDir)
+            freeBytes = fsInfo.f_bavail * fsInfo.f_frsize
+            usedBytes = diskUsage(self.workDir)
+        except Exception, e:
+            message = "\nUnable to measure disk usage of %s: %s\n" % (
+                self.workDir, str(e))
+            if message not in self.diskWarnings:
+                self.diskWarnings.add(message)
+                self.__write(message)
+            return
+        self.metrics.record("disk", path=self.workDir, used=usedBytes,
+                            free=freeBytes)
+        self.metrics.setGauges([
+            ("cactus_workdir_used_bytes", usedBytes, None),
+            ("cactus_workdir_free_bytes", freeBytes, None)])
 
     def __write(self, msg):
-        sys.stderr.write(msg)
-        with open(self.logPath, "a") as logFile:
-            logFile.write(msg)
+        if self.messageCallbackFn is not None:
+            self.messageCallbackFn(msg)
+        else:
+            sys.stderr.write(msg)
+        with self.logLock:
+            with open(self.logPath, "a") as logFile:
+                logFile.write(msg)
+            self.logBytesWritten += len(msg)
 
     def __hints(self):
         self.__write(" It is likely that Progressive Cactus " +
@@ -163,56 +315,117 @@ class JobStatusMonitor(Thread):
                      "any more jobs are queued. maybe your "+
                      "cluster is just busy...\n" +
                      "* if not it's probably time to abort.\n")
-        self.__write("Note that you can (and probably should)" +
-                     " kill any trailing ktserver jobs by"
-                     " running\n  rm -rf %s" % self.jobTreePath +
-                     "\nThey will eventually timeout on their"+
-                     " own but it could take days.\n\n")
+        self.__write("Note that the ktservers are shut down when" +
+                     " Progressive Cactus exits, even if you abort it." +
+                     "  If any are left behind (ex: after a kill -9)," +
+                     " stop them by running\n  runProgressiveCactus.sh" +
+                     " --reap %s" % (self.workDir or "<workDir>") +
+                     "\nor kill them all by running\n  rm -rf %s" %
+                     self.jobTreePath + "\nOtherwise they will eventually" +
+                     " timeout on their own but it could take days.\n\n")
+
+    ###########################################################################
+    # What we know about the run as of the last poll
+    ###########################################################################
+    def status(self):
+        return { "time" : time.time(),
+                 "activeJobs" : len(self.curActiveJobs),
+                 "failedJobs" : self.failedJobs,
+                 "retryingJobs" : self.retryingJobs,
+                 "ktservers" : len(self.curKtservers),
+                 "liveEvents" : set([self.ktEvents[x] for x in
+                                     self.curKtservers
+                                     if x in self.ktEvents]),
+                 "finishedEvents" : set(self.finishedEvents),
+                 "stalledTime" : self.progress.stalledTime(),
+                 "inDeadlock" : self.inDeadlock }
+
+    # what moved last, for the deadlock message
+    def __lastProgress(self):
+        history = self.progress.history()
+        if len(history) == 0:
+            return ""
+        signal, moved = history[0]
+        return " The last sign of progress was a change in %s at %s." % (
+            signal, time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(moved)))
+
+    # time nothing has moved for, if it's long enough to call a deadlock
+    # (otherwise None)
+    def __deadlockTime(self, now):
+        lastProgress = self.progress.lastProgressTime()
+        if lastProgress != self.lastProgress:
+            self.lastProgress = lastProgress
+            self.ktPollsSinceProgress = 0
+        stalled = self.progress.stalledTime(now)
+        if stalled > self.deadlockTime and self.ktPollsSinceProgress >= 2 \
+               and len(self.curKtservers) > 0:
+            return stalled
+        return None
 
     ###########################################################################
     # Poll until we hit a deadlock.  If that happens print a warning
     # and call the callback (if specified)
     ###########################################################################
     def run(self):
-        self.__resetTimes()
-        inDeadlock = False
         while True:
             sleep(self.pollTime)
-            self.__pollJobTree()
-            self.__pollKtServers()
-
-            if self.sameJobsTime > self.deadlockTime and\
-                   self.sameKtserversTime > self.deadlockTime:
-                inDeadlock = True
-                hangTime = min(self.sameJobsTime, self.sameKtserversTime)
-                failedJobs = self.failedJobs
-                self.__write("\n\n"
-                             "*****************************************"
-                             "*****************************************\n"
-                             "*****************************************"
-                             "*****************************************\n"
-                             "**                                    ALE"
-                             "RT                                     **\n"
-                             "*****************************************"
-                             "*****************************************\n"
-                             "*****************************************"
-                             "*****************************************\n")
-                self.__write("The only jobs that I have detected running" +
-                             " for at least the past %ds" % hangTime +
-                             " are %d ktservers." % len(self.curKtservers))
-                if failedJobs > 0:
-                    self.__write(" Furthermore, there appears to have " +
-                                 "been %d failed jobs. " % failedJobs)    
-                if self.deadlockCallbackFn is not None:
-                    self.deadlockCallbackFn()
-                else:
-                    self.__hints()
-            else:
-                if inDeadlock is True:
-                    self.__write("\nDeadlock no longer detected.  Progress"+
-                                 " resumed")
-                inDeadLock = False
-
-
+            self.pollOnce()
 
+    ###########################################################################
+    # Look at everything once (the ktservers and disk usage only if it's
+    # time to).  Exposed so that one thread can keep an eye on several
+    # alignments (see BatchMonitor)
+    ###########################################################################
+    def pollOnce(self):
+        now = time.time()
+        self.__pollJobTree(now)
+        self.__pollOutputs(now)
+        with self.logLock:
+            self.progress.sampleFiles("log", [self.logPath], now,
+                                      { self.logPath : self.logBytesWritten })
+        self.progress.sampleCpu(now)
+        if now - self.lastKtPoll >= self.ktPollTime:
+            self.__pollKtServers(now)
+            self.__recordKtMetrics()
+            self.lastKtPoll = now
+        self.__recordJobMetrics()
+        if self.lastDiskPoll is None or \
+               now - self.lastDiskPoll >= self.diskUsageTime:
+            self.__startDiskUsage()
+            self.lastDiskPoll = now
 
+        hangTime = self.__deadlockTime(now)
+        if hangTime is not None and self.inDeadlock is False:
+            self.inDeadlock = True
+            failedJobs = self.failedJobs
+            self.__write("\n\n"
+                         "*****************************************"
+                         "*****************************************\n"
+                         "*****************************************"
+                         "*****************************************\n"
+                         "**                                    ALE"
+                         "RT                                     **\n"
+                         "*****************************************"
+                         "*****************************************\n"
+                         "*****************************************"
+                         "*****************************************\n")
+            self.__write("Nothing has made progress for the past %ds" %
+                         hangTime + " (no log output, job changes, " +
+                         "database changes, HAL output or cpu use) " +
+                         "but %d ktservers are still running." %
+                         len(self.curKtservers))
+            self.__write(self.__lastProgress())
+            if failedJobs > 0:
+                self.__write(" Furthermore, there appears to have " +
+                             "been %d failed jobs. " % failedJobs)    
+            if self.deadlockCallbackFn is not None:
+                self.deadlockCallbackFn()
+            else:
+                self.__hints()
+        elif hangTime is None:
+            if self.inDeadlock is True:
+                self.__write("\nDeadlock no longer detected.  Progress"+
+                             " resumed")
+            self.inDeadlock = False
+        if self.statusCallbackFn is not None:
+            self.statusCallbackFn(self.status())
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+
+# Progressive Cactus Package
+# Copyright (C) 2009-2013 by Glenn Hickey (hickey@soe.ucsc.edu)
+# and Benedict Paten (benedictpaten@gmail.com)
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import os
+import sys
+import time
+
+from jobTree.src.master import getJobFileDirName
+from jobTree.src.job import Job
+
+###############################################################################
+# Keep track of the job files in a jobTree without rereading all of them
+# every time we look.  We remember the mtime of every directory and job
+# file we've seen: directories are only relisted when their mtime changes,
+# and job files are only reread when their mtime or size changes, so a
+# poll of a big, mostly idle jobTree costs a stat per file instead of a
+# read and parse per file.  Every fullScanInterval seconds everything is
+# relisted anyway in case we missed something (coarse mtimes on some
+# network filesystems, for example).
+###############################################################################
+class JobTreeWatcher:
+    jobFileName = "job"
+
+    def __init__(self, jobTreePath, fullScanInterval=3600):
+        self.jobTreePath = jobTreePath
+        self.fullScanInterval = fullScanInterval
+        self.lastFullScan = None
+        # dir path -> (mtime, subdirectory paths, job file paths)
+        self.dirs = dict()
+        # job file path -> (mtime, size, remaining retries, initial retries)
+        self.jobs = dict()
+
+    ###########################################################################
+    # Bring our view of the jobTree up to date.  Returns True if anything
+    # changed since the last poll.
+    ###########################################################################
+    def poll(self):
+        now = time.time()
+        fullScan = self.lastFullScan is None or \
+                   now - self.lastFullScan >= self.fullScanInterval
+        if fullScan is True:
+            self.lastFullScan = now
+        changed = False
+        seenDirs = set()
+        seenJobs = set()
+        stack = [getJobFileDirName(self.jobTreePath)]
+        while len(stack) > 0:
+            dirPath = stack.pop()
+            try:
+                mtime = os.stat(dirPath).st_mtime
+            except OSError:
+                continue
+            entry = self.dirs.get(dirPath)
+            if fullScan is True or entry is None or entry[0] != mtime:
+                entry = self.__listDir(dirPath, mtime)
+                if entry is None:
+                    continue
+                if self.dirs.get(dirPath) != entry:
+                    changed = True
+                self.dirs[dirPath] = entry
+            seenDirs.add(dirPath)
+            stack.extend(entry[1])
+            for jobFile in entry[2]:
+                if self.__updateJob(jobFile) is True:
+                    changed = True
+                seenJobs.add(jobFile)
+
+        for dirPath in self.dirs.keys():
+            if dirPath not in seenDirs:
+                del self.dirs[dirPath]
+        for jobFile in self.jobs.keys():
+            if jobFile not in seenJobs:
+                del self.jobs[jobFile]
+                changed = True
+        return changed
+
+    # the job files that currently exist (ie jobs that haven't finished)
+    def activeJobs(self):
+        return set(self.jobs.keys())
+
+    # jobs that have run out of retries
+    def numFailed(self):
+        return len([x for x in self.jobs.values() if x[2] == 0])
+
+    # jobs that have failed at least once since we first saw them, but
+    # still have retries left
+    def numRetrying(self):
+        return len([x for x in self.jobs.values() if x[2] is not None and
+                    x[3] is not None and 0 < x[2] < x[3]])
+
+    def __listDir(self, dirPath, mtime):
+        try:
+            names = os.listdir(dirPath)
+        except OSError:
+            return None
+        subDirs = []
+        jobFiles = []
+        for name in names:
+            path = os.path.join(dirPath, name)
+            if name == JobTreeWatcher.jobFileName:
+                jobFiles.append(path)
+            elif os.path.isdir(path):
+                subDirs.append(path)
+        return (mtime, sorted(subDirs), sorted(jobFiles))
+
+    # reread a job file if it's new or has been modified.  returns True
+    # if it was (re)read
+    def __updateJob(self, jobFile):
+        try:
+            info = os.stat(jobFile)
+        except OSError:
+            return False
+        entry = self.jobs.get(jobFile)
+        if entry is not None and entry[0] == info.st_mtime and \
+               entry[1] == info.st_size:
+            return False
+        mtime = info.st_mtime
+        try:
+            retries = Job.read(jobFile).remainingRetryCount
+        except:
+            # caught in the middle of an update: try again next time
+            retries = None
+            mtime = None
+        initialRetries = retries
+        if entry is not None and entry[3] is not None:
+            initialRetries = entry[3]
+        self.jobs[jobFile] = (mtime, info.st_size, retries, initialRetries)
+        return True
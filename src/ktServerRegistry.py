@@ -0,0 +1,374 @@
+#!/usr/bin/env python
+
+# Progressive Cactus Package
+# Copyright (C) 2009-2013 by Glenn Hickey (hickey@soe.ucsc.edu)
+# and Benedict Paten (benedictpaten@gmail.com)
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+import os
+import sys
+import re
+import json
+import time
+import errno
+import signal
+import atexit
+import subprocess
+from threading import Timer, Lock
+from multiprocessing.pool import ThreadPool
+
+from jobTree.src.master import getJobFileDirName
+
+from experimentCache import ExperimentCache
+from projectWrapper import ProjectWrapper
+from ktserverProbe import probeKtServer, killProcess
+from portAllocator import PortReservation, pidExists, isLocalHost
+from nodeProfile import readMetrics
+
+###############################################################################
+# Keep track of every ktserver a run has had, so that they can all be shut
+# down when the run stops, however it stops.  The servers are started by
+# cactus jobs, not by us, so they're found the way the JobStatusMonitor
+# finds them: each subproblem's database has a ktserver at the host and
+# port in its experiment, and cactus has the server log to ktout.log in the
+# database directory, which is where its pid comes from (kyoto tycoon logs
+# "[START]: pid=..." every time a server starts).  Every server seen is
+# recorded in <workDir>/ktserver_registry.json, which outlives the driver,
+# so the servers of a run that crashed can still be found (along with any
+# that were never seen running, by looking through the project again).
+###############################################################################
+
+# what cactus calls the ktserver log in a database directory
+ktLogName = "ktout.log"
+
+# A ktserver (or the last one) that served a subproblem's database
+class KtServerRecord:
+    def __init__(self, event, host, port, dbDir, pid=None, dbPaths=None,
+                 logOffset=0, lastSeen=None):
+        self.event = event
+        self.host = host
+        self.port = int(port)
+        self.dbDir = dbDir
+        self.pid = pid
+        if dbPaths is None:
+            dbPaths = []
+        self.dbPaths = dbPaths
+        # how much of the log we've read for pids
+        self.logOffset = logOffset
+        self.lastSeen = lastSeen
+
+    def key(self):
+        return "%s:%d:%s" % (self.host, self.port, self.dbDir)
+
+    def toDict(self):
+        return { "event" : self.event, "host" : self.host,
+                 "port" : self.port, "dbDir" : self.dbDir, "pid" : self.pid,
+                 "dbPaths" : self.dbPaths, "logOffset" : self.logOffset,
+                 "lastSeen" : self.lastSeen }
+
+    @staticmethod
+    def fromDict(info):
+        return KtServerRecord(info["event"], info["host"], info["port"],
+                              info["dbDir"], info.get("pid"),
+                              info.get("dbPaths"), info.get("logOffset", 0),
+                              info.get("lastSeen"))
+
+    # pick up the pid of the latest server from the end of its log
+    def updatePid(self):
+        if self.dbDir is None:
+            return False
+        logPath = os.path.join(self.dbDir, ktLogName)
+        try:
+            logFile = open(logPath, "r")
+        except IOError:
+            return False
+        try:
+            size = os.fstat(logFile.fileno()).st_size
+            if size < self.logOffset:
+                # the log was started over
+                self.logOffset = 0
+            logFile.seek(self.logOffset)
+            text = logFile.read(size - self.logOffset)
+        finally:
+            logFile.close()
+        # don't count a partly written last line
+        end = text.rfind("\n") + 1
+        self.logOffset += end
+        pids = re.findall(r'\[START\]: pid=([0-9]+)', text[:end])
+        if len(pids) == 0 or int(pids[-1]) == self.pid:
+            return False
+        self.pid = int(pids[-1])
+        return True
+
+###############################################################################
+# The servers recorded for a working directory
+###############################################################################
+class KtServerRegistry:
+    fileName = "ktserver_registry.json"
+
+    def __init__(self, workDir):
+        self.path = os.path.join(workDir, KtServerRegistry.fileName)
+        self.lock = Lock()
+        self.records = dict()
+        if os.path.isfile(self.path):
+            try:
+                inFile = open(self.path, "r")
+                for info in json.load(inFile):
+                    record = KtServerRecord.fromDict(info)
+                    self.records[record.key()] = record
+                inFile.close()
+            except (IOError, ValueError, KeyError):
+                # a registry we can't read is no worse than no registry:
+                # the project still tells us where to look
+                self.records = dict()
+
+    ###########################################################################
+    # Note a ktserver seen running for event's database in dbDir.  The
+    # registry is rewritten whenever it learns something new.
+    ###########################################################################
+    def add(self, event, host, port, dbDir, dbPaths=None, now=None):
+        with self.lock:
+            record = KtServerRecord(event, host, port, dbDir)
+            record = self.records.setdefault(record.key(), record)
+            changed = record.updatePid()
+            if dbPaths is not None and len(dbPaths) > 0 and \
+                   dbPaths != record.dbPaths:
+                record.dbPaths = dbPaths
+                changed = True
+            if record.lastSeen is None:
+                changed = True
+            if now is not None:
+                record.lastSeen = now
+            if changed is True:
+                self.__write()
+
+    ###########################################################################
+    # Add the database of every experiment in the project that has a
+    # ktserver log, whether or not we ever saw its server running
+    ###########################################################################
+    def discover(self, projectPath):
+        if not os.path.isfile(projectPath):
+            return
+        for event, exp in ExperimentCache().getExperiments(projectPath):
+            try:
+                dbDir = exp.getDbDir()
+                if os.path.isfile(os.path.join(dbDir, ktLogName)):
+                    self.add(event, exp.getDbHost(), exp.getDbPort(), dbDir)
+            except:
+                pass
+
+    def servers(self):
+        with self.lock:
+            return self.records.values()
+
+    def __write(self):
+        tempPath = "%s.tmp" % self.path
+        outFile = open(tempPath, "w")
+        json.dump([x.toDict() for x in self.records.values()], outFile,
+                  indent=1, sort_keys=True)
+        outFile.close()
+        os.rename(tempPath, self.path)
+
+###############################################################################
+# Shut down a bunch of ktservers at once.  Each server is sent a SIGTERM
+# (which kyoto tycoon handles by closing its databases cleanly) and, if it
+# hasn't gone after grace seconds, a SIGKILL.  Servers on this machine are
+# signalled directly, as long as their pid still belongs to a ktserver;
+# servers elsewhere are signalled over ssh, as long as they still answer
+# on their port with databases in the right place.  The servers are
+# handled in a thread pool, so a slow or unreachable host doesn't hold up
+# the others.
+###############################################################################
+class KtServerReaper:
+    def __init__(self, timeout=10, grace=10, maxConcurrent=16):
+        self.timeout = timeout
+        self.grace = grace
+        self.maxConcurrent = maxConcurrent
+
+    # stop every server in records.  returns a list of (record, outcome),
+    # where outcome is None if the server wasn't running, otherwise a
+    # description of what happened to it
+    def reap(self, records):
+        if len(records) == 0:
+            return []
+        pool = ThreadPool(max(1, min(self.maxConcurrent, len(records))))
+        try:
+            results = pool.map(self.reapServer, records)
+        finally:
+            pool.close()
+            pool.join()
+        return zip(records, results)
+
+    def reapServer(self, record):
+        if isLocalHost(record.host):
+            if record.pid is None or \
+                   not isKtServerProcess(record.pid, record):
+                return None
+            alive = lambda: isKtServerProcess(record.pid, record)
+            send = lambda sig: signalLocal(record.pid, sig)
+        else:
+            if not self.__answers(record):
+                return None
+            if record.pid is None:
+                return "unable to stop: pid unknown"
+            alive = lambda: self.__answers(record)
+            send = lambda sig: signalRemote(record.host, record.pid, sig,
+                                            self.timeout)
+        if send(signal.SIGTERM) is False:
+            return "unable to stop: signal failed"
+        deadline = time.time() + self.grace
+        while time.time() < deadline:
+            time.sleep(min(1, self.grace))
+            if not alive():
+                return "stopped"
+        send(signal.SIGKILL)
+        time.sleep(1)
+        if alive():
+            return "unable to stop: still running"
+        return "killed"
+
+    # a server is still up at the record's port, serving the record's
+    # databases (if we know what they are)
+    def __answers(self, record):
+        status = probeKtServer(record.host, record.port, self.timeout)
+        if status.alive is False:
+            return False
+        if len(status.dbPaths) == 0 or record.dbDir is None:
+            return True
+        dbDir = os.path.abspath(record.dbDir) + os.sep
+        return len([x for x in status.dbPaths if
+                    os.path.abspath(x).startswith(dbDir)]) > 0
+
+# True if pid is a ktserver started for record (its command line has the
+# record's port or database directory).  Without /proc we go by the pid.
+def isKtServerProcess(pid, record):
+    if not pidExists(pid):
+        return False
+    try:
+        cmdFile = open("/proc/%d/cmdline" % int(pid), "r")
+        cmdLine = cmdFile.read().split("\0")
+        cmdFile.close()
+    except IOError, e:
+        return e.errno == errno.ENOENT and not os.path.isdir("/proc")
+    if len([x for x in cmdLine if os.path.basename(x) == "ktserver"]) == 0:
+        return False
+    return str(record.port) in cmdLine or (
+        record.dbDir is not None and
+        len([x for x in cmdLine if record.dbDir in x]) > 0)
+
+def signalLocal(pid, sig):
+    try:
+        os.kill(int(pid), sig)
+        return True
+    except OSError:
+        return False
+
+def signalRemote(host, pid, sig, timeout):
+    cmd = ["ssh", "-o", "BatchMode=yes", "-o", "ConnectTimeout=%d" % timeout,
+           host, "kill", "-%d" % sig, str(pid)]
+    try:
+        process = subprocess.Popen(cmd, stdout=open(os.devnull, "w"),
+                                   stderr=subprocess.STDOUT, close_fds=True)
+    except OSError:
+        return False
+    killer = Timer(timeout * 2, killProcess, [process])
+    try:
+        killer.start()
+        process.wait()
+    finally:
+        killer.cancel()
+    return process.returncode == 0
+
+###############################################################################
+# Stop whatever ktservers of the run in workDir are still running.  Prints
+# what happened to each, and returns the number that couldn't be stopped.
+###############################################################################
+def reapWorkDir(workDir, reaper, out=sys.stderr):
+    projectPath = os.path.join(workDir, ProjectWrapper.alignmentDirName,
+                               "%s_project.xml" %
+                               ProjectWrapper.alignmentDirName)
+    registry = KtServerRegistry(workDir)
+    try:
+        registry.discover(projectPath)
+    except Exception, e:
+        out.write("Unable to read %s: %s\n" % (projectPath, str(e)))
+    failed = 0
+    for record, outcome in reaper.reap(registry.servers()):
+        if outcome is None:
+            continue
+        out.write("ktserver %s:%d (%s, pid %s): %s\n" % (
+            record.host, record.port, record.event, record.pid, outcome))
+        if outcome.startswith("unable") is True:
+            failed += 1
+    return failed
+
+###############################################################################
+# Signs that the run in workDir is still going, so its servers shouldn't
+# be reaped from outside: the driver that reserved its ports (or last
+# started it) is still alive on this machine, or a job file in its jobTree
+# has changed in the last recentTime seconds.  Returns a list of reasons,
+# empty if the run looks dead.
+###############################################################################
+def runActivity(workDir, recentTime=600):
+    reasons = []
+    owners = set()
+    reservation = PortReservation.read(workDir)
+    if reservation is not None and isLocalHost(reservation.host):
+        owners.add(reservation.pid)
+    starts = [x for x in readMetrics(workDir) if x["type"] == "run_start"]
+    if len(starts) > 0 and starts[-1].get("pid") is not None:
+        owners.add(starts[-1]["pid"])
+    for pid in sorted(owners):
+        if pid != os.getpid() and pidExists(pid):
+            reasons.append("its driver (pid %d) is still running" % pid)
+    jtPath = os.path.join(workDir, "jobTree")
+    newest = None
+    for dirPath, dirNames, fileNames in os.walk(getJobFileDirName(jtPath)):
+        for name in fileNames:
+            try:
+                mtime = os.path.getmtime(os.path.join(dirPath, name))
+            except OSError:
+                continue
+            newest = max(newest, mtime)
+    if newest is not None and time.time() - newest < recentTime:
+        reasons.append("jobs in %s were updated %ds ago" % (
+            jtPath, time.time() - newest))
+    return reasons
+
+###############################################################################
+# Make sure the ktservers of the runs in workDirs (a list, which can keep
+# growing) don't outlive us.  A SIGTERM or SIGHUP makes us exit the way a
+# ctrl-c does, and on the way out, however we got there, the processes
+# started by runner (if given) are killed, so cactus can't start any more
+# servers, and then every server still running is stopped.  Has to be
+# called from the main thread, after any ProcessRunner whose processes
+# should be gone first (their own atexit cancel() runs before ours).
+###############################################################################
+def installReaper(workDirs, reaper, runner=None):
+    def exitOnSignal(sig, frame):
+        sys.exit(128 + sig)
+    for sig in [signal.SIGTERM, signal.SIGHUP]:
+        signal.signal(sig, exitOnSignal)
+    def reapAll():
+        # don't let a second ctrl-c stop the cleanup halfway
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        if runner is not None:
+            runner.cancel()
+        for workDir in list(workDirs):
+            if os.path.isdir(workDir):
+                reapWorkDir(workDir, reaper)
+    atexit.register(reapAll)
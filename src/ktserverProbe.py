@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+
+# Progressive Cactus Package
+# Copyright (C) 2009-2013 by Glenn Hickey (hickey@soe.ucsc.edu)
+# and Benedict Paten (benedictpaten@gmail.com)
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import os
+import sys
+import re
+import time
+import subprocess
+from threading import Timer
+from multiprocessing.pool import ThreadPool
+
+###############################################################################
+# Check on a bunch of ktservers at once.  Each server is asked for its
+# report with ktremotemgr, which is killed if it doesn't answer within the
+# timeout, and the probes are run in a thread pool so one unreachable host
+# doesn't hold up the others.
+###############################################################################
+
+# What we found out about a ktserver
+class KtServerStatus:
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.alive = False
+        # seconds taken to answer the report request
+        self.latency = None
+        # number of records and bytes used, summed over the server's dbs
+        self.records = None
+        self.dbBytes = None
+        # paths of the server's dbs
+        self.dbPaths = []
+
+def probeKtServer(host, port, timeout):
+    status = KtServerStatus(host, port)
+    cmd = ["ktremotemgr", "report", "-port", str(port),
+           "-tout", str(timeout)]
+    if host is not None:
+        cmd += ["-host", str(host)]
+    start = time.time()
+    try:
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE, close_fds=True)
+    except OSError:
+        return status
+    # ktremotemgr's timeout only covers talking to the server, so make
+    # sure we don't wait forever on anything else
+    killer = Timer(timeout, killProcess, [process])
+    try:
+        killer.start()
+        output = process.communicate()[0]
+    finally:
+        killer.cancel()
+    if process.returncode != 0:
+        return status
+    status.alive = True
+    status.latency = time.time() - start
+    # ex: db_0: count=16391 size=1581872 path=...
+    for count, size in re.findall(r'db_[0-9]+:\s+count=([0-9]+)\s+'
+                                  r'size=([0-9]+)', output):
+        status.records = (status.records or 0) + int(count)
+        status.dbBytes = (status.dbBytes or 0) + int(size)
+    status.dbPaths = re.findall(r'db_[0-9]+:.*\spath=(\S+)', output)
+    return status
+
+# Kill a process that may already have exited (and been reaped) by the
+# time we get to it
+def killProcess(process):
+    try:
+        process.kill()
+    except OSError:
+        pass
+
+class KtServerProber:
+    def __init__(self, timeout=10, maxConcurrent=16):
+        self.timeout = timeout
+        self.maxConcurrent = maxConcurrent
+
+    # probe every server in targets, a dict of name -> (host, port).
+    # returns a dict of name -> KtServerStatus
+    def probe(self, targets):
+        if len(targets) == 0:
+            return dict()
+        names = targets.keys()
+        pool = ThreadPool(max(1, min(self.maxConcurrent, len(names))))
+        try:
+            results = pool.map(lambda name: probeKtServer(
+                targets[name][0], targets[name][1], self.timeout), names)
+        finally:
+            pool.close()
+            pool.join()
+        return dict(zip(names, results))
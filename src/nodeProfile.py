@@ -0,0 +1,278 @@
+#!/usr/bin/env python
+
+# Progressive Cactus Package
+# Copyright (C) 2009-2013 by Glenn Hickey (hickey@soe.ucsc.edu)
+# and Benedict Paten (benedictpaten@gmail.com)
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import os
+import sys
+import json
+import xml.etree.ElementTree as ET
+from optparse import OptionParser
+
+from experimentCache import ExperimentCache
+from projectWrapper import ProjectWrapper
+from runMetrics import RunMetrics, diskUsage
+
+###############################################################################
+# Break down where the time and memory of a finished (or running) alignment
+# went, one line per subproblem (ie internal node of the guide tree):
+# - wall: time the subproblem's ktserver was seen running by the
+#   JobStatusMonitor (if there is no record of that, the time between its
+#   output and the latest output of the subproblems it depends on)
+# - jobHours: active jobTree jobs over time, split evenly between the
+#   subproblems running at the time
+# - cpuHours: the total cpu in the jobTree stats (if the run used --stats)
+#   shared out in proportion to jobHours
+# - peakKtDbBytes: largest database size (summed over its dbs) reported
+#   by the subproblem's ktserver
+# - dbSize, halSize: size on disk of the database and of the cactus output
+# Subproblems are sorted by how much they contribute to the critical path,
+# which is the chain of dependent subproblems (children and outgroups) with
+# the most total wall time.  These are the ones worth rebalancing.
+###############################################################################
+
+class NodeProfile:
+    def __init__(self, event):
+        self.event = event
+        self.deps = []
+        self.wall = None
+        self.jobHours = 0.
+        self.cpuHours = None
+        self.peakKtDbBytes = None
+        self.dbSize = None
+        self.halSize = None
+        self.outputTime = None
+        self.criticalPath = 0.
+        self.onCriticalPath = False
+
+def readMetrics(workDir):
+    records = []
+    path = os.path.join(workDir, RunMetrics.fileName)
+    if os.path.isfile(path):
+        for line in open(path, "r"):
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                pass
+    records.sort(key=lambda x: x["time"])
+    return records
+
+# total cpu seconds of all targets in the jobTree stats file
+def readJobTreeCpu(jtPath):
+    statsPath = os.path.join(jtPath, "stats.xml")
+    if not os.path.isfile(statsPath):
+        return None
+    total = 0.
+    for target in ET.parse(statsPath).getroot().iter("target"):
+        total += float(target.attrib.get("time", 0))
+    return total
+
+# time between each record and the next record of the same type in the same
+# run (the last record of a run doesn't count for anything)
+def intervals(records, recordType):
+    result = []
+    last = None
+    for record in records:
+        if record["type"] == "run_start":
+            last = None
+        elif record["type"] == recordType:
+            if last is not None:
+                result.append((last, record["time"] - last["time"]))
+            last = record
+    return result
+
+# subproblems with a ktserver that answered in the given poll
+def liveEvents(ktRecord, profiles):
+    return set([x.get("event") for x in ktRecord["servers"].values()
+                if x.get("event") in profiles])
+
+def profileProject(workDir, jtPath=None):
+    if jtPath is None:
+        jtPath = os.path.join(workDir, "jobTree")
+    projPath = os.path.join(workDir, ProjectWrapper.alignmentDirName,
+                            "%s_project.xml" % ProjectWrapper.alignmentDirName)
+    cache = ExperimentCache()
+    mcProj = cache.getProject(projPath)
+    profiles = dict()
+    for event, exp in cache.getExperiments(projPath):
+        profile = NodeProfile(event)
+        tree = exp.getTree()
+        for node in tree.postOrderTraversal():
+            name = tree.getName(node)
+            if tree.isLeaf(node) and name != event and name in mcProj.expMap:
+                profile.deps.append(name)
+        try:
+            profile.halSize = os.path.getsize(exp.getHALPath())
+            profile.outputTime = os.path.getmtime(exp.getHALPath())
+        except:
+            pass
+        try:
+            if os.path.isdir(exp.getDbDir()):
+                profile.dbSize = diskUsage(exp.getDbDir())
+        except:
+            pass
+        profiles[event] = profile
+
+    records = readMetrics(workDir)
+    ktRecords = [x for x in records if x["type"] == "ktservers"]
+    # ktserver sightings give us peak database size and wall time
+    for record in ktRecords:
+        for server in record["servers"].values():
+            profile = profiles.get(server.get("event"))
+            if profile is not None and server.get("bytes") is not None:
+                profile.peakKtDbBytes = max(profile.peakKtDbBytes,
+                                            server["bytes"])
+    for record, elapsed in intervals(records, "ktservers"):
+        for event in liveEvents(record, profiles):
+            profiles[event].wall = (profiles[event].wall or 0.) + elapsed
+
+    # job activity is shared between whatever was running at the time
+    ktIndex = -1
+    for record, elapsed in intervals(records, "jobs"):
+        while ktIndex + 1 < len(ktRecords) and \
+                  ktRecords[ktIndex + 1]["time"] <= record["time"]:
+            ktIndex += 1
+        if ktIndex < 0:
+            continue
+        live = liveEvents(ktRecords[ktIndex], profiles)
+        for event in live:
+            profiles[event].jobHours += \
+                record["active"] * elapsed / 3600. / len(live)
+
+    totalCpu = readJobTreeCpu(jtPath)
+    totalJobHours = sum([x.jobHours for x in profiles.values()])
+    if totalCpu is not None and totalJobHours > 0:
+        for profile in profiles.values():
+            profile.cpuHours = totalCpu / 3600. * \
+                               profile.jobHours / totalJobHours
+
+    # subproblems we never saw running: estimate from output times
+    alignmentStart = None
+    for record in records:
+        if record["type"] == "stage_start" and \
+               record.get("stage") == "alignment":
+            alignmentStart = record["time"]
+    for profile in profiles.values():
+        if profile.wall is None and profile.outputTime is not None:
+            depTimes = [profiles[x].outputTime for x in profile.deps
+                        if profiles[x].outputTime is not None]
+            if len(depTimes) > 0:
+                start = max(depTimes)
+            else:
+                start = alignmentStart
+            if start is not None and start <= profile.outputTime:
+                profile.wall = profile.outputTime - start
+
+    computeCriticalPath(profiles, mcProj.mcTree.getRootName())
+    return sorted(profiles.values(), key=lambda x: (
+        not x.onCriticalPath, -(x.wall or 0.), x.event))
+
+# the critical path of a subproblem is its wall time (or whatever weight
+# gives) plus the longest critical path of anything it depends on.  Mark the
+# subproblems along the critical path of the root.
+def computeCriticalPath(profiles, rootName, weight=lambda x: x.wall or 0.):
+    done = set()
+    for start in profiles.keys():
+        visiting = set()
+        stack = [(start, False)]
+        while len(stack) > 0:
+            event, expanded = stack.pop()
+            profile = profiles[event]
+            if event in done:
+                continue
+            if expanded is True:
+                longest = max([profiles[x].criticalPath for x in profile.deps
+                               if x in done] + [0.])
+                profile.criticalPath = weight(profile) + longest
+                done.add(event)
+            elif event not in visiting:
+                visiting.add(event)
+                stack.append((event, True))
+                stack += [(x, False) for x in profile.deps if x not in done]
+    event = rootName
+    if event not in profiles:
+        event = max(profiles.keys(), key=lambda x: profiles[x].criticalPath)
+    while event is not None:
+        profiles[event].onCriticalPath = True
+        deps = profiles[event].deps
+        if len(deps) == 0:
+            break
+        event = max(deps, key=lambda x: profiles[x].criticalPath)
+
+def formatTime(seconds):
+    if seconds is None:
+        return "-"
+    seconds = int(seconds)
+    return "%dh%02dm%02ds" % (seconds / 3600, (seconds % 3600) / 60,
+                              seconds % 60)
+
+def formatBytes(numBytes):
+    if numBytes is None:
+        return "-"
+    for unit in ["B", "K", "M", "G"]:
+        if numBytes < 1024.:
+            return "%.1f%s" % (numBytes, unit)
+        numBytes /= 1024.
+    return "%.1fT" % numBytes
+
+def formatHours(hours):
+    if hours is None:
+        return "-"
+    return "%.2f" % hours
+
+def writeProfile(profiles, outFile):
+    total = max([x.criticalPath for x in profiles] + [0.])
+    outFile.write("Critical path: %s\n\n" % formatTime(total))
+    header = ["event", "critical", "wall", "pathShare", "jobHours",
+              "cpuHours", "peakKtDbBytes", "dbSize", "halSize"]
+    rows = [header]
+    for profile in profiles:
+        if profile.onCriticalPath is True and total > 0:
+            share = "%.1f%%" % (100. * (profile.wall or 0.) / total)
+            critical = "*"
+        else:
+            share = "-"
+            critical = ""
+        rows.append([profile.event, critical, formatTime(profile.wall),
+                     share, formatHours(profile.jobHours),
+                     formatHours(profile.cpuHours),
+                     formatBytes(profile.peakKtDbBytes),
+                     formatBytes(profile.dbSize),
+                     formatBytes(profile.halSize)])
+    widths = [max([len(row[i]) for row in rows]) for i in xrange(len(header))]
+    for row in rows:
+        outFile.write("  ".join([row[i].ljust(widths[i]) for i in
+                                 xrange(len(row))]).rstrip() + "\n")
+
+def main():
+    usage = "usage: %prog [options] <workDir>\n\n"\
+            "Report the time and memory used by each subproblem of a "\
+            "progressive alignment"
+    parser = OptionParser(usage=usage)
+    parser.add_option("--jobTree", dest="jobTree", help="jobTree of the run "
+                      "(for cpu stats) [default: <workDir>/jobTree]",
+                      default=None)
+    options, args = parser.parse_args()
+    if len(args) != 1:
+        parser.print_help()
+        return 1
+    writeProfile(profileProject(args[0], options.jobTree), sys.stdout)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
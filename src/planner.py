@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+
+# Progressive Cactus Package
+# Copyright (C) 2009-2013 by Glenn Hickey (hickey@soe.ucsc.edu)
+# and Benedict Paten (benedictpaten@gmail.com)
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+import os
+import sys
+import shutil
+import tempfile
+
+from projectWrapper import ProjectWrapper, subproblemGenomes
+from costModel import cpuHours, jobMemory, ktTuning, physicalMemory
+from costModel import parseBytes
+from nodeProfile import computeCriticalPath, formatBytes, formatHours
+
+###############################################################################
+# Dry run: work out how the alignment would be broken into subproblems
+# (by running cactus_createMultiCactusProject exactly as a real run would,
+# but in a temporary directory) and estimate what each subproblem will
+# need, without aligning anything.  The estimates come from the same
+# ballpark cost model as everything else (see costModel.py), so they're
+# only good to within a small factor, but that's enough to spot a run
+# that can't work before spending any cluster time on it.
+###############################################################################
+
+class SubproblemPlan:
+    def __init__(self, event):
+        self.event = event
+        self.leaves = []
+        self.outgroups = []
+        self.deps = []
+        self.bases = 0
+        self.cpuHours = 0.
+        self.jobMemory = 0
+        self.ktMemory = 0
+        self.criticalPath = 0.
+        self.onCriticalPath = False
+
+###############################################################################
+# Plan every subproblem of the alignment of seqFile with the given options.
+# Returns (list of SubproblemPlans, name of the root subproblem, max
+# parallel subtrees)
+###############################################################################
+def planProject(options, seqFile, runner=None):
+    tempDir = tempfile.mkdtemp(prefix="cactusPlan")
+    try:
+        projWrapper = ProjectWrapper(options, seqFile, tempDir, runner,
+                                     dryRun=True)
+        projWrapper.writeXml()
+        mcProj, experiments = projWrapper.readExperiments(
+            os.path.join(tempDir, ProjectWrapper.alignmentDirName))
+        subproblemBases = projWrapper.subproblemBases(experiments)
+        maxParallel = projWrapper.configWrapper.getMaxParallelSubtrees()
+        rootName = mcProj.mcTree.getRootName()
+    finally:
+        shutil.rmtree(tempDir, ignore_errors=True)
+
+    plans = dict()
+    for event, exp in experiments.items():
+        plan = SubproblemPlan(event)
+        plan.outgroups = exp.getOutgroupEvents()
+        if plan.outgroups is None:
+            plan.outgroups = []
+        plan.leaves = subproblemGenomes(exp, False)
+        plan.deps = [x for x in plan.leaves if x in experiments and
+                     x != event]
+        plan.bases = subproblemBases[event]
+        plan.cpuHours = cpuHours(plan.bases,
+                                 len(plan.leaves) + len(plan.outgroups))
+        plan.jobMemory = jobMemory(plan.bases)
+        plan.ktMemory = ktTuning(plan.bases)[1]
+        plans[event] = plan
+    computeCriticalPath(plans, rootName, lambda x: x.cpuHours)
+    return sorted(plans.values(), key=lambda x: (
+        not x.onCriticalPath, -x.criticalPath, x.event)), rootName, \
+        maxParallel
+
+def writePlan(plans, rootName, maxParallel, options, outFile):
+    if options.ktMaxMemory is not None:
+        memory = parseBytes(options.ktMaxMemory)
+    else:
+        memory = physicalMemory()
+    header = ["subproblem", "critical", "leaves", "outgroups", "bases",
+              "cpuHours", "jobMem", "ktMem"]
+    rows = [header]
+    tooBig = []
+    for plan in plans:
+        ktMemory = formatBytes(plan.ktMemory)
+        if options.database == "kyoto_tycoon" and memory is not None and \
+               plan.ktMemory > memory:
+            tooBig.append(plan.event)
+            ktMemory += "!"
+        rows.append([plan.event, "*" if plan.onCriticalPath else "",
+                     ",".join(plan.leaves), ",".join(plan.outgroups) or "-",
+                     formatBytes(plan.bases).rstrip("B"),
+                     formatHours(plan.cpuHours), formatBytes(plan.jobMemory),
+                     ktMemory])
+    widths = [max([len(row[i]) for row in rows]) for i in xrange(len(header))]
+    for row in rows:
+        outFile.write("  ".join([row[i].ljust(widths[i]) for i in
+                                 xrange(len(row))]).rstrip() + "\n")
+
+    path = [x for x in plans if x.onCriticalPath]
+    outFile.write("\n%d subproblems, up to %d at once.  Total: %s cpu "
+                  "hours\n" % (len(plans), maxParallel, formatHours(
+                      sum([x.cpuHours for x in plans]))))
+    outFile.write("Critical path: %s (%s cpu hours)\n" % (
+        " -> ".join([x.event for x in reversed(path)]),
+        formatHours(max([x.criticalPath for x in plans] + [0.]))))
+    if len(tooBig) > 0 and options.ktAutoTune is True:
+        outFile.write("The ktservers of %d subproblems (marked !) won't fit "
+                      "in %s of memory, and will use on-disk databases: "
+                      "%s\n" % (len(tooBig), formatBytes(memory),
+                                 ", ".join(tooBig)))
+    elif len(tooBig) > 0:
+        outFile.write("WARNING: the ktservers of %d subproblems (marked !) "
+                      "probably won't fit in %s of memory: %s.  Consider "
+                      "--ktAutoTune, --ktType disk or a bigger machine.\n" % (
+                          len(tooBig), formatBytes(memory),
+                          ", ".join(tooBig)))
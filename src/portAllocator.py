@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+
+# Progressive Cactus Package
+# Copyright (C) 2009-2013 by Glenn Hickey (hickey@soe.ucsc.edu)
+# and Benedict Paten (benedictpaten@gmail.com)
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+import os
+import sys
+import json
+import errno
+import fcntl
+import socket
+import tempfile
+
+###############################################################################
+# Find ranges of ktserver ports that nothing else is using, and keep other
+# runs from taking them.  A range is only handed out if every port in it
+# can be bound on this machine and it doesn't overlap the range of any
+# other run, which is recorded in a lock file (<lockDir>/ports.<first>-
+# <last>.json, holding the pid, host and workDir of its owner) for as long
+# as the run goes on.  Lock files of runs that died without releasing them
+# are cleaned up the next time anyone looks.  The lock directory is only
+# scanned and updated with <lockDir>/.lock held, so runs starting at the
+# same time can't take the same range.
+#
+# Ports are probed on this machine, which is where the ktservers run with
+# the usual singleMachine bigBatchSystem.
+###############################################################################
+
+# A range of ports held by a run.  Also recorded in the run's workDir
+# (<workDir>/ktserver_ports.json) so the monitor and cleanup code know
+# which ktservers are ours.
+class PortReservation:
+    fileName = "ktserver_ports.json"
+
+    def __init__(self, firstPort, lastPort, workDir, pid=None, host=None,
+                 lockPath=None):
+        self.firstPort = int(firstPort)
+        self.lastPort = int(lastPort)
+        self.workDir = workDir
+        if pid is None:
+            pid = os.getpid()
+        self.pid = pid
+        if host is None:
+            host = socket.gethostname()
+        self.host = host
+        self.lockPath = lockPath
+
+    def ports(self):
+        return range(self.firstPort, self.lastPort + 1)
+
+    def overlaps(self, firstPort, lastPort):
+        return firstPort <= self.lastPort and self.firstPort <= lastPort
+
+    def toDict(self):
+        return { "firstPort" : self.firstPort, "lastPort" : self.lastPort,
+                 "workDir" : self.workDir, "pid" : self.pid,
+                 "host" : self.host, "lockPath" : self.lockPath }
+
+    def write(self, path):
+        tempPath = "%s.tmp" % path
+        outFile = open(tempPath, "w")
+        json.dump(self.toDict(), outFile, indent=1, sort_keys=True)
+        outFile.close()
+        os.rename(tempPath, path)
+
+    @staticmethod
+    def readFile(path):
+        inFile = open(path, "r")
+        info = json.load(inFile)
+        inFile.close()
+        return PortReservation(info["firstPort"], info["lastPort"],
+                               info["workDir"], info["pid"], info["host"],
+                               info.get("lockPath"))
+
+    # the ports recorded in a workDir, or None if there aren't any
+    @staticmethod
+    def read(workDir):
+        path = os.path.join(workDir, PortReservation.fileName)
+        if not os.path.isfile(path):
+            return None
+        return PortReservation.readFile(path)
+
+class PortAllocator:
+    # ports set aside for each ktserver that can run at once (cactus moves
+    # up to the next port if the one it's given is busy)
+    portsPerServer = 4
+
+    def __init__(self, lockDir=None):
+        if lockDir is None:
+            lockDir = os.path.join(tempfile.gettempdir(),
+                                   "progressiveCactusPorts")
+        self.lockDir = lockDir
+        if not os.path.isdir(lockDir):
+            try:
+                os.makedirs(lockDir)
+                # shared by everyone on the machine, like /tmp
+                os.chmod(lockDir, 01777)
+            except OSError, e:
+                if e.errno != errno.EEXIST:
+                    raise
+        self.lockFile = None
+
+    ###########################################################################
+    # Reserve the first range of count free ports at or above lowest for
+    # the run in workDir.  Raises a RuntimeError if there isn't one.
+    ###########################################################################
+    def reserve(self, lowest, count, workDir, highest=65535):
+        count = max(1, int(count))
+        self.__lock()
+        try:
+            reservations = self.reservations()
+            firstPort = int(lowest)
+            while firstPort + count - 1 <= highest:
+                lastPort = firstPort + count - 1
+                clash = [x.lastPort for x in reservations
+                         if x.overlaps(firstPort, lastPort)]
+                if len(clash) == 0:
+                    clash = [x for x in xrange(firstPort, lastPort + 1)
+                             if portInUse(x)][:1]
+                if len(clash) == 0:
+                    reservation = PortReservation(
+                        firstPort, lastPort, os.path.abspath(workDir))
+                    reservation.lockPath = os.path.join(
+                        self.lockDir, "ports.%d-%d.json" % (firstPort,
+                                                            lastPort))
+                    reservation.write(reservation.lockPath)
+                    return reservation
+                firstPort = max(clash) + 1
+        finally:
+            self.__unlock()
+        raise RuntimeError("Unable to find %d free ports between %d and %d" %
+                           (count, int(lowest), highest))
+
+    # Give up a range (if it's still ours)
+    def release(self, reservation):
+        self.__lock()
+        try:
+            try:
+                current = PortReservation.readFile(reservation.lockPath)
+            except (IOError, OSError, ValueError, KeyError):
+                return
+            if current.pid == reservation.pid and \
+                   current.host == reservation.host:
+                os.remove(reservation.lockPath)
+        finally:
+            self.__unlock()
+
+    ###########################################################################
+    # The ranges held by live runs.  Lock files left by runs on this
+    # machine that are no longer running are removed.  Only call with the
+    # lock held.
+    ###########################################################################
+    def reservations(self):
+        reservations = []
+        host = socket.gethostname()
+        for name in os.listdir(self.lockDir):
+            path = os.path.join(self.lockDir, name)
+            if not name.startswith("ports.") or not name.endswith(".json"):
+                continue
+            try:
+                reservation = PortReservation.readFile(path)
+            except (IOError, OSError, ValueError, KeyError):
+                continue
+            if reservation.host == host and not pidExists(reservation.pid):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                continue
+            reservations.append(reservation)
+        return reservations
+
+    def __lock(self):
+        self.lockFile = open(os.path.join(self.lockDir, ".lock"), "a")
+        try:
+            os.chmod(self.lockFile.name, 0666)
+        except OSError:
+            pass
+        fcntl.flock(self.lockFile.fileno(), fcntl.LOCK_EX)
+
+    def __unlock(self):
+        fcntl.flock(self.lockFile.fileno(), fcntl.LOCK_UN)
+        self.lockFile.close()
+        self.lockFile = None
+
+# True if something on this machine is listening on (or otherwise holding)
+# a port
+def portInUse(port):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        sock.bind(("", int(port)))
+        return False
+    except socket.error:
+        return True
+    finally:
+        sock.close()
+
+# True if host (as given for a ktserver) is this machine
+def isLocalHost(host):
+    if host is None or host == "":
+        return True
+    return host in ["localhost", "127.0.0.1", socket.gethostname(),
+                    socket.getfqdn()]
+
+def pidExists(pid):
+    try:
+        os.kill(int(pid), 0)
+        return True
+    except OSError, e:
+        return e.errno == errno.EPERM
@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+
+# Progressive Cactus Package
+# Copyright (C) 2009-2013 by Glenn Hickey (hickey@soe.ucsc.edu)
+# and Benedict Paten (benedictpaten@gmail.com)
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+import os
+import sys
+import time
+import errno
+import signal
+import atexit
+import subprocess
+from threading import Timer, Lock
+
+###############################################################################
+# Run the external tools (cactus_progressive.py, cactus2hal.py, ...)
+# directly instead of through shell strings passed to system():
+# - the environment file is sourced once, and its environment is handed to
+#   every process we start
+# - output goes straight into the log (opened for appending), so it shows
+#   up as it's written, and nothing of ours is left holding a pipe that
+#   the process's own background children (ex ktservers) keep open
+# - each process gets its own process group, so killing it (on a timeout,
+#   a cancel() or a ctrl-c) takes whatever it started down with it
+# - the resource usage of every process is collected with wait4() and
+#   optionally recorded in the RunMetrics
+###############################################################################
+
+# environment file -> environment it sets up
+environmentCache = dict()
+
+# The environment after sourcing envFile, read only once per file
+def loadEnvironment(envFile):
+    if envFile not in environmentCache:
+        output = subprocess.Popen(
+            ["/bin/bash", "-c", ". \"$0\" > /dev/null && env -0",
+             os.path.abspath(envFile)],
+            stdout=subprocess.PIPE).communicate()[0]
+        env = dict()
+        for entry in output.split("\0"):
+            if "=" in entry:
+                key, value = entry.split("=", 1)
+                env[key] = value
+        if len(env) == 0:
+            raise RuntimeError("Unable to load environment from %s" % envFile)
+        environmentCache[envFile] = env
+    return environmentCache[envFile]
+
+# What happened to a process that's done
+class ProcessResult:
+    def __init__(self, args, returnCode, wallTime, rusage, timedOut):
+        self.args = args
+        self.returnCode = returnCode
+        self.wallTime = wallTime
+        self.userTime = rusage.ru_utime
+        self.sysTime = rusage.ru_stime
+        # ru_maxrss is in kilobytes on linux
+        self.maxRss = rusage.ru_maxrss * 1024
+        # bytes sent to disk (ru_oublock is in 512 byte blocks), including
+        # files that were deleted again before the process ended
+        self.writtenBytes = rusage.ru_oublock * 512
+        self.timedOut = timedOut
+
+    def command(self):
+        return " ".join(self.args)
+
+# A process started by a ProcessRunner
+class RunningProcess:
+    # seconds between asking a process to stop and forcing it to
+    killGrace = 30
+
+    def __init__(self, runner, args, logPath, timeout, cwd):
+        self.runner = runner
+        self.args = [str(x) for x in args]
+        self.timeout = timeout
+        self.startTime = time.time()
+        self.timedOut = False
+        self.result = None
+        logFile = None
+        if logPath is not None:
+            logFile = open(logPath, "a")
+        try:
+            self.popen = subprocess.Popen(self.args, env=runner.env, cwd=cwd,
+                                          stdout=logFile,
+                                          stderr=subprocess.STDOUT
+                                          if logFile is not None else None,
+                                          preexec_fn=os.setpgrp,
+                                          close_fds=True)
+        except OSError, e:
+            raise RuntimeError("Unable to run %s: %s" % (self.args[0],
+                                                          str(e)))
+        finally:
+            # the process has its own copy
+            if logFile is not None:
+                logFile.close()
+        self.timer = None
+        if timeout is not None:
+            self.timer = Timer(timeout, self.__timeout)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def pid(self):
+        return self.popen.pid
+
+    def isRunning(self):
+        return self.result is None
+
+    ###########################################################################
+    # Wait for the process to finish and return its ProcessResult
+    ###########################################################################
+    def wait(self):
+        if self.result is not None:
+            return self.result
+        try:
+            while True:
+                try:
+                    pid, status, rusage = os.wait4(self.popen.pid, 0)
+                    break
+                except OSError, e:
+                    if e.errno != errno.EINTR:
+                        raise
+        except KeyboardInterrupt:
+            self.kill()
+            raise
+        if os.WIFSIGNALED(status):
+            returnCode = -os.WTERMSIG(status)
+        else:
+            returnCode = os.WEXITSTATUS(status)
+        # we've reaped it ourselves, so Popen mustn't try to
+        self.popen.returncode = returnCode
+        if self.timer is not None:
+            self.timer.cancel()
+        self.result = ProcessResult(self.args, returnCode,
+                                    time.time() - self.startTime, rusage,
+                                    self.timedOut)
+        self.runner.finished(self)
+        return self.result
+
+    ###########################################################################
+    # Stop the process (and everything it started): SIGTERM first, then
+    # SIGKILL if it's still around killGrace seconds later
+    ###########################################################################
+    def kill(self):
+        if self.__signal(signal.SIGTERM) is True:
+            timer = Timer(RunningProcess.killGrace, self.__signal,
+                          [signal.SIGKILL])
+            timer.daemon = True
+            timer.start()
+
+    def __signal(self, sig):
+        if self.popen.returncode is not None:
+            return False
+        try:
+            os.killpg(self.popen.pid, sig)
+            return True
+        except OSError:
+            return False
+
+    def __timeout(self):
+        self.timedOut = True
+        self.kill()
+
+###############################################################################
+# Start processes with a prepared environment (os.environ by default)
+###############################################################################
+class ProcessRunner:
+    def __init__(self, env=None, metrics=None):
+        self.env = env
+        self.metrics = metrics
+        self.lock = Lock()
+        self.running = set()
+        atexit.register(self.cancel)
+
+    # Start a process.  Its output (stdout and stderr) is appended to
+    # logPath if given, otherwise it goes wherever ours does.  It's killed
+    # if it runs for longer than timeout seconds.
+    def start(self, args, logPath=None, timeout=None, cwd=None):
+        process = RunningProcess(self, args, logPath, timeout, cwd)
+        with self.lock:
+            self.running.add(process)
+        return process
+
+    ###########################################################################
+    # Run a process to completion.  Like system(), raises a RuntimeError
+    # if it fails (or times out).  Returns its ProcessResult otherwise.
+    ###########################################################################
+    def run(self, args, logPath=None, timeout=None, cwd=None):
+        return self.wait(self.start(args, logPath, timeout, cwd))
+
+    # Wait for a process we started, and check on it the same way run() does
+    def wait(self, process):
+        result = process.wait()
+        if result.timedOut is True:
+            raise RuntimeError("Command: %s timed out after %ds" % (
+                result.command(), process.timeout))
+        if result.returnCode != 0:
+            raise RuntimeError("Command: %s exited with non-zero status %i" % (
+                result.command(), result.returnCode))
+        return result
+
+    # Kill everything that's still running.  With a timeout, also wait (for
+    # up to that many seconds) until they've all been waited on.
+    def cancel(self, timeout=None):
+        with self.lock:
+            running = list(self.running)
+        for process in running:
+            process.kill()
+        if timeout is not None:
+            deadline = time.time() + timeout
+            while time.time() < deadline:
+                with self.lock:
+                    if len(self.running) == 0:
+                        break
+                time.sleep(1)
+
+    def finished(self, process):
+        with self.lock:
+            self.running.discard(process)
+        if self.metrics is not None:
+            result = process.result
+            self.metrics.record("process", command=os.path.basename(
+                result.args[0]), args=result.args[1:],
+                                status=result.returnCode,
+                                wall=result.wallTime, user=result.userTime,
+                                sys=result.sysTime, maxRss=result.maxRss,
+                                written=result.writtenBytes,
+                                timedOut=result.timedOut)
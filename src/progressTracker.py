@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+
+# Progressive Cactus Package
+# Copyright (C) 2009-2013 by Glenn Hickey (hickey@soe.ucsc.edu)
+# and Benedict Paten (benedictpaten@gmail.com)
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+import os
+import sys
+import time
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+###############################################################################
+# Keep track of when an alignment last did something useful.  A "signal" is
+# anything that changes while work is getting done: the size of the logs,
+# the job files in the jobTree, the size of the ktserver databases, the
+# mtimes of the HAL files and the cpu time used by the processes we
+# started.  Each signal remembers the last time it moved, so the time since
+# the latest of them tells us how long the alignment has been stuck for
+# (and which signal moved last tells us what it was doing).
+###############################################################################
+class ProgressTracker:
+    # process names whose cpu time doesn't count as progress: an idle
+    # ktserver still ticks over
+    ignoredProcesses = set(["ktserver"])
+
+    # minCpuRate: the cpu used by our child processes only counts as
+    # progress if it's at least this many cores' worth on average
+    def __init__(self, minCpuRate=0.05, rootPid=None):
+        self.minCpuRate = minCpuRate
+        if rootPid is None:
+            rootPid = os.getpid()
+        self.rootPid = rootPid
+        self.startTime = time.time()
+        # signal -> last value seen
+        self.values = dict()
+        # signal -> last time its value changed
+        self.lastMoved = dict()
+        # pid -> cpu seconds at the last sample
+        self.cpuTimes = None
+        self.lastCpuSample = None
+
+    # The signal moved
+    def progress(self, signal, now=None):
+        if now is None:
+            now = time.time()
+        self.lastMoved[signal] = now
+
+    # Look at the current value of a signal, which moved if it's not the
+    # same as last time
+    def observe(self, signal, value, now=None):
+        if signal not in self.values or self.values[signal] != value:
+            self.values[signal] = value
+            self.progress(signal, now)
+
+    # Sizes of the given (log) files, not counting the bytes in ownBytes
+    # (path -> bytes) that the caller wrote to them itself
+    def sampleFiles(self, signal, paths, now=None, ownBytes=None):
+        if ownBytes is None:
+            ownBytes = dict()
+        sizes = dict()
+        for path in paths:
+            try:
+                sizes[path] = os.path.getsize(path) - ownBytes.get(path, 0)
+            except OSError:
+                sizes[path] = None
+        self.observe(signal, sizes, now)
+
+    ###########################################################################
+    # Total cpu time used by the processes under rootPid (not counting
+    # ignoredProcesses) since the last sample.  Processes that have started
+    # since then count from zero, and the ones that have exited drop out.
+    ###########################################################################
+    def sampleCpu(self, now=None):
+        if psutil is None:
+            return
+        if now is None:
+            now = time.time()
+        cpuTimes = descendantCpuTimes(self.rootPid,
+                                      ProgressTracker.ignoredProcesses)
+        if self.cpuTimes is not None and now > self.lastCpuSample:
+            used = 0.
+            for pid, seconds in cpuTimes.items():
+                used += max(0., seconds - self.cpuTimes.get(pid, 0.))
+            if used / (now - self.lastCpuSample) >= self.minCpuRate:
+                self.progress("cpu", now)
+        self.cpuTimes = cpuTimes
+        self.lastCpuSample = now
+
+    # The last time any signal moved (or when we started, if none has)
+    def lastProgressTime(self):
+        return max(self.lastMoved.values() + [self.startTime])
+
+    def stalledTime(self, now=None):
+        if now is None:
+            now = time.time()
+        return max(0., now - self.lastProgressTime())
+
+    # (signal, last time it moved), most recent first
+    def history(self):
+        return sorted(self.lastMoved.items(), key=lambda x: -x[1])
+
+###############################################################################
+# pid -> user + system cpu seconds of every process under rootPid, other
+# than the ones named in ignore.  Works with both the old (get_*) and new
+# psutil interfaces.
+###############################################################################
+def descendantCpuTimes(rootPid, ignore=set()):
+    cpuTimes = dict()
+    try:
+        root = psutil.Process(rootPid)
+        children = psutilCall(root, "children", "get_children",
+                              recursive=True)
+    except (psutil.NoSuchProcess, psutil.AccessDenied):
+        return cpuTimes
+    for process in children:
+        try:
+            name = process.name
+            if callable(name):
+                name = name()
+            if name in ignore:
+                continue
+            times = psutilCall(process, "cpu_times", "get_cpu_times")
+            cpuTimes[process.pid] = times.user + times.system
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            pass
+    return cpuTimes
+
+def psutilCall(obj, name, oldName, *args, **kwargs):
+    if hasattr(obj, name):
+        return getattr(obj, name)(*args, **kwargs)
+    return getattr(obj, oldName)(*args, **kwargs)
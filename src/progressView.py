@@ -0,0 +1,301 @@
+#!/usr/bin/env python
+
+# Progressive Cactus Package
+# Copyright (C) 2009-2013 by Glenn Hickey (hickey@soe.ucsc.edu)
+# and Benedict Paten (benedictpaten@gmail.com)
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+import os
+import sys
+import cgi
+import json
+import time
+from threading import Thread, Lock
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+
+from projectWrapper import ProjectWrapper, subproblemGenomes
+from costModel import cpuHours
+from nodeProfile import formatTime, formatHours
+
+###############################################################################
+# Show how a running alignment is getting on, instead of leaving the user
+# to run jobTreeStatus --verbose in a loop.  The view is fed by the
+# JobStatusMonitor (see update()), so it costs nothing extra to keep up to
+# date, and it can be shown:
+# - on the terminal, rewritten in place after every poll.  The monitor's
+#   messages go through message(), which writes them above the view so
+#   they don't break the next redraw.
+# - as a page (and status.json) served over http on localhost
+# Every subproblem is done (its HAL file exists), running (its ktserver is
+# up), ready (everything it depends on is done) or pending.  The ETA is the
+# estimated cpu hours (see costModel.py) of the work left divided by the
+# estimated cpu hours of the subproblems that have finished so far in this
+# run per hour, so it's only as good as the cost model, and there isn't one
+# until the first subproblem is done.
+###############################################################################
+class ProgressView:
+    states = ["done", "running", "ready", "pending"]
+
+    # mcProj and experiments as returned by ProjectWrapper.readExperiments.
+    # Progress is written to outFile (if given) and served on port (if
+    # given).  The terminal view lists at most maxLines subproblems.
+    def __init__(self, mcProj, experiments, costs, outFile=None, port=None,
+                 maxLines=10):
+        self.costs = costs
+        self.outFile = outFile
+        self.maxLines = maxLines
+        self.lock = Lock()
+        self.startTime = time.time()
+        self.doneAtStart = None
+        self.status = None
+        # what's on the terminal, and the lock that keeps the monitor's
+        # threads from drawing over each other
+        self.shownLines = 0
+        self.shownText = None
+        self.drawLock = Lock()
+        # (event, depth) of every subproblem, parents first
+        self.events = []
+        tree = mcProj.mcTree
+        depths = dict()
+        for node in tree.preOrderTraversal():
+            depth = 0
+            if tree.hasParent(node):
+                depth = depths.get(tree.getParent(node), -1) + 1
+            depths[node] = depth
+            if tree.getName(node) in experiments:
+                self.events.append((tree.getName(node), depth))
+        self.deps = dict()
+        for event, exp in experiments.items():
+            self.deps[event] = [x for x in subproblemGenomes(exp, True)
+                                if x in experiments and x != event]
+        self.server = None
+        if port is not None:
+            self.server = StatusServer(self, port)
+            self.server.start()
+
+    ###########################################################################
+    # Take in a JobStatusMonitor.status() and redraw
+    ###########################################################################
+    def update(self, status):
+        with self.lock:
+            if self.doneAtStart is None:
+                self.doneAtStart = set(status["finishedEvents"])
+            self.status = status
+        if self.outFile is not None:
+            self.__draw(self.render(False))
+
+    # Write a message (to stderr) above the terminal view rather than
+    # across it, and redraw the view below it
+    def message(self, msg):
+        with self.drawLock:
+            lines = self.shownText
+            if lines is not None:
+                self.__erase()
+            sys.stderr.write(msg)
+            if not msg.endswith("\n"):
+                sys.stderr.write("\n")
+            sys.stderr.flush()
+            if lines is not None:
+                self.__drawLines(lines)
+
+    # Leave whatever was drawn last on the terminal, and stop serving
+    def stop(self):
+        if self.server is not None:
+            self.server.stop()
+        with self.drawLock:
+            self.shownLines = 0
+            self.shownText = None
+
+    def nodeStates(self):
+        states = dict()
+        if self.status is None:
+            return states
+        for event, depth in self.events:
+            if event in self.status["finishedEvents"]:
+                states[event] = "done"
+            elif event in self.status["liveEvents"]:
+                states[event] = "running"
+            elif len([x for x in self.deps[event] if x not in
+                      self.status["finishedEvents"]]) == 0:
+                states[event] = "ready"
+            else:
+                states[event] = "pending"
+        return states
+
+    ###########################################################################
+    # Summary of the run as a dict (the contents of status.json)
+    ###########################################################################
+    def summary(self):
+        with self.lock:
+            status = self.status
+            now = time.time()
+            states = self.nodeStates()
+            counts = dict([(x, states.values().count(x))
+                           for x in ProgressView.states])
+            total = sum(self.costs.values())
+            done = sum([self.costs[x] for x in states if states[x] == "done"])
+            doneNow = sum([self.costs[x] for x in states
+                           if states[x] == "done" and
+                           x not in self.doneAtStart])
+            elapsed = now - self.startTime
+            rate = None
+            eta = None
+            if doneNow > 0 and elapsed > 0:
+                rate = doneNow / (elapsed / 3600.)
+                eta = (total - done) / rate * 3600.
+            result = { "time" : now, "elapsed" : elapsed, "states" : states,
+                       "counts" : counts, "totalCpuHours" : total,
+                       "doneCpuHours" : done, "cpuHoursPerHour" : rate,
+                       "eta" : eta }
+            if status is not None:
+                for key in ["activeJobs", "failedJobs", "retryingJobs",
+                            "ktservers", "stalledTime", "inDeadlock"]:
+                    result[key] = status[key]
+            return result
+
+    ###########################################################################
+    # The view as a list of lines.  The full view lists every subproblem
+    # as a tree, otherwise only the running ones are listed.
+    ###########################################################################
+    def render(self, full):
+        summary = self.summary()
+        counts = summary["counts"]
+        lines = ["Progressive Cactus alignment: %s elapsed" % formatTime(
+            summary["elapsed"])]
+        if "activeJobs" not in summary:
+            lines.append("Waiting for the first update")
+            return lines
+        percent = 0.
+        if summary["totalCpuHours"] > 0:
+            percent = 100. * summary["doneCpuHours"] / summary[
+                "totalCpuHours"]
+        lines.append("Subproblems: %d done, %d running, %d ready, %d pending "
+                     "(%.1f%% of estimated work)" % (
+                         counts["done"], counts["running"], counts["ready"],
+                         counts["pending"], percent))
+        lines.append("Jobs: %d active, %d failed, %d retrying.  "
+                     "ktservers: %d" % (
+                         summary["activeJobs"], summary["failedJobs"],
+                         summary["retryingJobs"], summary["ktservers"]))
+        lines.append("Throughput: %s estimated cpu hours per hour.  "
+                     "ETA: %s" % (formatHours(summary["cpuHoursPerHour"]),
+                                  formatTime(summary["eta"])))
+        stalled = "Last sign of progress: %s ago" % formatTime(
+            summary["stalledTime"])
+        if summary["inDeadlock"] is True:
+            stalled += " (suspected deadlock)"
+        lines.append(stalled)
+        states = summary["states"]
+        if full is True:
+            lines.append("")
+            for event, depth in self.events:
+                lines.append("%s%s  %s  %s" % (
+                    "  " * depth, event, states[event],
+                    formatHours(self.costs.get(event))))
+        else:
+            running = [x for x, depth in self.events
+                       if states[x] == "running"]
+            for event in running[:self.maxLines]:
+                lines.append("  running: %s" % event)
+            if len(running) > self.maxLines:
+                lines.append("  ... and %d more" % (len(running) -
+                                                    self.maxLines))
+        return lines
+
+    # Replace what we drew last time
+    def __draw(self, lines):
+        with self.drawLock:
+            self.__erase()
+            self.__drawLines(lines)
+
+    # ANSI: go up as many lines as we drew, then clear to the end of the
+    # screen
+    def __erase(self):
+        if self.shownLines > 0:
+            self.outFile.write("\x1b[%dF\x1b[J" % self.shownLines)
+            self.outFile.flush()
+            self.shownLines = 0
+
+    def __drawLines(self, lines):
+        self.outFile.write("\n".join(lines) + "\n")
+        self.outFile.flush()
+        self.shownLines = len(lines)
+        self.shownText = lines
+
+###############################################################################
+# Serve a ProgressView on http://localhost:<port>/ (and the summary as
+# json on /status.json) from a daemon thread
+###############################################################################
+class StatusServer(Thread):
+    refreshTime = 30
+
+    def __init__(self, view, port):
+        Thread.__init__(self)
+        self.daemon = True
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] == "/status.json":
+                    summary = view.summary()
+                    body = json.dumps(summary, sort_keys=True)
+                    contentType = "application/json"
+                else:
+                    body = "<html><head><title>Progressive Cactus</title>" \
+                           "<meta http-equiv=\"refresh\" content=\"%d\">" \
+                           "</head><body><pre>%s</pre></body></html>" % (
+                               StatusServer.refreshTime,
+                               cgi.escape("\n".join(view.render(True))))
+                    contentType = "text/html"
+                self.send_response(200)
+                self.send_header("Content-Type", contentType)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+        try:
+            self.httpd = HTTPServer(("localhost", port), Handler)
+        except Exception, e:
+            raise RuntimeError("Unable to serve status page on port %d: %s" %
+                               (port, str(e)))
+
+    def run(self):
+        self.httpd.serve_forever()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+###############################################################################
+# Estimated cpu hours of every subproblem of the project in workDir (see
+# planner.py)
+###############################################################################
+def subproblemCosts(projWrapper, experiments):
+    bases = projWrapper.subproblemBases(experiments)
+    costs = dict()
+    for event, exp in experiments.items():
+        costs[event] = cpuHours(bases[event],
+                                len(subproblemGenomes(exp, True)))
+    return costs
+
+# A ProgressView of the project that projWrapper has set up
+def projectProgressView(projWrapper, outFile=None, port=None):
+    mcProj, experiments = projWrapper.readExperiments(
+        os.path.join(projWrapper.workingDir, ProjectWrapper.alignmentDirName))
+    return ProgressView(mcProj, experiments,
+                        subproblemCosts(projWrapper, experiments), outFile,
+                        port)
@@ -33,11 +33,11 @@ import socket
 import signal
 import traceback
 import datetime
+import shutil
 
 from sonLib.bioio import logger
 from sonLib.bioio import setLoggingFromOptions
 from sonLib.bioio import getTempDirectory
-from sonLib.bioio import system
 from sonLib.bioio import popenCatch
 
 from jobTree.scriptTree.target import Target 
@@ -52,6 +52,16 @@ from cactus.shared.configWrapper import ConfigWrapper
 from seqFile import SeqFile
 from projectWrapper import ProjectWrapper
 from jobStatusMonitor import JobStatusMonitor
+from runMetrics import RunMetrics
+from nodeProfile import profileProject, writeProfile
+from halExporter import HalExporter
+from processRunner import ProcessRunner, RunningProcess, loadEnvironment
+from trash import Trash
+from planner import planProject, writePlan
+from ktServerRegistry import KtServerReaper, installReaper, reapWorkDir
+from ktServerRegistry import runActivity
+from progressView import projectProgressView
+from portAllocator import PortAllocator
 
 def initParser():
     usage = "usage: runProgressiveCactus.sh [options] <seqFile> <workDir> <outputHalFile>\n\n"\
@@ -93,21 +103,104 @@ def initParser():
     parser.add_option("--autoAbortOnDeadlock", dest="autoAbortOnDeadlock",
                       action="store_true",
                       help="Abort automatically when jobTree monitor" +
-                      " suspects a deadlock by deleting the jobTree folder." +
-                      " Will guarantee no trailing ktservers but still " +
-                      " dangerous to use until we can more robustly detect " +
-                      " deadlocks.",
+                      " suspects a deadlock by stopping cactus and then" +
+                      " shutting down its ktservers.  The jobTree folder" +
+                      " is left in place.  A slow enough alignment could" +
+                      " still be mistaken for a deadlock (see" +
+                      " --deadlockTime).",
                       default=False)
+    parser.add_option("--deadlockTime", dest="deadlockTime", type=int,
+                      help="Seconds without any sign of progress (log " +
+                      "output, job changes, database changes, HAL output " +
+                      "or cpu use) while ktservers are running before the " +
+                      "jobTree monitor suspects a deadlock [default: " +
+                      "%default]", default=1800)
     parser.add_option("--overwrite", dest="overwrite", action="store_true",
                       help="Re-align nodes in the tree that have already" +
                       " been successfully aligned.",
                       default=False)
+    parser.add_option("--reuseSubtrees", dest="reuseSubtrees",
+                      action="store_true",
+                      help="If the input has changed since the alignment in" +
+                      " the working directory was started, keep the" +
+                      " alignments of all subtrees whose sequences, tree" +
+                      " and configuration are unchanged and only realign" +
+                      " the rest.",
+                      default=False)
     parser.add_option("--rootOutgroupDists", dest="rootOutgroupDists",
                       help="root outgroup distance (--rootOutgroupPaths must " +
                       "be given as well)", default=None)
     parser.add_option("--rootOutgroupPaths", dest="rootOutgroupPaths", type=str,
                       help="root outgroup path (--rootOutgroup must be given " +
                       "as well)", default=None)
+    parser.add_option("--sanityCheckThreads", dest="sanityCheckThreads",
+                      type=int, help="Maximum number of input sequences to "
+                      "check (or decompress, if gzipped) concurrently "
+                      "before starting the alignment "
+                      "[default: number of cpus]", default=None)
+    parser.add_option("--prometheusFile", dest="prometheusFile",
+                      help="Keep the latest run metrics (which are always "
+                      "logged to <workDir>/%s) in this file in " % (
+                          RunMetrics.fileName) +
+                      "Prometheus text format", default=None)
+    parser.add_option("--profile", dest="profile", action="store_true",
+                      help="Write a report of the time and memory used by "
+                      "each subproblem to <workDir>/cactus_profile.txt "
+                      "once the alignment is done", default=False)
+    parser.add_option("--halExportThreads", dest="halExportThreads",
+                      type=int, help="Export each subproblem to HAL as soon "
+                      "as it's aligned, using up to this many threads, and "
+                      "merge the pieces at the end, instead of exporting "
+                      "the whole alignment after it's done", default=None)
+    parser.add_option("--seqCacheDir", dest="seqCacheDir",
+                      help="Directory (which can be shared between runs) "
+                      "where preprocessed sequences are cached, so the same "
+                      "genome preprocessed with the same settings is only "
+                      "done once", default=None)
+    parser.add_option("--seqCacheSize", dest="seqCacheSize",
+                      help="Evict the least recently used sequences from "
+                      "--seqCacheDir when it grows bigger than this (ex "
+                      "500g) [default: no limit]", default=None)
+    parser.add_option("--cleanupThreads", dest="cleanupThreads", type=int,
+                      help="Old data (previous jobTree, overwritten project) "
+                      "is moved into <workDir>/.trash and deleted in the "
+                      "background, this many directories at a time "
+                      "[default: %default]", default=2)
+    parser.add_option("--cleanupNice", dest="cleanupNice", type=int,
+                      help="CPU priority (nice level) of the background "
+                      "deletion [default: %default]", default=19)
+    parser.add_option("--cleanupIoClass", dest="cleanupIoClass",
+                      type="choice", choices=["idle", "best-effort", "none"],
+                      help="ionice class of the background deletion (idle, "
+                      "best-effort or none) [default: %default]",
+                      default="idle")
+    parser.add_option("--plan", dest="plan", action="store_true",
+                      help="Print the subproblems the alignment would be "
+                      "broken into, with estimates of their cpu, memory and "
+                      "ktserver needs and of the critical path, then exit "
+                      "without aligning anything (only <seqFile> is needed)",
+                      default=False)
+    parser.add_option("--reap", dest="reap", action="store_true",
+                      help="Shut down any ktservers still running for the "
+                      "alignment in <workDir> (ex: after the run was killed) "
+                      "then exit (<workDir> can be given on its own, or "
+                      "with the other arguments as usual).  This is "
+                      "done automatically whenever the aligner exits",
+                      default=False)
+    parser.add_option("--force", dest="force", action="store_true",
+                      help="With --reap, shut the ktservers down even if "
+                      "the alignment looks like it's still running",
+                      default=False)
+    parser.add_option("--progress", dest="progress", action="store_true",
+                      help="Show which subproblems are done, running or "
+                      "pending, the active jobs and ktservers, and an ETA, "
+                      "updated in place on the terminal while aligning",
+                      default=False)
+    parser.add_option("--statusPort", dest="statusPort", type=int,
+                      help="Serve the same progress information as "
+                      "--progress (with the whole tree) on "
+                      "http://localhost:<statusPort>/ while aligning, and "
+                      "as json on /status.json", default=None)
     parser.add_option("--root", dest="root", help="Name of ancestral node (which"
                       " must appear in NEWICK tree in <seqfile>) to use as a "
                       "root for the alignment.  Any genomes not below this node "
@@ -124,6 +217,17 @@ def initParser():
                        help="starting port (lower bound of range) of ktservers"
                        " [default: %default]",
                        default=1978)
+    ktGroup.add_option("--ktFixedPort", dest="ktFixedPort",
+                       action="store_true",
+                       help="Use --ktPort as it is, instead of reserving a "
+                       "range of ports at or above it that no other run or "
+                       "process on this machine is using",
+                       default=False)
+    ktGroup.add_option("--ktPortLockDir", dest="ktPortLockDir",
+                       help="Directory where runs on this machine record the "
+                       "ktserver ports they've reserved [default: "
+                       "progressiveCactusPorts in the system temp dir]",
+                       default=None)
     ktGroup.add_option("--ktHost", dest="ktHost",
                        help="The hostname to use for connections to the "
                        "ktserver (this just specifies where nodes will attempt"
@@ -148,6 +252,27 @@ def initParser():
                        help="ktserver options when opening existing db "\
                             "(ex #opts=ls#ktopts=p)",
                        default=None)
+    ktGroup.add_option("--ktAutoTune", dest="ktAutoTune",
+                       action="store_true",
+                       help="Set the bucket count and memory map size of each"
+                       " subproblem's database from the size of the genomes"
+                       " it aligns, and use an on-disk database for any"
+                       " subproblem that wouldn't fit in --ktMaxMemory.  "
+                       "Values given in --ktCreateTuning take precedence.",
+                       default=False)
+    ktGroup.add_option("--ktMaxMemory", dest="ktMaxMemory",
+                       help="Memory available to a single ktserver when "
+                       "using --ktAutoTune (ex 200g) [default: physical "
+                       "memory of this machine]",
+                       default=None)
+    ktGroup.add_option("--ktProbeTimeout", dest="ktProbeTimeout", type=int,
+                       help="Seconds to wait for a ktserver to answer when "
+                       "checking on it during the run [default: %default]",
+                       default=10)
+    ktGroup.add_option("--ktProbeThreads", dest="ktProbeThreads", type=int,
+                       help="Maximum number of ktservers to check on at once "
+                       "[default: %default]",
+                       default=16)
     parser.add_option_group(ktGroup)
  
     return parser
@@ -191,15 +316,15 @@ def validateInput(workDir, outputHalFile, options):
 # Convert the jobTree options taken in by the parser back
 # out to command line options to pass to progressive cactus
 def getJobTreeCommands(jtPath, parser, options):
-    cmds = "--jobTree %s" % jtPath
+    cmds = ["--jobTree", jtPath]
     for optGroup in parser.option_groups:
         if optGroup.title.startswith("jobTree") or optGroup.title.startswith("Jobtree"):
             for opt in optGroup.option_list:
                 if hasattr(options, opt.dest) and \
                     getattr(options, opt.dest) != optGroup.defaults[opt.dest]:
-                    cmds += " %s" % str(opt)
+                    cmds.append(opt.get_opt_string())
                     if opt.nargs > 0:
-                        cmds += " \"%s\"" % getattr(options, opt.dest)
+                        cmds.append(str(getattr(options, opt.dest)))
     return cmds
 
 # Go through a text file and add every word inside to an arguments list
@@ -227,63 +352,95 @@ def getEnvFilePath():
 
 # If specified with the risky --autoAbortOnDeadlock option, we call this to
 # force an abort if the jobStatusMonitor thinks it's hopeless.
-# We delete the jobTreePath to get rid of kyoto tycoons.
-def abortFunction(jtPath, options):
+# We stop cactus first (and wait for it to exit), so nothing is still
+# writing to the jobTree or starting ktservers, then shut down the
+# ktservers it left behind.  The jobTree is left as it is, so the run can
+# be looked into or restarted.
+def abortFunction(workDir, jtPath, options, runner):
     def afClosure():
-        sys.stderr.write('\nAborting due to deadlock (prevent with'
-                         + '--noAutoAbort' +
-                         ' option), and running rm -rf %s\n\n' % jtPath)
-        system('rm -rf %s' % jtPath)
-        sys.exit(-1)
+        sys.stderr.write('\nAborting due to deadlock (prevent by leaving out'
+                         ' the --autoAbortOnDeadlock option).  Stopping '
+                         'cactus and its ktservers, and leaving the jobTree'
+                         ' in %s\n\n' % jtPath)
+        runner.cancel(RunningProcess.killGrace + 10)
+        if options.database == "kyoto_tycoon":
+            reapWorkDir(workDir, KtServerReaper(
+                options.ktProbeTimeout, maxConcurrent=options.ktProbeThreads))
     if options.autoAbortOnDeadlock:
         return afClosure
     else:
         return None
     
 # Run cactus progressive on the project that has been created in workDir.
-# Any jobtree options are passed along.  Should probably look at redirecting
-# stdout/stderr in the future.
-def runCactus(workDir, jtCommands, jtPath, options):
-    envFile = getEnvFilePath()
+# Any jobtree options are passed along, and its output goes to cactus.log.
+def runCactus(workDir, jtCommands, jtPath, options, runner, metrics=None,
+              halExporter=None, progressView=None, batchMonitor=None):
     pjPath = os.path.join(workDir, ProjectWrapper.alignmentDirName,
                           '%s_project.xml' % ProjectWrapper.alignmentDirName)
     logFile = os.path.join(workDir, 'cactus.log')
 
+    cmd = ["cactus_progressive.py"] + jtCommands + [pjPath]
     if options.overwrite:
-        overwriteFlag = '--overwrite'
-        system("rm -f %s" % logFile)
-    else:
-        overwriteFlag = ''
+        cmd.append("--overwrite")
+        if os.path.exists(logFile):
+            os.remove(logFile)
 
     logHandle = open(logFile, "a")
     logHandle.write("\n%s: Beginning Progressive Cactus Alignment\n\n" % str(
         datetime.datetime.now()))
     logHandle.close()
-    cmd = '. %s && cactus_progressive.py %s %s %s >> %s 2>&1' % (envFile,
-                                                                 jtCommands,
-                                                                 pjPath,
-                                                                 overwriteFlag,
-                                                                 logFile)
+    if metrics is not None:
+        metrics.stageStart("alignment")
     jtMonitor = JobStatusMonitor(jtPath, pjPath, logFile,
-                                 deadlockCallbackFn=abortFunction(jtPath,
-                                                                  options))
-    if options.database == "kyoto_tycoon":
+                                 deadlockTime=options.deadlockTime,
+                                 deadlockCallbackFn=abortFunction(
+                                     workDir, jtPath, options, runner),
+                                 ktProbeTimeout=options.ktProbeTimeout,
+                                 ktProbeThreads=options.ktProbeThreads,
+                                 metrics=metrics, workDir=workDir)
+    if progressView is not None:
+        jtMonitor.statusCallbackFn = progressView.update
+        jtMonitor.messageCallbackFn = progressView.message
+    if halExporter is not None:
+        halExporter.start()
+        
+    process = runner.start(cmd, logPath=logFile)
+    # only cpu used by cactus (and whatever it starts) counts as progress
+    jtMonitor.progress.rootPid = process.pid()
+    if batchMonitor is not None:
+        batchMonitor.add(workDir, jtMonitor)
+    elif options.database == "kyoto_tycoon" or progressView is not None:
         jtMonitor.daemon = True
         jtMonitor.start()
-        
-    system(cmd)
+    try:
+        runner.wait(process)
+    except RuntimeError:
+        if jtMonitor.inDeadlock is True and \
+               options.autoAbortOnDeadlock is True:
+            raise RuntimeError("Aborted due to deadlock (no progress for "
+                               "%ds)" % options.deadlockTime)
+        raise
+    finally:
+        if progressView is not None:
+            progressView.stop()
+        if batchMonitor is not None:
+            batchMonitor.remove(workDir)
     logHandle = open(logFile, "a")
     logHandle.write("\n%s: Finished Progressive Cactus Alignment\n" % str(
         datetime.datetime.now()))
     logHandle.close()
+    if metrics is not None:
+        metrics.stageEnd("alignment")
 
 def checkCactus(workDir, options):
     pass
 
 # Call cactus2hal to extract a single hal file out of the progressive
 # alignmenet in the working directory.  If the maf option was set, we
-# just move out the root maf.  
-def extractOutput(workDir, outputHalFile, options):
+# just move out the root maf.  If a HalExporter was running alongside the
+# alignment, it only has to finish up and merge its pieces instead.
+def extractOutput(workDir, outputHalFile, options, runner, metrics=None,
+                  halExporter=None):
     if options.outputMaf is not None:
         mcProj = MultiCactusProject()
         mcProj.readXML(
@@ -292,9 +449,7 @@ def extractOutput(workDir, outputHalFile, options):
         rootName = mcProj.mcTree.getRootName()
         rootPath = os.path.join(workDir, ProjectWrapper.alignmentDirName,
         rootName, rootName + '.maf')
-        cmd = 'mv %s %s' % (rootPath, options.outputMaf)
-        system(cmd)
-    envFile = getEnvFilePath()
+        shutil.move(rootPath, options.outputMaf)
     logFile = os.path.join(workDir, 'cactus.log')
     pjPath = os.path.join(workDir, ProjectWrapper.alignmentDirName,
                           '%s_project.xml' % ProjectWrapper.alignmentDirName)
@@ -302,19 +457,113 @@ def extractOutput(workDir, outputHalFile, options):
     logHandle.write("\n\n%s: Beginning HAL Export\n\n" % str(
         datetime.datetime.now()))
     logHandle.close()
-    cmd = '. %s && cactus2hal.py %s %s >> %s 2>&1' % (envFile, pjPath,
-                                                      outputHalFile, logFile)
-    system(cmd)
+    if metrics is not None:
+        metrics.stageStart("halExport")
+    if halExporter is not None:
+        halExporter.finish(outputHalFile)
+    else:
+        runner.run(["cactus2hal.py", pjPath, outputHalFile],
+                   logPath=logFile)
     logHandle = open(logFile, "a")
     logHandle.write("\n%s: Finished HAL Export \n" % str(
         datetime.datetime.now()))
     logHandle.close()
+    if metrics is not None:
+        metrics.stageEnd("halExport", bytes=os.path.getsize(outputHalFile))
+
+# Write the per-subproblem profile of the run.  This is only for
+# information, so we never want it to make the run fail
+def reportProfile(workDir, jtPath, out=sys.stdout):
+    profilePath = os.path.join(workDir, "cactus_profile.txt")
+    try:
+        profileFile = open(profilePath, "w")
+        writeProfile(profileProject(workDir, jtPath), profileFile)
+        profileFile.close()
+        out.write("Profile of subproblems written to %s\n" % profilePath)
+    except Exception, e:
+        sys.stderr.write("Unable to write profile %s: %s\n" % (profilePath,
+                                                              str(e)))
+
+# Add the preprocessed sequences to the cache.  The cache is only there to
+# save time in later runs, so we never want it to make this one fail
+def cacheSequences(projWrapper):
+    try:
+        projWrapper.storeCachedSequences()
+    except Exception, e:
+        sys.stderr.write("Unable to update sequence cache %s: %s\n" % (
+            projWrapper.options.seqCacheDir, str(e)))
+
+###############################################################################
+# Align the genomes in seqFilePath into outputHalFile, using workDir for
+# everything in between.  state["stage"] is kept up to date (1: alignment,
+# 2: HAL export) so the caller can say where things went wrong.  A batch
+# passes its BatchMonitor, which keeps an eye on the alignment instead of
+# a JobStatusMonitor thread of its own.
+###############################################################################
+def alignSeqFile(seqFilePath, workDir, outputHalFile, options, parser, runner,
+                 metrics, state, batchMonitor=None, out=sys.stdout):
+    metrics.stageStart("validation")
+    seqFile = SeqFile(seqFilePath,
+                      cachePath=os.path.join(workDir, "sanityCheck.json"),
+                      numThreads=options.sanityCheckThreads)
+    metrics.stageEnd("validation", genomes=len(seqFile.pathMap))
+
+    jtPath = os.path.join(workDir, "jobTree")
+    state["stage"] = 1
+    out.write("\nBeginning Alignment\n")
+    trash = Trash(workDir, options.cleanupThreads, options.cleanupNice,
+                  options.cleanupIoClass)
+    trash.discard(jtPath)
+    metrics.stageStart("project")
+    projWrapper = ProjectWrapper(options, seqFile, workDir, runner, trash)
+    portAllocator = None
+    if options.database == "kyoto_tycoon" and options.ktFixedPort is False:
+        portAllocator = PortAllocator(options.ktPortLockDir)
+        projWrapper.reserveKtPorts(portAllocator)
+    try:
+        projWrapper.writeXml()
+        metrics.stageEnd("project")
+        # whatever was replaced gets deleted in the background while we run
+        trash.empty()
+        jtCommands = getJobTreeCommands(jtPath, parser, options)
+        halExporter = None
+        if options.halExportThreads is not None:
+            halExporter = HalExporter(
+                os.path.join(workDir, ProjectWrapper.alignmentDirName,
+                             '%s_project.xml' %
+                             ProjectWrapper.alignmentDirName),
+                workDir, runner, os.path.join(workDir, 'cactus.log'),
+                options.halExportThreads)
+        progressView = None
+        if options.progress is True or options.statusPort is not None:
+            progressView = projectProgressView(
+                projWrapper, sys.stdout if options.progress else None,
+                options.statusPort)
+        runCactus(workDir, jtCommands, jtPath, options, runner,
+                  metrics, halExporter, progressView, batchMonitor)
+        runner.run(["jobTreeStatus", "--failIfNotComplete", "--jobTree",
+                    jtPath], logPath=os.devnull)
+        if options.seqCacheDir is not None:
+            cacheSequences(projWrapper)
+
+        state["stage"] = 2
+        out.write("Beginning HAL Export\n")
+        extractOutput(workDir, outputHalFile, options, runner, metrics,
+                      halExporter)
+        metrics.record("run_end", status="success")
+        if options.profile is True:
+            reportProfile(workDir, jtPath, out)
+    finally:
+        if projWrapper.portReservation is not None:
+            portAllocator.release(projWrapper.portReservation)
 
 def main():
     # init as dummy function
     cleanKtFn = lambda x,y:x
-    stage = -1
+    # the stage we got to
+    state = { "stage" : -1 }
     workDir = None
+    metrics = None
     try:
         parser = initParser()
         options, args = parser.parse_args()
@@ -325,37 +574,57 @@ def main():
         if len(args) == 0:
             parser.print_help()
             return 1
-        if len(args) != 3:
+        singleArg = options.plan is True or options.reap is True
+        if len(args) != 3 and not (singleArg and len(args) == 1):
             raise RuntimeError("Error parsing command line. Exactly 3 arguments are required but %d arguments were detected: %s" % (len(args), str(args)))
         
         if options.optionsFile != None:
             fileArgs = parseOptionsFile(options.optionsFile)
             options, args = parser.parse_args(fileArgs + sys.argv[1:])
-            if len(args) != 3:
+            singleArg = options.plan is True or options.reap is True
+            if len(args) != 3 and not (singleArg and len(args) == 1):
                 raise RuntimeError("Error parsing options file.  Make sure all "
                                    "options have -- prefix")
-        stage = 0
+        state["stage"] = 0
         setLoggingFromOptions(options)
-        seqFile = SeqFile(args[0])
+        if options.plan is True:
+            seqFile = SeqFile(args[0], numThreads=options.sanityCheckThreads)
+            plans, rootName, maxParallel = planProject(
+                options, seqFile, ProcessRunner(loadEnvironment(
+                    getEnvFilePath())))
+            writePlan(plans, rootName, maxParallel, options, sys.stdout)
+            return 0
+        reaper = KtServerReaper(options.ktProbeTimeout,
+                                maxConcurrent=options.ktProbeThreads)
+        if options.reap is True:
+            # either just <workDir>, or the usual three arguments
+            if len(args) == 3:
+                reapDir = args[1]
+            else:
+                reapDir = args[0]
+            if not os.path.isdir(reapDir):
+                raise RuntimeError("Working directory %s not found" %
+                                   reapDir)
+            activity = runActivity(reapDir)
+            if len(activity) > 0 and options.force is False:
+                raise RuntimeError("The alignment in %s looks like it's "
+                                   "still running (%s).  Stop it first, or "
+                                   "use --force to shut its ktservers down "
+                                   "anyway" % (reapDir, "; ".join(activity)))
+            if reapWorkDir(reapDir, reaper, sys.stdout) > 0:
+                raise RuntimeError("Some ktservers could not be stopped. "
+                                   "Removing %s will make them exit" %
+                                   os.path.join(reapDir, "jobTree"))
+            return 0
         workDir = args[1]
         outputHalFile = args[2]
         validateInput(workDir, outputHalFile, options)
-
-        jtPath = os.path.join(workDir, "jobTree")
-        stage = 1
-        print "\nBeginning Alignment"
-        system("rm -rf %s" % jtPath) 
-        projWrapper = ProjectWrapper(options, seqFile, workDir)
-        projWrapper.writeXml()
-        jtCommands = getJobTreeCommands(jtPath, parser, options)
-        runCactus(workDir, jtCommands, jtPath, options)
-        cmd = 'jobTreeStatus --failIfNotComplete --jobTree %s > /dev/null 2>&1 ' %\
-              jtPath
-        system(cmd)
-
-        stage = 2
-        print "Beginning HAL Export"
-        extractOutput(workDir, outputHalFile, options)
+        metrics = RunMetrics(workDir, options.prometheusFile)
+        runner = ProcessRunner(loadEnvironment(getEnvFilePath()), metrics)
+        if options.database == "kyoto_tycoon":
+            installReaper([workDir], reaper, runner)
+        alignSeqFile(args[0], workDir, outputHalFile, options, parser,
+                     runner, metrics, state)
         print "Success.\n" "Temporary data was left in: %s\n" \
               % workDir
         
@@ -363,12 +632,16 @@ def main():
     
     except RuntimeError, e:
         sys.stderr.write("Error: %s\n\n" % str(e))
-        if stage >= 0 and workDir is not None and os.path.isdir(workDir):
+        if metrics is not None:
+            metrics.record("run_end", status="failed", stage=state["stage"],
+                           error=str(e))
+        if state["stage"] >= 0 and workDir is not None and \
+               os.path.isdir(workDir):
             sys.stderr.write("Temporary data was left in: %s\n" % workDir)
-        if stage == 1:
+        if state["stage"] == 1:
             sys.stderr.write("More information can be found in %s\n" %
                              os.path.join(workDir, "cactus.log"))
-        elif stage == 2:
+        elif state["stage"] == 2:
             sys.stderr.write("More information can be found in %s\n" %
                              os.path.join(workDir, "cactus.log"))
         return -1
@@ -0,0 +1,388 @@
+#!/usr/bin/env python
+
+# Progressive Cactus Package
+# Copyright (C) 2009-2013 by Glenn Hickey (hickey@soe.ucsc.edu)
+# and Benedict Paten (benedictpaten@gmail.com)
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+import os
+import sys
+import copy
+import time
+from time import sleep
+from threading import Thread, Lock, Condition
+
+from sonLib.bioio import setLoggingFromOptions
+
+from progressiveCactus import initParser, parseOptionsFile, validateInput
+from progressiveCactus import alignSeqFile, getEnvFilePath
+from seqFile import SeqFile
+from costModel import TreeCost, physicalMemory, parseBytes
+from runMetrics import RunMetrics
+from processRunner import ProcessRunner, loadEnvironment
+from nodeProfile import formatBytes, formatTime
+from ktServerRegistry import KtServerReaper, installReaper
+
+###############################################################################
+# Run many independent alignments from one process, instead of one
+# runProgressiveCactus.sh per alignment each with its own monitor thread
+# and its own idea of which ktserver ports and how much of the machine it
+# can use.  The manifest lists one alignment per line:
+#   <seqFile> <workDir> <outputHalFile>
+# (blank lines and lines starting with # are ignored).  Every alignment
+# gets the same options, except that:
+# - at most --batchMaxRuns alignments run at once, and an alignment only
+#   starts if its estimated peak memory (see costModel.py) fits in what
+#   the running ones leave of --batchMaxMemory (or nothing else is running)
+# - each running alignment reserves its own range of ktserver ports at or
+#   above --ktPort, with room for its maxParallelSubtrees, through the
+#   PortAllocator, which skips past the ranges of the others (and anything
+#   else in use)
+# - jobTree's --maxThreads is split between the alignments that can run
+#   at once, as each one starts (see BatchScheduler.threadShare)
+# - a single BatchMonitor does the job of every alignment's
+#   JobStatusMonitor, and prints a combined status every --batchStatusTime
+###############################################################################
+
+# one line of the manifest
+class BatchRun:
+    def __init__(self, seqFilePath, workDir, outputHalFile):
+        self.seqFilePath = seqFilePath
+        self.workDir = workDir
+        self.outputHalFile = outputHalFile
+        self.memory = 0
+        # jobTree --maxThreads, set when it starts
+        self.threads = None
+        # pending, running, done or failed
+        self.state = "pending"
+        self.stage = { "stage" : -1 }
+        self.error = None
+        self.startTime = None
+        self.endTime = None
+
+def readManifest(path):
+    if not os.path.isfile(path):
+        raise RuntimeError("Manifest not found: %s" % path)
+    runs = []
+    workDirs = set()
+    outputs = set()
+    for lineNumber, line in enumerate(open(path, "r")):
+        tokens = line.split()
+        if len(tokens) == 0 or tokens[0][0] == "#":
+            continue
+        if len(tokens) != 3:
+            raise RuntimeError("Line %d of manifest %s should be <seqFile> "
+                               "<workDir> <outputHalFile>: %s" % (
+                                   lineNumber + 1, path, line.strip()))
+        workDir = os.path.abspath(tokens[1])
+        output = os.path.abspath(tokens[2])
+        if workDir in workDirs:
+            raise RuntimeError("workDir %s is used more than once in %s" % (
+                tokens[1], path))
+        if output in outputs:
+            raise RuntimeError("Output %s is used more than once in %s" % (
+                tokens[2], path))
+        workDirs.add(workDir)
+        outputs.add(output)
+        runs.append(BatchRun(tokens[0], tokens[1], tokens[2]))
+    if len(runs) == 0:
+        raise RuntimeError("No alignments found in manifest %s" % path)
+    return runs
+
+###############################################################################
+# One thread polling the JobStatusMonitors of all the running alignments.
+# Each poll runs in a thread of its own, and an alignment whose last poll
+# is still going (ex waiting on unreachable ktservers) is skipped, so a
+# slow alignment only holds up its own deadlock detection.
+###############################################################################
+class BatchMonitor(Thread):
+    def __init__(self, pollTime=60, statusTime=600, out=sys.stdout):
+        Thread.__init__(self)
+        self.pollTime = pollTime
+        self.statusTime = statusTime
+        self.out = out
+        self.lock = Lock()
+        # workDir -> JobStatusMonitor
+        self.monitors = dict()
+        self.daemon = True
+
+    def add(self, workDir, monitor):
+        with self.lock:
+            self.monitors[workDir] = monitor
+
+    def remove(self, workDir):
+        with self.lock:
+            if workDir in self.monitors:
+                del self.monitors[workDir]
+
+    def run(self):
+        lastStatus = time.time()
+        # workDir -> thread of its latest poll
+        polls = dict()
+        while True:
+            sleep(self.pollTime)
+            with self.lock:
+                monitors = sorted(self.monitors.items())
+            for workDir in polls.keys():
+                if not polls[workDir].is_alive():
+                    del polls[workDir]
+            for workDir, monitor in monitors:
+                if workDir not in polls:
+                    polls[workDir] = Thread(target=self.poll,
+                                            args=[workDir, monitor])
+                    polls[workDir].daemon = True
+                    polls[workDir].start()
+            now = time.time()
+            if now - lastStatus >= self.statusTime and len(monitors) > 0:
+                self.writeStatus(monitors)
+                lastStatus = now
+
+    def poll(self, workDir, monitor):
+        try:
+            monitor.pollOnce()
+        except Exception, e:
+            with self.lock:
+                self.out.write("Unable to check on %s: %s\n" % (
+                    workDir, str(e)))
+                self.out.flush()
+
+    def writeStatus(self, monitors):
+        lines = ["%s: %d alignments running" % (
+            time.strftime("%Y-%m-%d %H:%M:%S"), len(monitors))]
+        for workDir, monitor in monitors:
+            status = monitor.status()
+            line = "  %s: %d subproblems done, %d jobs, %d ktservers, " \
+                   "last progress %s ago" % (
+                       workDir, len(status["finishedEvents"]),
+                       status["activeJobs"], status["ktservers"],
+                       formatTime(status["stalledTime"]))
+            if status["inDeadlock"] is True:
+                line += " (suspected deadlock)"
+            lines.append(line)
+        self.out.write("\n".join(lines) + "\n")
+        self.out.flush()
+
+###############################################################################
+# Start the alignments of a batch as the limits allow, and wait for them
+# all to finish
+###############################################################################
+class BatchScheduler:
+    def __init__(self, runs, options, parser, maxRuns, maxMemory,
+                 monitor, out=sys.stdout):
+        self.runs = runs
+        self.options = options
+        self.parser = parser
+        self.maxRuns = max(1, maxRuns)
+        self.maxMemory = maxMemory
+        self.monitor = monitor
+        self.out = out
+        self.condition = Condition()
+        self.running = []
+        self.env = loadEnvironment(getEnvFilePath())
+
+    ###########################################################################
+    # Check every alignment's input and estimate its memory up front, so
+    # that bad manifest entries show up right away
+    ###########################################################################
+    def prepare(self):
+        for run in self.runs:
+            try:
+                validateInput(run.workDir, run.outputHalFile, self.options)
+                seqFile = SeqFile(run.seqFilePath, cachePath=os.path.join(
+                    run.workDir, "sanityCheck.json"),
+                                  numThreads=self.options.sanityCheckThreads)
+                run.memory = TreeCost(seqFile.tree,
+                                      seqFile.pathMap).peakMemory()
+            except RuntimeError, e:
+                self.__failed(run, e)
+
+    def run(self):
+        threads = []
+        while True:
+            with self.condition:
+                pending = [x for x in self.runs if x.state == "pending"]
+                if len(pending) == 0:
+                    break
+                fits = [x for x in pending if self.__fits(x)]
+                if len(fits) == 0:
+                    # short waits so that we still notice a ctrl-c
+                    self.condition.wait(1)
+                    continue
+                run = fits[0]
+                run.threads = self.threadShare(run, pending)
+                run.state = "running"
+                self.running.append(run)
+            thread = Thread(target=self.__align, args=[run])
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(1)
+        return [x for x in self.runs if x.state == "failed"]
+
+    def __fits(self, run):
+        if len(self.running) >= self.maxRuns:
+            return False
+        if len(self.running) == 0 or self.maxMemory is None:
+            return True
+        used = sum([x.memory for x in self.running])
+        return used + run.memory <= self.maxMemory
+
+    ###########################################################################
+    # jobTree threads for a run that's about to start (with the condition
+    # held).  jobTree can't change --maxThreads once it's running, so the
+    # split is decided up front: --maxThreads is divided between as many
+    # alignments as can be running along with this one, which is fewer than
+    # --batchMaxRuns near the end of the batch, and none for an alignment
+    # too big to share memory with any of the ones still pending.  It never
+    # takes more than the running alignments leave free.
+    ###########################################################################
+    def threadShare(self, run, pending):
+        if getattr(self.options, "maxThreads", None) is None:
+            return None
+        total = int(self.options.maxThreads)
+        free = total - sum([x.threads or 0 for x in self.running])
+        others = [x for x in pending if x is not run]
+        if len(self.running) == 0 and len(others) > 0 and \
+               self.maxMemory is not None and run.memory + min(
+            [x.memory for x in others]) > self.maxMemory:
+            concurrency = 1
+        else:
+            concurrency = min(self.maxRuns, len(self.running) + len(pending))
+        return max(1, min(free, total / max(1, concurrency)))
+
+    # the options of a single alignment: its share of the threads (its
+    # ktserver ports are reserved when it starts)
+    def runOptions(self, run):
+        options = copy.copy(self.options)
+        if run.threads is not None:
+            options.maxThreads = run.threads
+        return options
+
+    def __align(self, run):
+        run.startTime = time.time()
+        options = self.runOptions(run)
+        self.__write("%s: started (%s threads, estimated memory %s)" % (
+            run.workDir, run.threads, formatBytes(run.memory)))
+        devNull = open(os.devnull, "w")
+        metrics = None
+        try:
+            metrics = RunMetrics(run.workDir)
+            runner = ProcessRunner(self.env, metrics)
+            alignSeqFile(run.seqFilePath, run.workDir, run.outputHalFile,
+                         options, self.parser, runner, metrics, run.stage,
+                         self.monitor, devNull)
+            run.state = "done"
+            self.__write("%s: finished in %s" % (run.workDir, formatTime(
+                time.time() - run.startTime)))
+        except Exception, e:
+            if metrics is not None:
+                metrics.record("run_end", status="failed",
+                               stage=run.stage["stage"], error=str(e))
+            self.__failed(run, e)
+        finally:
+            devNull.close()
+            run.endTime = time.time()
+            with self.condition:
+                self.running.remove(run)
+                self.condition.notify_all()
+
+    def __failed(self, run, error):
+        run.state = "failed"
+        run.error = str(error)
+        message = "%s: failed: %s" % (run.workDir, run.error)
+        if run.stage["stage"] >= 1:
+            message += " (more information can be found in %s)" % (
+                os.path.join(run.workDir, "cactus.log"))
+        self.__write(message)
+
+    def __write(self, msg):
+        with self.condition:
+            self.out.write(msg + "\n")
+            self.out.flush()
+
+def initBatchParser():
+    parser = initParser()
+    parser.set_usage(
+        "usage: runProgressiveCactusBatch.sh [options] <manifest>\n\n"
+        "Required Arguments:\n"
+        "  <manifest>\t\tFile listing one alignment per line as\n"
+        "\t\t\t<seqFile> <workDir> <outputHalFile>\n\n"
+        "All other options apply to every alignment in the manifest.")
+    parser.add_option("--batchMaxRuns", dest="batchMaxRuns", type=int,
+                      help="Maximum number of alignments to run at once "
+                      "[default: %default]", default=4)
+    parser.add_option("--batchMaxMemory", dest="batchMaxMemory",
+                      help="Memory the alignments running at once can use "
+                      "between them, going by their estimated peak memory "
+                      "(ex 500g).  An alignment that needs more than this "
+                      "runs on its own. [default: physical memory of this "
+                      "machine]", default=None)
+    parser.add_option("--batchStatusTime", dest="batchStatusTime", type=int,
+                      help="Seconds between printing the status of the "
+                      "running alignments [default: %default]", default=600)
+    return parser
+
+def main():
+    parser = initBatchParser()
+    options, args = parser.parse_args()
+    if len(args) != 1:
+        parser.print_help()
+        return 1
+    try:
+        if options.optionsFile != None:
+            fileArgs = parseOptionsFile(options.optionsFile)
+            options, args = parser.parse_args(fileArgs + sys.argv[1:])
+        if options.outputMaf is not None:
+            raise RuntimeError("--outputMaf can't be used with a batch")
+        if options.database == "kyoto_tycoon" and options.ktFixedPort:
+            # the alignments would all start their ktservers on it
+            raise RuntimeError("--ktFixedPort can't be used with a batch")
+        setLoggingFromOptions(options)
+        # these only make sense for a single alignment
+        options.progress = False
+        options.statusPort = None
+        options.prometheusFile = None
+        if options.batchMaxMemory is not None:
+            maxMemory = parseBytes(options.batchMaxMemory)
+        else:
+            maxMemory = physicalMemory()
+        runs = readManifest(args[0])
+        if options.database == "kyoto_tycoon":
+            # each run's ProcessRunner cancels its own processes on exit
+            installReaper([x.workDir for x in runs], KtServerReaper(
+                options.ktProbeTimeout, maxConcurrent=options.ktProbeThreads))
+        monitor = BatchMonitor(statusTime=options.batchStatusTime)
+        monitor.start()
+        scheduler = BatchScheduler(runs, options, parser,
+                                   options.batchMaxRuns, maxMemory, monitor)
+        scheduler.prepare()
+        failed = scheduler.run()
+    except RuntimeError, e:
+        sys.stderr.write("Error: %s\n\n" % str(e))
+        return -1
+    sys.stdout.write("\n%d of %d alignments succeeded\n" % (
+        len(runs) - len(failed), len(runs)))
+    if len(failed) > 0:
+        sys.stdout.write("Failed: %s\n" % ", ".join(
+            [x.workDir for x in failed]))
+        return -1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -31,16 +31,57 @@ from optparse import OptionGroup
 import imp
 import string
 import socket
+import hashlib
+import json
 
-from sonLib.bioio import system, absSymPath
+from sonLib.bioio import absSymPath
 
-from seqFile import SeqFile
+from seqFile import SeqFile, sequenceSignature
+from costModel import TreeCost, numCpus, physicalMemory, parseBytes
+from costModel import ktTuning, genomeBases
+from portAllocator import PortAllocator, PortReservation, portInUse
+from portAllocator import isLocalHost
+from inputSequences import decompressInputs, inputDirName
+from sequenceCache import SequenceCache, cacheKey
+from processRunner import ProcessRunner
+from trash import Trash
+from compactTree import writeNewick
+from cactus.progressive.multiCactusProject import MultiCactusProject
 from cactus.shared.experimentWrapper import ExperimentWrapper
 from cactus.shared.experimentWrapper import DbElemWrapper
 from cactus.shared.configWrapper import ConfigWrapper
 from cactus.shared.common import cactusRootPath
 
 
+# Newick string for a tree that doesn't depend on the order in which
+# children happen to be stored
+def canonicalNewick(tree):
+    return writeNewick(tree, lambda node, string: string)
+
+# parse kyoto tycoon tuning options like #bnum=30m#msiz=50g into a dict
+def parseTuning(tuningString):
+    tuning = dict()
+    if tuningString is not None:
+        for token in tuningString.split("#"):
+            if "=" in token:
+                key, value = token.split("=", 1)
+                tuning[key] = value
+    return tuning
+
+# names of the genomes (leaves of the species tree) aligned in a
+# subproblem, optionally including its outgroups
+def subproblemGenomes(exp, withOutgroups):
+    outgroups = exp.getOutgroupEvents()
+    if outgroups is None:
+        outgroups = []
+    tree = exp.getTree()
+    names = []
+    for node in tree.postOrderTraversal():
+        name = tree.getName(node)
+        if tree.isLeaf(node) and (withOutgroups or name not in outgroups):
+            names.append(name)
+    return names
+
 # Wrap up the cactus_progressive interface:
 # - intialize the working directory
 # - create Experiment file from seqfile and options
@@ -49,12 +90,28 @@ from cactus.shared.common import cactusRootPath
 # - now ready to launch cactus progressive
 class ProjectWrapper:
     alignmentDirName = 'progressiveAlignment'
-    def __init__(self, options, seqFile, workingDir):
+    fingerprintFileName = '%s_fingerprint.txt' % alignmentDirName
+    subtreeFileName = '%s_subtrees.json' % alignmentDirName
+    def __init__(self, options, seqFile, workingDir, runner=None, trash=None,
+                 dryRun=False):
         self.options = options
+        # only set up the project: don't touch the input sequences or the
+        # sequence cache
+        self.dryRun = dryRun
+        if runner is None:
+            runner = ProcessRunner()
+        self.runner = runner
+        # old directories are moved here rather than deleted
+        if trash is None:
+            trash = Trash(workingDir)
+        self.trash = trash
         self.seqFile = seqFile
         self.workingDir = workingDir
         self.configWrapper = None
         self.expWrapper = None
+        # ktserver ports reserved for this run (see reserveKtPorts)
+        self.portReservation = None
+        self.treeCost = TreeCost(seqFile.tree, seqFile.pathMap)
         self.processConfig()
         self.processExperiment()
 
@@ -67,6 +124,7 @@ class ProjectWrapper:
             configPath = os.path.join(dir,
                                       "cactus_progressive_config.xml")
         configXml = ET.parse(configPath).getroot()
+        self.configXml = configXml
         self.configWrapper = ConfigWrapper(configXml)
         # here we can go through the options and apply some to the config
         self.configWrapper.setBuildHal(True)
@@ -75,14 +133,22 @@ class ProjectWrapper:
             self.configWrapper.setBuildMaf(True)
             self.configWrapper.setJoinMaf(True)
         # pre-emptively turn down maxParallelSubtree for singleMachine
-        # mode if not enough threads are provided to support it.  Probably
-        # need to do something for other ?combined? batch systems?
+        # mode if not enough threads (or cores) are provided to support it,
+        # or if the estimated ktservers of the biggest subtrees wouldn't fit
+        # in memory together.  Probably need to do something for other
+        # ?combined? batch systems?
         if self.options.batchSystem == 'singleMachine' and \
                self.options.database == 'kyoto_tycoon':
-            if int(self.options.maxThreads) < \
-                   self.configWrapper.getMaxParallelSubtrees() * 3:
-                self.configWrapper.setMaxParallelSubtrees(
-                    max(1, int(self.options.maxThreads) / 3)) 
+            maxParallel = self.configWrapper.getMaxParallelSubtrees()
+            cores = min(int(self.options.maxThreads), numCpus())
+            if cores < maxParallel * 3:
+                maxParallel = max(1, cores / 3)
+            memory = physicalMemory()
+            if memory is not None:
+                maxParallel = min(maxParallel,
+                                  self.treeCost.maxParallelSubproblems(memory))
+            if maxParallel < self.configWrapper.getMaxParallelSubtrees():
+                self.configWrapper.setMaxParallelSubtrees(maxParallel)
 
         # this is a little hack to effectively toggle back to the
         # non-progressive version of cactus (as published in Gen. Res. 2011)
@@ -91,7 +157,28 @@ class ProjectWrapper:
             self.configWrapper.setSubtreeSize(sys.maxint)
 
     def processExperiment(self):
-        expXml = self.seqFile.toXMLElement()
+        #set up the sequence output directory, decompressing any gzipped
+        #input genomes into it
+        outSeqDir = os.path.join(self.workingDir, "sequenceData")
+        if os.path.exists(outSeqDir) and self.options.overwrite:
+            self.trash.discard(outSeqDir)
+        if not os.path.exists(outSeqDir):
+            os.mkdir(outSeqDir)
+        if self.dryRun is True:
+            self.inputPathMap = dict(self.seqFile.pathMap)
+        else:
+            self.inputPathMap = decompressInputs(
+                self.seqFile.pathMap, os.path.join(outSeqDir, inputDirName),
+                self.seqFile.numThreads)
+
+        # list the children with the longest path to the root first, so
+        # that when there are more subtrees than can be run at once, the
+        # ones on the critical path get started first.  The tree itself is
+        # reordered because cactus matches the sequences to the leaves of
+        # the species tree by their order, so both have to come from it.
+        pathCost = self.treeCost.pathCost
+        self.seqFile.tree.sortChildren(lambda node: -pathCost[node])
+        expXml = self.seqFile.toXMLElement(self.inputPathMap)
         #create the cactus disk
         cdElem = ET.SubElement(expXml, "cactus_disk")
         database = self.options.database
@@ -125,15 +212,8 @@ class ProjectWrapper:
             if self.options.ktOpenTuning is not None:
                 self.expWrapper.setDbReadTuningOptions(
                     self.options.ktOpenTuning)
-        
-        #set the sequence output directory
-        outSeqDir = os.path.join(self.workingDir, "sequenceData")
-        if os.path.exists(outSeqDir) and self.options.overwrite:
-            system("rm -rf %s" % outSeqDir)
-        if not os.path.exists(outSeqDir):
-            system("mkdir %s" % outSeqDir)
-        self.expWrapper.setOutputSequenceDir(os.path.join(self.workingDir, 
-                                                          "sequenceData"))
+
+        self.expWrapper.setOutputSequenceDir(outSeqDir)
 
     def writeXml(self):
         assert os.path.isdir(self.workingDir)
@@ -148,36 +228,401 @@ class ProjectWrapper:
         projPath = os.path.join(self.workingDir,
                                 ProjectWrapper.alignmentDirName)
         if os.path.exists(projPath) and self.options.overwrite:
-            system("rm -rf %s" % projPath)
+            self.trash.discard(projPath)
         if self.options.outputMaf is True:
             fixNames=1
         else:
             fixNames=0
+        fingerprint = self.fingerprint(fixNames)
         if os.path.exists(projPath):
-           if not self.isSameAsExisting(expPath, projPath, fixNames):
-               raise RuntimeError("Existing project %s not " % projPath+
-                                  "compatible with current input.  Please "
-                                  "erase the working directory or rerun "
-                                  "with the --overwrite option to start "
-                                  "from scratch.")
-           else:
+           if self.matchesExisting(fingerprint, expPath, projPath, fixNames):
                logPath = os.path.join(self.workingDir, 'cactus.log')
                logFile = open(logPath, "a")
                logFile.write("\nContinuing existing alignment.  Use "
                              "--overwrite or erase the working directory to "
                              "force restart from scratch.\n")
                logFile.close()
+           elif self.options.reuseSubtrees is True and \
+                    self.reuseSubtrees(expPath, projPath, fixNames):
+               self.writeFingerprint(projPath, fingerprint)
+           else:
+               raise RuntimeError("Existing project %s not " % projPath+
+                                  "compatible with current input.  Please "
+                                  "erase the working directory or rerun "
+                                  "with the --overwrite or --reuseSubtrees "
+                                  "option.")
+           if self.portReservation is not None:
+               self.assignKtPorts(projPath)
+        else:
+            self.createProject(expPath, projPath, fixNames)
+            self.writeSubtreeSignatures(projPath)
+            self.writeFingerprint(projPath, fingerprint)
+        if self.portReservation is not None:
+            self.checkKtPorts(projPath)
+        if self.options.seqCacheDir is not None and self.dryRun is False:
+            self.fetchCachedSequences(configPath)
+
+    def createProject(self, expPath, projPath, fixNames):
+        self.runCreateProject(expPath, projPath, fixNames)
+        if self.options.database == "kyoto_tycoon" and \
+               self.options.ktAutoTune is True:
+            try:
+                self.tuneKtServers(projPath)
+            except:
+                # a rerun mustn't mistake a half-made project for one it
+                # can continue
+                self.trash.discard(projPath)
+                raise
+
+    def runCreateProject(self, expPath, projPath, fixNames):
+        cmd = ["cactus_createMultiCactusProject.py", expPath, projPath,
+               "--fixNames=%d" % fixNames]
+        if len(self.seqFile.outgroups) > 0: 
+            cmd += ["--outgroupNames", ",".join(self.seqFile.outgroups)]
+        if self.options.rootOutgroupDists:
+            cmd += ["--rootOutgroupDists", self.options.rootOutgroupDists]
+            cmd += ["--rootOutgroupPaths", self.options.rootOutgroupPaths]
+        if self.options.root is not None:
+            cmd += ["--root", self.options.root]
+        self.runner.run(cmd)
+
+    # Size the database of each subproblem in a newly created project
+    # from the size of the genomes it aligns (inputs for leaves, averages of
+    # their descendants for ancestors).  Bucket counts and map sizes are set
+    # per subproblem, without overriding anything given in --ktCreateTuning,
+    # and subproblems whose in-memory database wouldn't fit in --ktMaxMemory
+    # are switched to an on-disk database.  (A snapshot database is still
+    # held entirely in memory, so switching to snapshot wouldn't help.)
+    def tuneKtServers(self, projPath):
+        if self.options.ktMaxMemory is not None:
+            maxMemory = parseBytes(self.options.ktMaxMemory)
         else:
-            cmd = "cactus_createMultiCactusProject.py \"%s\" \"%s\" --fixNames=%d" % (
-                expPath, projPath, fixNames)
-            if len(self.seqFile.outgroups) > 0: 
-                cmd += " --outgroupNames " + ",".join(self.seqFile.outgroups)
-            if self.options.rootOutgroupDists:
-                cmd += " --rootOutgroupDists %s" % self.options.rootOutgroupDists
-                cmd += " --rootOutgroupPaths %s" % self.options.rootOutgroupPaths
-            if self.options.root is not None:
-                cmd += " --root %s" % self.options.root
-            system(cmd)
+            maxMemory = physicalMemory()
+        mcProj, experiments = self.readExperiments(projPath)
+        subproblemBases = self.subproblemBases(experiments)
+        for event, exp in experiments.items():
+            bnum, msiz = ktTuning(subproblemBases[event])
+            tuning = parseTuning(self.options.ktCreateTuning)
+            tuning.setdefault("bnum", str(bnum))
+            if maxMemory is not None and msiz > maxMemory:
+                exp.setDbInMemory(False)
+                exp.setDbSnapshot(False)
+                # for on-disk databases msiz is just the size of the
+                # memory-mapped region
+                msiz = maxMemory / 2
+            tuning.setdefault("msiz", str(msiz))
+            exp.setDbCreateTuningOptions(
+                "".join(["#%s=%s" % (k, v) for k, v in sorted(tuning.items())]))
+            exp.writeXML(mcProj.expMap[event])
+
+    # Estimated number of bases aligned (outgroups included) by each of the
+    # subproblems in experiments (event -> ExperimentWrapper).  Leaf genomes
+    # are the size of their input, and ancestors the average size of the
+    # genomes below them.
+    def subproblemBases(self, experiments):
+        sizes = dict()
+        for name, path in self.seqFile.pathMap.items():
+            sizes[name] = genomeBases(path)
+        def genomeSize(name, visiting):
+            if name in sizes:
+                return sizes[name]
+            if name not in experiments or name in visiting:
+                return 0
+            visiting.add(name)
+            childSizes = [genomeSize(x, visiting) for x in
+                          subproblemGenomes(experiments[name], False)]
+            visiting.remove(name)
+            sizes[name] = sum(childSizes) / max(1, len(childSizes))
+            return sizes[name]
+        bases = dict()
+        for event, exp in experiments.items():
+            bases[event] = sum([genomeSize(x, set()) for x in
+                                subproblemGenomes(exp, True)])
+        return bases
+
+    ###########################################################################
+    # Reserve a range of free ktserver ports at or above --ktPort, with
+    # room for every subproblem that can run at once, and run the project on
+    # it.  The range is recorded in the working directory.
+    ###########################################################################
+    def reserveKtPorts(self, allocator):
+        self.portReservation = allocator.reserve(
+            self.options.ktPort,
+            self.configWrapper.getMaxParallelSubtrees() *
+            PortAllocator.portsPerServer, self.workingDir)
+        self.portReservation.write(os.path.join(self.workingDir,
+                                                PortReservation.fileName))
+        self.options.ktPort = self.portReservation.firstPort
+        self.expWrapper.setDbPort(str(self.options.ktPort))
+
+    # Move the subproblems of a project made by an earlier run onto the
+    # ports reserved for this one
+    def assignKtPorts(self, projPath):
+        mcProj, experiments = self.readExperiments(projPath)
+        for event, exp in experiments.items():
+            if str(exp.getDbPort()) != str(self.options.ktPort):
+                exp.setDbPort(str(self.options.ktPort))
+                exp.writeXML(mcProj.expMap[event])
+
+    ###########################################################################
+    # Move every subproblem that still has to run off any port that has
+    # been taken (since the range was reserved, or by a server left over
+    # from an earlier run of the project) onto a free port in the
+    # reservation.  This has to happen before cactus starts: once it's
+    # running, a job may already have read a subproblem's port.
+    ###########################################################################
+    def checkKtPorts(self, projPath):
+        mcProj, experiments = self.readExperiments(projPath)
+        pending = sorted([x for x, exp in experiments.items()
+                          if not os.path.isfile(exp.getHALPath())])
+        usedPorts = set([int(experiments[x].getDbPort()) for x in pending])
+        moved = []
+        for event in pending:
+            exp = experiments[event]
+            port = int(exp.getDbPort())
+            if not isLocalHost(exp.getDbHost()) or not portInUse(port):
+                continue
+            free = [x for x in self.portReservation.ports()
+                    if x not in usedPorts and not portInUse(x)]
+            if len(free) == 0:
+                raise RuntimeError("Port %d of subproblem %s is taken, and "
+                                   "there are no free ports left in %d-%d "
+                                   "to move it to" % (
+                                       port, event,
+                                       self.portReservation.firstPort,
+                                       self.portReservation.lastPort))
+            exp.setDbPort(str(free[0]))
+            exp.writeXML(mcProj.expMap[event])
+            usedPorts.add(free[0])
+            moved.append("%s: %d to %d" % (event, port, free[0]))
+        if len(moved) > 0:
+            logFile = open(os.path.join(self.workingDir, 'cactus.log'), "a")
+            logFile.write("\nMoved subproblems off ktserver ports taken by "
+                          "something else (%s)\n" % ", ".join(moved))
+            logFile.close()
+
+    # the project in a directory and the ExperimentWrapper of each of its
+    # subproblems
+    def readExperiments(self, projPath):
+        mcProj = MultiCactusProject()
+        mcProj.readXML(os.path.join(projPath, "%s_project.xml" %
+                                    ProjectWrapper.alignmentDirName))
+        experiments = dict()
+        for event, expPath in mcProj.expMap.items():
+            experiments[event] = ExperimentWrapper(ET.parse(expPath).getroot())
+        return mcProj, experiments
+
+    # Cache key and preprocessed sequence path of every leaf genome,
+    # keyed on the content of the sequence cactus will preprocess and the
+    # preprocessor section of the config
+    def cachedSequenceKeys(self, cache, configPath):
+        configRoot = ET.parse(configPath).getroot()
+        configString = "".join([ET.tostring(x) for x in
+                                configRoot.findall("preprocessor")])
+        outSeqDir = self.expWrapper.getOutputSequenceDir()
+        tree = self.seqFile.tree
+        names = [tree.getName(x) for x in tree.postOrderTraversal()
+                 if tree.isLeaf(x)]
+        digests = cache.digests([self.inputPathMap[x] for x in names],
+                                self.seqFile.numThreads)
+        keys = dict()
+        for name in names:
+            path = self.inputPathMap[name]
+            keys[name] = (cacheKey(digests[path], configString),
+                          os.path.join(outSeqDir, os.path.basename(path)))
+        return keys
+
+    # link any preprocessed sequences that are in the --seqCacheDir cache
+    # (and not in the working directory already) so cactus doesn't redo them
+    def fetchCachedSequences(self, configPath):
+        cache = SequenceCache(self.options.seqCacheDir, self.seqCacheSize())
+        self.seqCacheKeys = self.cachedSequenceKeys(cache, configPath)
+        hits = []
+        for name, (key, outPath) in self.seqCacheKeys.items():
+            if not os.path.exists(outPath) and cache.fetch(key, outPath):
+                hits.append(name)
+        logFile = open(os.path.join(self.workingDir, 'cactus.log'), "a")
+        logFile.write("\nUsing %d of %d preprocessed sequences from %s "
+                      "(%s)\n" % (len(hits), len(self.seqCacheKeys),
+                                  self.options.seqCacheDir,
+                                  ", ".join(sorted(hits))))
+        logFile.close()
+
+    # add the preprocessed sequences of a finished alignment to the cache
+    def storeCachedSequences(self):
+        cache = SequenceCache(self.options.seqCacheDir, self.seqCacheSize())
+        for name, (key, outPath) in self.seqCacheKeys.items():
+            if os.path.isfile(outPath):
+                cache.store(key, outPath)
+
+    def seqCacheSize(self):
+        if self.options.seqCacheSize is None:
+            return None
+        return parseBytes(self.options.seqCacheSize)
+
+    # path and signature of the input sequence of every leaf genome
+    def leafSequences(self):
+        tree = self.seqFile.tree
+        leafMap = dict()
+        for node in tree.postOrderTraversal():
+            if tree.isLeaf(node):
+                path = self.seqFile.pathMap[tree.getName(node)]
+                leafMap[tree.getName(node)] = [absSymPath(path),
+                                               sequenceSignature(path)]
+        return leafMap
+
+    # Digest of the configuration, leaving out maxParallelSubtrees, which
+    # only says how many subproblems can run at once and comes from
+    # --maxThreads and the size of the machine.  Resuming with different
+    # resources doesn't change the alignment.
+    def configSignature(self):
+        configXml = copy.deepcopy(self.configXml)
+        ConfigWrapper(configXml).setMaxParallelSubtrees(1)
+        return hashlib.sha1(ET.tostring(configXml)).hexdigest()
+
+    # Digest of all the input that goes into creating the project: the
+    # tree, the sequences (by path, size and mtime), the outgroups and root
+    # options, and the configuration.  If the digest of the current input
+    # matches the one stored with an existing project, it's safe to continue
+    # that project without regenerating it.
+    def fingerprint(self, fixNames):
+        inputs = { "tree" : canonicalNewick(self.seqFile.tree),
+                   "sequences" : sorted(self.leafSequences().items()),
+                   "outgroups" : sorted(self.seqFile.outgroups),
+                   "root" : self.options.root,
+                   "rootOutgroupDists" : self.options.rootOutgroupDists,
+                   "rootOutgroupPaths" : self.options.rootOutgroupPaths,
+                   "fixNames" : fixNames,
+                   "config" : self.configSignature() }
+        return hashlib.sha1(json.dumps(inputs, sort_keys=True)).hexdigest()
+
+    def writeFingerprint(self, projPath, fingerprint):
+        fpFile = open(os.path.join(projPath,
+                                   ProjectWrapper.fingerprintFileName), "w")
+        fpFile.write("%s\n" % fingerprint)
+        fpFile.close()
+
+    # compare the fingerprint to the one stored with the existing project.
+    # projects made before fingerprints were stored fall back on the
+    # (slow) full comparison, and get a fingerprint if they pass.
+    def matchesExisting(self, fingerprint, expPath, projPath, fixNames):
+        fpPath = os.path.join(projPath, ProjectWrapper.fingerprintFileName)
+        if os.path.isfile(fpPath):
+            fpFile = open(fpPath, "r")
+            oldFingerprint = fpFile.read().strip()
+            fpFile.close()
+            return oldFingerprint == fingerprint
+        if self.isSameAsExisting(expPath, projPath, fixNames):
+            self.writeFingerprint(projPath, fingerprint)
+            return True
+        return False
+
+    # Store a signature for every subproblem of the project in projPath,
+    # along with the leaf sequences they were computed from.  A subproblem's
+    # signature covers its tree, the configuration and (recursively) the
+    # signatures of all the genomes it aligns and of its outgroups (the
+    # sequence of a leaf outgroup, the subtree of an ancestral one), so it
+    # only stays the same if nothing it was computed from has changed.
+    def writeSubtreeSignatures(self, projPath):
+        mcProj = MultiCactusProject()
+        mcProj.readXML(os.path.join(projPath, "%s_project.xml" %
+                                    ProjectWrapper.alignmentDirName))
+        leafMap = self.leafSequences()
+        configHash = self.configSignature()
+        signatures = dict()
+        def subtreeSignature(event, visiting):
+            if event in signatures:
+                return signatures[event]
+            if event not in mcProj.expMap or event in visiting:
+                return [event, leafMap.get(event)]
+            visiting.add(event)
+            exp = ExperimentWrapper(ET.parse(mcProj.expMap[event]).getroot())
+            tree = exp.getTree()
+            genomes = []
+            for node in tree.postOrderTraversal():
+                if tree.isLeaf(node):
+                    genomes.append(subtreeSignature(tree.getName(node),
+                                                    visiting))
+            outgroups = exp.getOutgroupEvents()
+            if outgroups is None:
+                outgroups = []
+            outgroups = sorted([subtreeSignature(x, visiting)
+                                for x in outgroups])
+            inputs = { "tree" : canonicalNewick(tree),
+                       "genomes" : sorted(genomes),
+                       "outgroups" : outgroups,
+                       "config" : configHash }
+            visiting.remove(event)
+            signatures[event] = hashlib.sha1(
+                json.dumps(inputs, sort_keys=True)).hexdigest()
+            return signatures[event]
+        for event in mcProj.expMap.keys():
+            subtreeSignature(event, set())
+        sigFile = open(os.path.join(projPath,
+                                    ProjectWrapper.subtreeFileName), "w")
+        json.dump({ "subtrees" : signatures, "sequences" : leafMap },
+                  sigFile, sort_keys=True)
+        sigFile.close()
+        return mcProj, signatures
+
+    # The input has changed, but some subproblems may not have.  Move the
+    # old project out of the way, create the new one, and move the output
+    # of every subproblem whose signature is unchanged back into it.
+    # Everything else (ie the ancestors of whatever changed) is realigned.
+    # Returns False if the old project has no signatures to compare against.
+    def reuseSubtrees(self, expPath, projPath, fixNames):
+        oldSigPath = os.path.join(projPath, ProjectWrapper.subtreeFileName)
+        if not os.path.isfile(oldSigPath):
+            return False
+        oldSigFile = open(oldSigPath, "r")
+        oldInfo = json.load(oldSigFile)
+        oldSigFile.close()
+        oldProjPath = "%s_old" % os.path.dirname(projPath + "/")
+        self.trash.discard(oldProjPath)
+        os.rename(projPath, oldProjPath)
+        try:
+            self.createProject(expPath, projPath, fixNames)
+            mcProj, signatures = self.writeSubtreeSignatures(projPath)
+        except:
+            self.trash.discard(projPath)
+            os.rename(oldProjPath, projPath)
+            raise
+        reused = []
+        for event, signature in signatures.items():
+            if oldInfo["subtrees"].get(event) != signature:
+                continue
+            newEventDir = os.path.dirname(mcProj.expMap[event])
+            oldEventDir = os.path.join(oldProjPath, os.path.relpath(
+                newEventDir, projPath))
+            if not os.path.isdir(oldEventDir):
+                continue
+            for name in os.listdir(oldEventDir):
+                if not os.path.exists(os.path.join(newEventDir, name)):
+                    os.rename(os.path.join(oldEventDir, name),
+                              os.path.join(newEventDir, name))
+            reused.append(event)
+
+        # cactus names preprocessed sequences after the input file (or the
+        # file it was decompressed to), so we need to make sure the output
+        # for any leaf whose input has changed gets regenerated.
+        leafMap = self.leafSequences()
+        outSeqDir = self.expWrapper.getOutputSequenceDir()
+        for name, (oldPath, oldSignature) in oldInfo["sequences"].items():
+            if leafMap.get(name) != [oldPath, oldSignature]:
+                outNames = set([os.path.basename(oldPath)])
+                if name in self.inputPathMap:
+                    outNames.add(os.path.basename(self.inputPathMap[name]))
+                for outName in outNames:
+                    self.trash.discard(os.path.join(outSeqDir, outName))
+        self.trash.discard(oldProjPath)
+
+        logFile = open(os.path.join(self.workingDir, 'cactus.log'), "a")
+        logFile.write("\nInput changed.  Reusing existing alignments for "
+                      "%d of %d subproblems (%s).  The rest will be "
+                      "realigned.\n" % (len(reused), len(signatures),
+                                         ", ".join(sorted(reused))))
+        logFile.close()
+        return True
 
     # create a project in a dummy directory.  check if the
     # project xml is the same as the current project.
@@ -188,18 +633,8 @@ class ProjectWrapper:
             return False
         oldPath = os.path.dirname(projPath + "/")
         tempPath = "%s_temp" % oldPath
-        if os.path.exists(tempPath):
-            system("rm -rf %s" % tempPath)
-        cmd = "cactus_createMultiCactusProject.py %s %s --fixNames=%d" % (
-            expPath, tempPath, fixNames)
-        if len(self.seqFile.outgroups) > 0: 
-            cmd += " --outgroupNames " + ",".join(self.seqFile.outgroups)
-        if self.options.rootOutgroupDists:
-            cmd += " --rootOutgroupDists %s" % self.options.rootOutgroupDists
-            cmd += " --rootOutgroupPaths %s" % self.options.rootOutgroupPaths
-        if self.options.root is not None:
-            cmd += " --root %s" % self.options.root
-        system(cmd)
+        self.trash.discard(tempPath)
+        self.runCreateProject(expPath, tempPath, fixNames)
         projFilePathNew = os.path.join(tempPath,'%s_temp_project.xml' %
                                        self.alignmentDirName)
         projFilePathOld = os.path.join(oldPath, '%s_project.xml' %
@@ -213,10 +648,5 @@ class ProjectWrapper:
         for newLine, oldLine in zip(newFile, oldFile):
             if newLine.replace(tempPath, oldPath) != oldLine:
                 areSame = False
-        system("rm -rf %s" % tempPath)
+        self.trash.discard(tempPath)
         return areSame
-
-    
-
-        
-        
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+
+# Progressive Cactus Package
+# Copyright (C) 2009-2013 by Glenn Hickey (hickey@soe.ucsc.edu)
+# and Benedict Paten (benedictpaten@gmail.com)
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import os
+import sys
+import time
+import json
+from threading import Lock
+
+###############################################################################
+# Machine-readable record of how a run is going.  Every measurement is
+# appended as a line of json (with a timestamp and a type) to
+# <workDir>/cactus_metrics.jsonl.  The latest value of each measurement is
+# also kept as a gauge, which can optionally be written out in the
+# Prometheus text format (ex for the node_exporter textfile collector)
+# every time it changes.  Safe to use from several threads.
+###############################################################################
+class RunMetrics:
+    fileName = "cactus_metrics.jsonl"
+
+    def __init__(self, workDir, prometheusPath=None):
+        self.path = os.path.join(workDir, RunMetrics.fileName)
+        self.prometheusPath = prometheusPath
+        self.lock = Lock()
+        # (name, sorted label items) -> value
+        self.gauges = dict()
+        self.stageStarts = dict()
+        self.record("run_start", pid=os.getpid())
+
+    def record(self, recordType, **fields):
+        entry = { "time" : time.time(), "type" : recordType }
+        entry.update(fields)
+        line = json.dumps(entry, sort_keys=True)
+        with self.lock:
+            metricsFile = open(self.path, "a")
+            metricsFile.write(line + "\n")
+            metricsFile.close()
+
+    def stageStart(self, stage):
+        self.stageStarts[stage] = time.time()
+        self.record("stage_start", stage=stage)
+        self.setGauges([("cactus_stage_running", 1, { "stage" : stage })])
+
+    def stageEnd(self, stage, **fields):
+        elapsed = None
+        if stage in self.stageStarts:
+            elapsed = time.time() - self.stageStarts[stage]
+        self.record("stage_end", stage=stage, elapsed=elapsed, **fields)
+        gauges = [("cactus_stage_running", 0, { "stage" : stage })]
+        if elapsed is not None:
+            gauges.append(("cactus_stage_seconds", elapsed,
+                           { "stage" : stage }))
+        self.setGauges(gauges)
+
+    # gauges is a list of (name, value, labels dict or None).  Setting a
+    # value to None removes the gauge.
+    def setGauges(self, gauges):
+        with self.lock:
+            for name, value, labels in gauges:
+                if labels is None:
+                    labels = dict()
+                key = (name, tuple(sorted(labels.items())))
+                if value is None:
+                    self.gauges.pop(key, None)
+                else:
+                    self.gauges[key] = value
+            self.__writePrometheus()
+
+    # remove all gauges with the given name (ex per-server latencies
+    # for servers that have gone away)
+    def clearGauges(self, name):
+        with self.lock:
+            for key in self.gauges.keys():
+                if key[0] == name:
+                    del self.gauges[key]
+
+    def __writePrometheus(self):
+        if self.prometheusPath is None:
+            return
+        lines = []
+        lastName = None
+        for (name, labels), value in sorted(self.gauges.items()):
+            if name != lastName:
+                lines.append("# TYPE %s gauge" % name)
+                lastName = name
+            if len(labels) > 0:
+                labelString = "{%s}" % ",".join(
+                    ['%s="%s"' % (k, str(v).replace('"', '\\"'))
+                     for k, v in labels])
+            else:
+                labelString = ""
+            lines.append("%s%s %s" % (name, labelString, repr(value)))
+        tempPath = "%s.tmp" % self.prometheusPath
+        try:
+            promFile = open(tempPath, "w")
+            promFile.write("\n".join(lines) + "\n")
+            promFile.close()
+            os.rename(tempPath, self.prometheusPath)
+        except:
+            pass
+
+# Number of bytes used on disk by everything under path
+def diskUsage(path):
+    total = 0
+    for dirPath, dirNames, fileNames in os.walk(path):
+        for name in dirNames + fileNames:
+            try:
+                info = os.lstat(os.path.join(dirPath, name))
+                total += info.st_blocks * 512
+            except OSError:
+                pass
+    return total
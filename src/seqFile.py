@@ -30,12 +30,57 @@ from optparse import OptionParser
 from optparse import OptionGroup
 import imp
 import string
-import re
+import json
+import multiprocessing
 
 from sonLib.bioio import absSymPath
-from sonLib.nxtree import NXTree
-from sonLib.nxnewick import NXNewick
-from sonLib.bioio import popenCatch
+
+from fastaStats import scanSequence, sequenceSignature
+from compactTree import CompactTree, parseNewick, writeNewick
+
+# Get the (repeat-masked fraction, N fraction) of a sequence path, which
+# can be a fasta file or a directory of fasta files
+def analyseSequence(path):
+    stats = scanSequence(path)[0]
+    return (stats.maskedFraction(), stats.nFraction())
+
+# Remember sanity check results in a json sidecar file, keyed on the
+# absolute path of the sequence and checked against its signature, so
+# that restarting a run doesn't mean rescanning every genome.
+class SanityCheckCache:
+    def __init__(self, path=None):
+        self.path = path
+        self.entries = dict()
+        if path is not None and os.path.isfile(path):
+            try:
+                self.entries = json.load(open(path, "r"))
+            except:
+                sys.stderr.write("Ignoring unreadable sanity check cache %s\n"
+                                 % path)
+                self.entries = dict()
+
+    def get(self, seqPath, signature):
+        entry = self.entries.get(absSymPath(seqPath))
+        if entry is not None and entry["signature"] == signature:
+            return tuple(entry["stats"])
+        return None
+
+    def set(self, seqPath, signature, stats):
+        self.entries[absSymPath(seqPath)] = { "signature" : signature,
+                                              "stats" : list(stats) }
+
+    def write(self):
+        if self.path is None:
+            return
+        tempPath = "%s.tmp" % self.path
+        try:
+            tempFile = open(tempPath, "w")
+            json.dump(self.entries, tempFile)
+            tempFile.close()
+            os.rename(tempPath, self.path)
+        except:
+            sys.stderr.write("Unable to write sanity check cache %s\n" %
+                             self.path)
 
 # parse the input seqfile for progressive cactus.  this file is in the
 # format of:
@@ -60,7 +105,13 @@ from sonLib.bioio import popenCatch
 
 class SeqFile:
     branchLen = 1
-    def __init__(self, path=None):
+    def __init__(self, path=None, cachePath=None, numThreads=None):
+        # sidecar file where sanity check results are remembered between runs
+        self.cachePath = cachePath
+        # bound on the number of sequences that get checked at once
+        if numThreads is None:
+            numThreads = multiprocessing.cpu_count()
+        self.numThreads = max(1, int(numThreads))
         if path is not None:
             self.parseFile(path)
 
@@ -78,10 +129,9 @@ class SeqFile:
                     continue
                 tokens = line.split()
                 if self.tree is None and (len(tokens) == 1 or line[0] == '('):
-                    newickParser = NXNewick()
                     try:
-                        self.tree = newickParser.parseString(line)
-                    except:
+                        self.tree = parseNewick(line)
+                    except RuntimeError:
                         raise RuntimeError("Failed to parse newick tree: %s" %
                                            line)
                 elif len(tokens) > 0 and tokens[0] == '*':
@@ -104,46 +154,61 @@ class SeqFile:
         self.validate()
 
     def starTree(self):
-        self.tree = NXTree()
-        label = 0
-        self.tree.nxDg.add_node(label)
-        self.tree.rootId = label
+        self.tree = CompactTree()
+        root = self.tree.addNode()
         for name in self.pathMap.keys():
-            label += 1
-            self.tree.nxDg.add_edge(0, label)
-            self.tree.setName(label, name)
-            self.tree.setWeight(0, label, SeqFile.branchLen)
+            self.tree.addNode(root, name, SeqFile.branchLen)
         
     def validate(self):
-        if len([i for i in self.tree.postOrderTraversal()]) <= 2:
+        if self.tree.size() <= 2:
             raise RuntimeError("At least two valid leaf genomes required in"
                                " input tree")
-        for node in self.tree.postOrderTraversal():
-            if self.tree.isLeaf(node):
-                name = self.tree.getName(node)
-                if name not in self.pathMap:
-                    raise RuntimeError("No sequence specified for %s" % name)
-                else:
-                    path = self.pathMap[name]
-                    if not os.path.exists(path):
-                        raise RuntimeError("Sequence path not found: %s" % path)
-                    self.sanityCheckSequence(path)
-
-    def sanityCheckSequence(self, path):
+        paths = []
+        for node in self.tree.leaves():
+            name = self.tree.getName(node)
+            if name not in self.pathMap:
+                raise RuntimeError("No sequence specified for %s" % name)
+            else:
+                path = self.pathMap[name]
+                if not os.path.exists(path):
+                    raise RuntimeError("Sequence path not found: %s" % path)
+                paths.append(path)
+        self.sanityCheckSequences(paths)
+
+    # check all the input sequences at once, scanning up to numThreads
+    # of them concurrently in separate processes.  sequences whose size and
+    # mtime haven't changed since the last time they were looked at are not
+    # rescanned if a cache path was given
+    def sanityCheckSequences(self, paths):
+        cache = SanityCheckCache(self.cachePath)
+        statsMap = dict()
+        todo = []
+        for path in paths:
+            if path in statsMap:
+                continue
+            signature = sequenceSignature(path)
+            statsMap[path] = cache.get(path, signature)
+            if statsMap[path] is None:
+                todo.append((path, signature))
+        if len(todo) > 0:
+            pool = multiprocessing.Pool(min(self.numThreads, len(todo)))
+            try:
+                results = pool.map(analyseSequence, [p for p, s in todo])
+            finally:
+                pool.close()
+                pool.join()
+            for (path, signature), stats in zip(todo, results):
+                cache.set(path, signature, stats)
+                statsMap[path] = stats
+            cache.write()
+        for path in paths:
+            self.sanityCheckSequence(path, statsMap[path])
+
+    def sanityCheckSequence(self, path, stats=None):
         """Warns the user about common problems with the input sequences."""
-        # Relies on cactus_analyseAssembly output staying in the
-        # format it's currently in.
-        cmdline = "cactus_analyseAssembly"
-        if os.path.isdir(path):
-            cmdline = "cat %s/* | %s -" % (path, cmdline)
-        else:
-            cmdline += " %s" % path
-        output = popenCatch(cmdline)
-        # We don't do error-checking here, all we'll get is a prettier
-        # error message and it will be pretty obvious what's going on
-        # (i.e. the analyseAssembly output will have changed)
-        repeatMaskedFrac = float(re.search(r'Proportion-repeat-masked: ([0-9.]*)', output).group(1))
-        nFrac = float(re.search(r'ProportionNs: ([0-9.]*)', output).group(1))
+        if stats is None:
+            stats = analyseSequence(path)
+        repeatMaskedFrac, nFrac = stats
         # These thresholds are pretty arbitrary, but should be good for
         # badly- to well-assembled vertebrate genomes.
         if repeatMaskedFrac > 0.70:
@@ -166,26 +231,21 @@ class SeqFile:
                              "ignore this message.\n\n" % (path, nFrac))
 
     # remove leaves that do not have sequence data associated with them
+    # (and any ancestors left without leaves), all in one pass
     def cleanTree(self):
-        numLeaves = 0
-        removeList = []
-        for node in self.tree.postOrderTraversal():
-            if self.tree.isLeaf(node):
-                name = self.tree.getName(node)
-                if name not in self.pathMap:
-                    removeList.append(node)
-                numLeaves += 1
+        numLeaves = len(self.tree.leaves())
         if numLeaves < 2:
             raise RuntimeError("At least two valid leaf genomes required in"
                                " input tree")
-        if len(removeList) == numLeaves:
+        removed = self.tree.prune(
+            lambda node: self.tree.getName(node) in self.pathMap)
+        if len(removed) == numLeaves:
             raise RuntimeError("No sequence path specified for any leaves in the tree")
-        for leaf in removeList:
+        for name in removed:
              sys.stderr.write("No sequence path found for %s: skipping\n" % (
-                 self.tree.getName(leaf)))
-             self.tree.removeLeaf(leaf)
+                 name))
 
-        for node in self.tree.postOrderTraversal():
+        for node in self.tree.preOrderTraversal():
             if self.tree.hasParent(node):
                 parent = self.tree.getParent(node)
                 if self.tree.getWeight(parent, node) is None:
@@ -198,18 +258,21 @@ class SeqFile:
     # create the cactus_workflow_experiment xml element which serves as
     # the root node of the experiment template file needed by
     # cactus_createMultiCactusProject.  Note the element is incomplete
-    # until the cactus_disk child element has been added
-    def toXMLElement(self):
+    # until the cactus_disk child element has been added.  The sequence
+    # paths can be overridden by name with pathMap.
+    def toXMLElement(self, pathMap=None):
         assert self.tree is not None
+        if pathMap is None:
+            pathMap = self.pathMap
         elem = ET.Element("cactus_workflow_experiment")
         seqString = ""
         for node in self.tree.postOrderTraversal():
             if self.tree.isLeaf(node):
                 name = self.tree.getName(node)
-                path = self.pathMap[name]
+                path = pathMap[name]
                 path.replace(" ", "\ ")
                 seqString += absSymPath(path) + " "
         elem.attrib["sequences"] = seqString
-        elem.attrib["species_tree"] = NXNewick().writeString(self.tree)
+        elem.attrib["species_tree"] = writeNewick(self.tree)
         elem.attrib["config"] = "defaultProgressive"
         return elem
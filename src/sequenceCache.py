@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+
+# Progressive Cactus Package
+# Copyright (C) 2009-2013 by Glenn Hickey (hickey@soe.ucsc.edu)
+# and Benedict Paten (benedictpaten@gmail.com)
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+import os
+import sys
+import time
+import json
+import errno
+import fcntl
+import shutil
+import hashlib
+import multiprocessing
+
+from fastaStats import sequenceFiles, readChunks, sequenceSignature
+
+###############################################################################
+# A cache of preprocessed sequences that can be shared by any number of
+# working directories.  Entries are keyed on the content of the input
+# sequence and on the preprocessing configuration, so the same genome
+# preprocessed the same way is only ever done once, whatever its path.
+#
+# <cacheDir>/objects/<key> holds the preprocessed sequences, and
+# <cacheDir>/index.json holds the size and last use of every entry (for
+# LRU eviction once the cache is over maxBytes) along with the digests of
+# the input files we've hashed, keyed on path and signature so we don't
+# hash the same file twice.  The index is only touched with
+# <cacheDir>/.lock held, so runs can share the cache safely.
+#
+# Entries are hard-linked into working directories when possible (and
+# symlinked otherwise): cactus never rewrites a preprocessed sequence that
+# already exists, and removing the working directory leaves the cache
+# alone.
+###############################################################################
+class SequenceCache:
+    def __init__(self, cacheDir, maxBytes=None):
+        self.cacheDir = cacheDir
+        self.objectDir = os.path.join(cacheDir, "objects")
+        self.indexPath = os.path.join(cacheDir, "index.json")
+        self.maxBytes = maxBytes
+        if not os.path.isdir(self.objectDir):
+            try:
+                os.makedirs(self.objectDir)
+            except OSError, e:
+                if e.errno != errno.EEXIST:
+                    raise
+        self.lockFile = None
+
+    ###########################################################################
+    # Content digests of the given sequence paths (files or directories).
+    # Anything not already in the index is hashed, numThreads at a time.
+    ###########################################################################
+    def digests(self, paths, numThreads=1):
+        self.__lock()
+        try:
+            index = self.__readIndex()
+            result = dict()
+            todo = []
+            for path in set(paths):
+                signature = [os.path.abspath(path), sequenceSignature(path)]
+                entry = index["digests"].get(signature[0])
+                if entry is not None and entry[0] == signature[1]:
+                    result[path] = entry[1]
+                else:
+                    todo.append((path, signature))
+        finally:
+            self.__unlock()
+        if len(todo) > 0:
+            pool = multiprocessing.Pool(min(max(1, numThreads), len(todo)))
+            try:
+                digests = pool.map(digestSequence, [p for p, s in todo])
+            finally:
+                pool.close()
+                pool.join()
+            self.__lock()
+            try:
+                index = self.__readIndex()
+                for (path, signature), digest in zip(todo, digests):
+                    index["digests"][signature[0]] = [signature[1], digest]
+                    result[path] = digest
+                self.__writeIndex(index)
+            finally:
+                self.__unlock()
+        return result
+
+    ###########################################################################
+    # Link the entry for key to outPath.  Returns False on a cache miss
+    ###########################################################################
+    def fetch(self, key, outPath):
+        self.__lock()
+        try:
+            index = self.__readIndex()
+            objectPath = os.path.join(self.objectDir, key)
+            if key not in index["entries"] or not os.path.isfile(objectPath):
+                return False
+            if os.path.lexists(outPath):
+                os.remove(outPath)
+            try:
+                os.link(objectPath, outPath)
+            except OSError:
+                os.symlink(os.path.abspath(objectPath), outPath)
+            index["entries"][key]["lastUsed"] = time.time()
+            self.__writeIndex(index)
+            return True
+        finally:
+            self.__unlock()
+
+    ###########################################################################
+    # Add path to the cache under key (if it isn't there already), then
+    # evict the least recently used entries until we're under budget
+    ###########################################################################
+    def store(self, key, path):
+        self.__lock()
+        try:
+            index = self.__readIndex()
+            objectPath = os.path.join(self.objectDir, key)
+            if key not in index["entries"] or not os.path.isfile(objectPath):
+                tempPath = "%s.tmp" % objectPath
+                try:
+                    os.link(os.path.realpath(path), tempPath)
+                except OSError:
+                    shutil.copyfile(path, tempPath)
+                os.rename(tempPath, objectPath)
+                index["entries"][key] = {
+                    "size" : os.path.getsize(objectPath) }
+            index["entries"][key]["lastUsed"] = time.time()
+            self.__evict(index, key)
+            self.__writeIndex(index)
+        finally:
+            self.__unlock()
+
+    # never evicts keep, which was just used
+    def __evict(self, index, keep):
+        if self.maxBytes is None:
+            return
+        entries = index["entries"]
+        total = sum([x["size"] for x in entries.values()])
+        for key in sorted(entries.keys(),
+                          key=lambda x: entries[x]["lastUsed"]):
+            if total <= self.maxBytes:
+                break
+            if key == keep:
+                continue
+            total -= entries[key]["size"]
+            del entries[key]
+            objectPath = os.path.join(self.objectDir, key)
+            if os.path.exists(objectPath):
+                os.remove(objectPath)
+
+    def __readIndex(self):
+        index = { "entries" : dict(), "digests" : dict() }
+        if os.path.isfile(self.indexPath):
+            try:
+                indexFile = open(self.indexPath, "r")
+                index.update(json.load(indexFile))
+                indexFile.close()
+            except ValueError:
+                sys.stderr.write("Ignoring unreadable sequence cache index "
+                                 "%s\n" % self.indexPath)
+        return index
+
+    def __writeIndex(self, index):
+        tempPath = "%s.tmp" % self.indexPath
+        indexFile = open(tempPath, "w")
+        json.dump(index, indexFile)
+        indexFile.close()
+        os.rename(tempPath, self.indexPath)
+
+    def __lock(self):
+        self.lockFile = open(os.path.join(self.cacheDir, ".lock"), "a")
+        fcntl.flock(self.lockFile.fileno(), fcntl.LOCK_EX)
+
+    def __unlock(self):
+        fcntl.flock(self.lockFile.fileno(), fcntl.LOCK_UN)
+        self.lockFile.close()
+        self.lockFile = None
+
+# sha1 of the (uncompressed) content of a sequence path
+def digestSequence(path):
+    digest = hashlib.sha1()
+    for seqPath in sequenceFiles(path):
+        for chunk in readChunks(seqPath):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+# key of the preprocessed version of a sequence with the given digest
+def cacheKey(digest, configString):
+    return hashlib.sha1("%s\n%s" % (digest, configString)).hexdigest()
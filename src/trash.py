@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+
+# Progressive Cactus Package
+# Copyright (C) 2009-2013 by Glenn Hickey (hickey@soe.ucsc.edu)
+# and Benedict Paten (benedictpaten@gmail.com)
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+import os
+import sys
+import time
+import errno
+import pipes
+import shutil
+import subprocess
+
+###############################################################################
+# Get rid of big directories (old jobTrees, projects, sequences) without
+# waiting for them to be deleted.  discard() just renames a path into
+# <workDir>/.trash, which is instant and atomic (the path is gone as far as
+# anything else is concerned), and empty() starts a detached background
+# process that deletes whatever is in the trash, up to concurrency
+# entries at once, at low cpu (nice) and io (ionice) priority.  Anything
+# left over if that process dies is picked up by the next empty().
+###############################################################################
+class Trash:
+    dirName = ".trash"
+
+    def __init__(self, workDir, concurrency=2, niceness=19, ioClass="idle"):
+        self.trashDir = os.path.join(workDir, Trash.dirName)
+        self.concurrency = max(1, int(concurrency))
+        self.niceness = niceness
+        self.ioClass = ioClass
+        self.count = 0
+
+    ###########################################################################
+    # Move path into the trash.  Paths on a different filesystem from the
+    # trash can't be moved atomically, so they're deleted on the spot.
+    ###########################################################################
+    def discard(self, path):
+        if not os.path.lexists(path):
+            return
+        if not os.path.isdir(self.trashDir):
+            try:
+                os.makedirs(self.trashDir)
+            except OSError, e:
+                if e.errno != errno.EEXIST:
+                    raise
+        self.count += 1
+        trashPath = os.path.join(self.trashDir, "%s.%d.%d.%d" % (
+            os.path.basename(os.path.normpath(path)), int(time.time()),
+            os.getpid(), self.count))
+        try:
+            os.rename(path, trashPath)
+        except OSError, e:
+            if e.errno != errno.EXDEV:
+                raise
+            if os.path.isdir(path) and not os.path.islink(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+
+    ###########################################################################
+    # Start deleting the contents of the trash in the background.  The
+    # deleter is detached from us (and our process group), so it finishes
+    # even if we don't.
+    ###########################################################################
+    def empty(self):
+        if not os.path.isdir(self.trashDir) or \
+               len(os.listdir(self.trashDir)) == 0:
+            return
+        rm = "rm -rf"
+        if self.ioClass is not None and self.ioClass != "none" and \
+               findExecutable("ionice") is not None:
+            rm = "ionice -c %d %s" % (ioniceClasses[self.ioClass], rm)
+        if self.niceness is not None:
+            rm = "nice -n %d %s" % (int(self.niceness), rm)
+        script = "find %s -mindepth 1 -maxdepth 1 -print0 | " \
+                 "xargs -0 -n 1 -P %d %s" % (pipes.quote(self.trashDir),
+                                             self.concurrency, rm)
+        # the shell exits right away, leaving the deleter orphaned (so we
+        # don't have to reap it)
+        devNull = open(os.devnull, "r+")
+        try:
+            subprocess.Popen(["/bin/sh", "-c", "(%s) &" % script],
+                             stdin=devNull, stdout=devNull, stderr=devNull,
+                             preexec_fn=os.setsid, close_fds=True).wait()
+        finally:
+            devNull.close()
+
+ioniceClasses = { "realtime" : 1, "best-effort" : 2, "idle" : 3 }
+
+def findExecutable(name):
+    for dirPath in os.environ.get("PATH", "").split(os.pathsep):
+        path = os.path.join(dirPath, name)
+        if os.path.isfile(path) and os.access(path, os.X_OK):
+            return path
+    return None
@@ -0,0 +1,101 @@
+
+# Progressive Cactus Package
+# Copyright (C) 2009-2013 by Glenn Hickey (hickey@soe.ucsc.edu)
+# and Benedict Paten (benedictpaten@gmail.com)
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import pytest
+
+from compactTree import CompactTree, parseNewick, writeNewick
+
+def leafNames(tree):
+    return [tree.getName(x) for x in tree.postOrderTraversal()
+            if tree.isLeaf(x)]
+
+@pytest.mark.parametrize("newick", [
+    "((human:0.006,chimp:0.006667)hc:0.0022,gorilla:0.008825)root;",
+    "(a,b,(c,d));",
+    "(a:1.5,(b:0.25,c:2)bc:1e-05);",
+    "leaf;",
+    "((((a,b),c),d),e);"])
+def test_roundTrip(newick):
+    tree = parseNewick(newick)
+    assert writeNewick(parseNewick(writeNewick(tree))) == writeNewick(tree)
+    # labels and lengths survive as they were
+    again = parseNewick(writeNewick(tree))
+    assert again.names == tree.names
+    assert again.weights == tree.weights
+    assert again.parents == tree.parents
+
+def test_parseStructure():
+    tree = parseNewick("((a:1,b:2)ab:3,c:4)r;")
+    root = tree.getRootId()
+    assert tree.getName(root) == "r"
+    assert not tree.hasParent(root)
+    ab, c = tree.getChildren(root)
+    assert tree.getName(ab) == "ab"
+    assert tree.getWeight(root, ab) == 3.
+    assert tree.getWeight(root, c) == 4.
+    assert leafNames(tree) == ["a", "b", "c"]
+    assert tree.getWeight(root, tree.getChildren(ab)[0]) is None
+
+def test_whitespaceAndMissingLengths():
+    tree = parseNewick(" ( a , b:2 ) ; \n")
+    assert leafNames(tree) == ["a", "b"]
+    a, b = tree.getChildren(tree.getRootId())
+    assert tree.getWeight(tree.getRootId(), a, 1.) == 1.
+    assert tree.getWeight(tree.getRootId(), b) == 2.
+
+def test_deepTree():
+    # far deeper than the recursion limit
+    depth = 5000
+    newick = "(" * depth + "a" + "".join([",x%d)" % i for i in
+                                          xrange(depth)]) + ";"
+    tree = parseNewick(newick)
+    assert tree.size() == 2 * depth + 1
+    assert writeNewick(tree) == newick
+
+@pytest.mark.parametrize("newick", [
+    "((a,b);",
+    "(a,b));",
+    "(a,b);(c,d);",
+    "(a,b); junk",
+    "(a:,b);",
+    "(a:1:2,b);",
+    "(a:x,b);",
+    "(a:1 b,c);",
+    "(a,b)c(d,e);",
+    ";",
+    ""])
+def test_rejectsInvalid(newick):
+    with pytest.raises(RuntimeError):
+        parseNewick(newick)
+
+def test_writeSortedChildren():
+    tree = parseNewick("(c,(b,a)x);")
+    assert writeNewick(tree, lambda node, s: s) == "((a,b)x,c);"
+
+def test_prune():
+    tree = parseNewick("((a:1,b:2)ab:3,(c:4,d:5)cd:6)r;")
+    removed = tree.prune(lambda node: tree.getName(node) not in ["c", "d"])
+    assert sorted(removed) == ["c", "d"]
+    assert writeNewick(tree) == "((a:1.0,b:2.0)ab:3.0)r;"
+
+def test_oneRoot():
+    tree = CompactTree()
+    tree.addNode()
+    with pytest.raises(RuntimeError):
+        tree.addNode()
@@ -0,0 +1,47 @@
+
+# Progressive Cactus Package
+# Copyright (C) 2009-2013 by Glenn Hickey (hickey@soe.ucsc.edu)
+# and Benedict Paten (benedictpaten@gmail.com)
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import pytest
+
+from costModel import parseBytes, ktTuning, ktBytesPerBase
+
+@pytest.mark.parametrize("sizeString, expected", [
+    ("0", 0),
+    ("1234", 1234),
+    (1234, 1234),
+    ("1k", 1024),
+    ("500m", 500 * 1024 ** 2),
+    ("50g", 50 * 1024 ** 3),
+    ("50G", 50 * 1024 ** 3),
+    (" 2t ", 2 * 1024 ** 4),
+    ("1.5g", int(1.5 * 1024 ** 3))])
+def test_parseBytes(sizeString, expected):
+    assert parseBytes(sizeString) == expected
+
+@pytest.mark.parametrize("sizeString", ["", "g", "10x", "ten", "1.5", "5gb"])
+def test_parseBytesRejects(sizeString):
+    with pytest.raises(RuntimeError):
+        parseBytes(sizeString)
+
+def test_ktTuning():
+    bnum, msiz = ktTuning(3 * 10 ** 9)
+    assert msiz == 3 * 10 ** 9 * ktBytesPerBase
+    assert bnum > 0
+    # tiny inputs still get a usable bucket count
+    assert ktTuning(0)[0] > 0
@@ -0,0 +1,121 @@
+
+# Progressive Cactus Package
+# Copyright (C) 2009-2013 by Glenn Hickey (hickey@soe.ucsc.edu)
+# and Benedict Paten (benedictpaten@gmail.com)
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import gzip
+
+import pytest
+
+from fastaStats import FastaScanner, scanFile, scanSequence, readChunks
+from fastaStats import sequenceSignature
+
+fasta = (">chr1 first contig\nACGTacgtNN\nnnAC\n"
+         ">chr2\nNNNNacgt\n"
+         ">empty\n"
+         ">chr3 last\nAAAAAAAAAA")
+
+def contigCounts(contigs):
+    return [(x.name, x.length, x.masked, x.ns) for x in contigs]
+
+def scan(chunks):
+    scanner = FastaScanner(contigs=True)
+    for chunk in chunks:
+        scanner.update(chunk)
+    total = scanner.finish()
+    return (total.length, total.masked, total.ns), \
+           contigCounts(scanner.contigs)
+
+expected = ((32, 10, 8),
+            [("chr1", 14, 6, 4), ("chr2", 8, 4, 4), ("empty", 0, 0, 0),
+             ("chr3", 10, 0, 0)])
+
+def test_wholeFile():
+    assert scan([fasta]) == expected
+
+@pytest.mark.parametrize("size", range(1, 12))
+def test_chunkBoundaries(size):
+    # chunks break everywhere: in headers, right before and after >, and
+    # between the \n and the sequence
+    chunks = [fasta[i:i + size] for i in xrange(0, len(fasta), size)]
+    assert scan(chunks) == expected
+
+def test_headerSplitAtEveryPosition():
+    for split in xrange(len(fasta) + 1):
+        assert scan([fasta[:split], fasta[split:]]) == expected
+
+def test_headerWithoutNewlineAtEnd():
+    totals, contigs = scan([">a\nAC\n>last"])
+    assert totals == (2, 0, 0)
+    assert contigs == [("a", 2, 0, 0), ("last", 0, 0, 0)]
+
+def test_fractions():
+    scanner = FastaScanner()
+    scanner.update(fasta)
+    total = scanner.finish()
+    assert total.maskedFraction() == pytest.approx(10. / 32)
+    assert total.nFraction() == pytest.approx(8. / 32)
+    assert FastaScanner().finish().nFraction() == 0.
+
+@pytest.mark.parametrize("size", [1, 3, 7, 1024])
+def test_plainAndGzippedMatch(tmpdir, size):
+    plainPath = str(tmpdir.join("seq.fa"))
+    gzPath = str(tmpdir.join("seq.fa.gz"))
+    open(plainPath, "w").write(fasta)
+    gzFile = gzip.open(gzPath, "wb")
+    gzFile.write(fasta)
+    gzFile.close()
+    for path in [plainPath, gzPath]:
+        total, contigs = scanFile(path, contigs=True, size=size)
+        assert (total.length, total.masked, total.ns) == expected[0]
+        assert contigCounts(contigs) == expected[1]
+        assert "".join(readChunks(path, size)) == fasta
+
+def test_concatenatedGzipMembers(tmpdir):
+    # what bgzip writes
+    path = str(tmpdir.join("seq.fa.gz"))
+    half = len(fasta) / 2
+    for part, mode in [(fasta[:half], "wb"), (fasta[half:], "ab")]:
+        gzFile = gzip.open(path, mode)
+        gzFile.write(part)
+        gzFile.close()
+    total = scanFile(path, size=5)[0]
+    assert (total.length, total.masked, total.ns) == expected[0]
+
+def test_emptyFile(tmpdir):
+    path = str(tmpdir.join("empty.fa"))
+    open(path, "w").close()
+    total = scanFile(path)[0]
+    assert total.length == 0
+    assert list(readChunks(path)) == []
+
+def test_directory(tmpdir):
+    tmpdir.join("b.fa").write(">b\nacgt\n")
+    tmpdir.join("a.fa").write(">a\nNNNN\n")
+    tmpdir.join(".hidden").write(">h\nAAAA\n")
+    total, fileStats, contigs = scanSequence(str(tmpdir), contigs=True)
+    assert (total.length, total.masked, total.ns) == (8, 4, 4)
+    assert [x.name for x in contigs] == ["a", "b"]
+    assert len(fileStats) == 2
+
+def test_signatureChangesWithSize(tmpdir):
+    path = tmpdir.join("seq.fa")
+    path.write(">a\nACGT\n")
+    before = sequenceSignature(str(path))
+    assert sequenceSignature(str(path)) == before
+    path.write(">a\nACGTACGT\n")
+    assert sequenceSignature(str(path)) != before
@@ -0,0 +1,131 @@
+
+# Progressive Cactus Package
+# Copyright (C) 2009-2013 by Glenn Hickey (hickey@soe.ucsc.edu)
+# and Benedict Paten (benedictpaten@gmail.com)
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import os
+import socket
+import subprocess
+
+import pytest
+
+from portAllocator import PortAllocator, PortReservation, portInUse
+
+# a port with a few free ones above it (probably: nothing stops another
+# process from taking them while the test runs)
+def freeBase(count=16):
+    for attempt in xrange(20):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.bind(("", 0))
+        port = sock.getsockname()[1]
+        sock.close()
+        if port + count < 65535 and len([x for x in xrange(port, port + count)
+                                         if portInUse(x)]) == 0:
+            return port
+    pytest.skip("no free block of ports found")
+
+def deadPid():
+    process = subprocess.Popen(["true"])
+    process.wait()
+    return process.pid
+
+@pytest.fixture
+def allocator(tmpdir):
+    return PortAllocator(str(tmpdir.join("locks")))
+
+def test_reserve(allocator, tmpdir):
+    base = freeBase()
+    reservation = allocator.reserve(base, 4, str(tmpdir))
+    assert (reservation.firstPort, reservation.lastPort) == (base, base + 3)
+    assert reservation.ports() == range(base, base + 4)
+    assert reservation.pid == os.getpid()
+    # the lock file is what keeps other runs away
+    held = PortReservation.readFile(reservation.lockPath)
+    assert held.toDict() == reservation.toDict()
+    assert [x.toDict() for x in allocator.reservations()] == \
+           [reservation.toDict()]
+
+def test_reservationsDontOverlap(allocator, tmpdir):
+    base = freeBase()
+    first = allocator.reserve(base, 4, str(tmpdir.join("a")))
+    second = allocator.reserve(base, 4, str(tmpdir.join("b")))
+    assert not second.overlaps(first.firstPort, first.lastPort)
+    assert second.firstPort == first.lastPort + 1
+
+def test_releaseAllowsReuse(allocator, tmpdir):
+    base = freeBase()
+    first = allocator.reserve(base, 4, str(tmpdir))
+    allocator.release(first)
+    assert not os.path.exists(first.lockPath)
+    again = allocator.reserve(base, 4, str(tmpdir))
+    assert again.firstPort == first.firstPort
+
+def test_releaseLeavesOtherOwners(allocator, tmpdir):
+    base = freeBase()
+    reservation = allocator.reserve(base, 4, str(tmpdir))
+    # someone else has since taken over the lock file
+    other = PortReservation(reservation.firstPort, reservation.lastPort,
+                            str(tmpdir), pid=os.getpid() + 1,
+                            host="elsewhere",
+                            lockPath=reservation.lockPath)
+    other.write(reservation.lockPath)
+    allocator.release(reservation)
+    assert os.path.exists(reservation.lockPath)
+
+def test_skipsPortsInUse(allocator, tmpdir):
+    base = freeBase()
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        sock.bind(("", base + 1))
+        sock.listen(1)
+        reservation = allocator.reserve(base, 3, str(tmpdir))
+        assert reservation.firstPort >= base + 2
+    finally:
+        sock.close()
+
+def test_staleReservationCleanedUp(allocator, tmpdir):
+    base = freeBase()
+    stale = PortReservation(base, base + 3, str(tmpdir), pid=deadPid())
+    stale.lockPath = os.path.join(allocator.lockDir,
+                                  "ports.%d-%d.json" % (base, base + 3))
+    stale.write(stale.lockPath)
+    reservation = allocator.reserve(base, 4, str(tmpdir))
+    assert reservation.firstPort == base
+    assert PortReservation.readFile(reservation.lockPath).pid == os.getpid()
+
+def test_otherHostsRespected(allocator, tmpdir):
+    # we can't tell if a run on another machine is still alive
+    base = freeBase()
+    remote = PortReservation(base, base + 3, str(tmpdir), pid=deadPid(),
+                             host="some-other-host")
+    remote.write(os.path.join(allocator.lockDir,
+                              "ports.%d-%d.json" % (base, base + 3)))
+    reservation = allocator.reserve(base, 4, str(tmpdir))
+    assert reservation.firstPort == base + 4
+
+def test_noRoomLeft(allocator, tmpdir):
+    base = freeBase()
+    allocator.reserve(base, 4, str(tmpdir))
+    with pytest.raises(RuntimeError):
+        allocator.reserve(base, 4, str(tmpdir), highest=base + 6)
+
+def test_workDirRecord(tmpdir):
+    assert PortReservation.read(str(tmpdir)) is None
+    reservation = PortReservation(2000, 2003, str(tmpdir))
+    reservation.write(str(tmpdir.join(PortReservation.fileName)))
+    assert PortReservation.read(str(tmpdir)).toDict() == \
+           reservation.toDict()
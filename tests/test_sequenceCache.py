@@ -0,0 +1,94 @@
+
+# Progressive Cactus Package
+# Copyright (C) 2009-2013 by Glenn Hickey (hickey@soe.ucsc.edu)
+# and Benedict Paten (benedictpaten@gmail.com)
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import os
+import json
+
+import pytest
+
+import sequenceCache
+from sequenceCache import SequenceCache, cacheKey, digestSequence
+
+# a clock that moves on by a second every time it's read, so entries
+# never tie on last use
+@pytest.fixture(autouse=True)
+def clock(monkeypatch):
+    now = [1000.]
+    def tick():
+        now[0] += 1.
+        return now[0]
+    monkeypatch.setattr(sequenceCache.time, "time", tick)
+
+def makeFile(tmpdir, name, size):
+    path = tmpdir.join(name)
+    path.write("A" * size)
+    return str(path)
+
+def cachedKeys(cache):
+    return sorted(json.load(open(cache.indexPath))["entries"].keys())
+
+def test_storeAndFetch(tmpdir):
+    cache = SequenceCache(str(tmpdir.join("cache")))
+    cache.store("k1", makeFile(tmpdir, "one.fa", 10))
+    outPath = str(tmpdir.join("out.fa"))
+    assert cache.fetch("k1", outPath) is True
+    assert open(outPath).read() == "A" * 10
+    assert cache.fetch("missing", str(tmpdir.join("nope.fa"))) is False
+    assert not os.path.exists(str(tmpdir.join("nope.fa")))
+
+def test_leastRecentlyUsedEvicted(tmpdir):
+    cache = SequenceCache(str(tmpdir.join("cache")), maxBytes=25)
+    cache.store("a", makeFile(tmpdir, "a.fa", 10))
+    cache.store("b", makeFile(tmpdir, "b.fa", 10))
+    # using a makes b the oldest
+    assert cache.fetch("a", str(tmpdir.join("out.fa"))) is True
+    cache.store("c", makeFile(tmpdir, "c.fa", 10))
+    assert cachedKeys(cache) == ["a", "c"]
+    assert not os.path.exists(os.path.join(cache.objectDir, "b"))
+    assert os.path.exists(os.path.join(cache.objectDir, "a"))
+
+def test_evictsUntilUnderBudget(tmpdir):
+    cache = SequenceCache(str(tmpdir.join("cache")), maxBytes=30)
+    for name in ["a", "b", "c"]:
+        cache.store(name, makeFile(tmpdir, "%s.fa" % name, 10))
+    cache.store("big", makeFile(tmpdir, "big.fa", 25))
+    assert cachedKeys(cache) == ["big"]
+
+def test_newestKeptEvenIfTooBig(tmpdir):
+    cache = SequenceCache(str(tmpdir.join("cache")), maxBytes=5)
+    cache.store("a", makeFile(tmpdir, "a.fa", 10))
+    assert cachedKeys(cache) == ["a"]
+
+def test_noLimit(tmpdir):
+    cache = SequenceCache(str(tmpdir.join("cache")))
+    for name in ["a", "b", "c"]:
+        cache.store(name, makeFile(tmpdir, "%s.fa" % name, 1000))
+    assert cachedKeys(cache) == ["a", "b", "c"]
+
+def test_digests(tmpdir):
+    cache = SequenceCache(str(tmpdir.join("cache")))
+    one = makeFile(tmpdir, "one.fa", 10)
+    two = makeFile(tmpdir, "two.fa", 20)
+    digests = cache.digests([one, two])
+    assert digests[one] == digestSequence(one)
+    assert digests[one] != digests[two]
+    # same content, different path: same digest
+    copy = makeFile(tmpdir, "copy.fa", 10)
+    assert cache.digests([copy])[copy] == digests[one]
+    assert cacheKey(digests[one], "config") != cacheKey(digests[one], "other")